@@ -1,5 +1,6 @@
 from .workbook import Workbook
+from .threadsafe_workbook import ThreadSafeWorkbook
 from .cellerror import CellError, CellErrorType
 version = "1.3"
 
-__all__ = ['Workbook', 'CellError', 'CellErrorType']
+__all__ = ['Workbook', 'ThreadSafeWorkbook', 'CellError', 'CellErrorType']
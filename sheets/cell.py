@@ -6,10 +6,9 @@ from decimal import Decimal, InvalidOperation
 
 class Cell:
     def __init__(self, sheet_name, loc, contents=None):
-        # For cell dependencies
-        self._parent_cells = []  # Cells that new cell depends on
-        self._children_cells = []  # Cells that depend on new cell
         self._formula_cell_flag = False
+        # Closure computing the value of a formula cell (see formula_compiler)
+        self._compiled_formula = None
         self._contents = contents
         # Check if cell is empty string, and set cell to None type
         if not contents or contents == "" or len(contents) == 0:
@@ -41,27 +40,18 @@ class Cell:
     def get_contents(self):
         return self._contents
 
-    def get_parent_cells(self):
-        return self._parent_cells
-
-    def set_parent_cells(self, parent_cells):
-        self._parent_cells = parent_cells
-
-    def get_children_cells(self):
-        return self._children_cells
-
-    def set_children_cells(self, children_cells):
-        self._children_cells = children_cells
-
-    def append_child_cell(self, child):
-        self._children_cells.append(child)
-
     def get_formula_cell_flag(self):
         return self._formula_cell_flag
 
     def set_formula_cell_flag(self, flag):
         self._formula_cell_flag = flag
 
+    def get_compiled_formula(self):
+        return self._compiled_formula
+
+    def set_compiled_formula(self, compiled_formula):
+        self._compiled_formula = compiled_formula
+
     def get_value(self):
         return self._value
 
@@ -23,3 +23,13 @@ class CellErrorType(enum.Enum):
 
     # A divide-by-zero was encountered during evaluation ("#DIV/0!")
     DIVIDE_BY_ZERO = 6
+
+
+# Map between the literal string error and the CellErrorType
+ERROR_TYPES = {"#ERROR!": CellErrorType.PARSE_ERROR,
+               "#CIRCREF!": CellErrorType.CIRCULAR_REFERENCE,
+               "#REF!": CellErrorType.BAD_REFERENCE,
+               "#NAME?": CellErrorType.BAD_NAME,
+               "#VALUE!": CellErrorType.TYPE_ERROR,
+               "#DIV/0!": CellErrorType.DIVIDE_BY_ZERO
+               }
@@ -0,0 +1,75 @@
+from .cellerror import CellError
+from .cellerrortype import CellErrorType, ERROR_TYPES
+from .formula_references import loc_str, range_loc
+
+
+class EvaluationContext:
+    # What a compiled formula (see formula_compiler) reads while it runs: the
+    # values of the cells it references, the default sheet and origin of the
+    # cell being evaluated.  It also records the cells and ranges the formula
+    # read, which become the parents of the cell in the DependencyGraph.
+    def __init__(self, wb):
+        self._wb = wb
+        self._default_sheet = ""
+        # (row, col) of the cell whose formula is being evaluated
+        self._origin = None
+        # Parent cells of the cell whose formula is being evaluated
+        self._parent_cells = set()
+
+    def new_parsing(self, sheet_name, origin=None):
+        # Start evaluating a formula of sheet_name, in the cell at origin
+        self._default_sheet = sheet_name
+        self._origin = origin
+        self._parent_cells = set()
+
+    def get_origin(self):
+        return self._origin
+
+    def get_parent_cells(self):
+        return self._parent_cells
+
+    def lookup(self, sheet, loc):
+        # Return the value of the cell at loc (upper case, no "$", within the
+        # sheet bounds) and record it as a parent cell.  A sheet of None is
+        # the default sheet.  Compiled formulas call this for every reference.
+        if sheet is None:
+            sheet = self._default_sheet
+        self._parent_cells.add((sheet.lower(), loc))
+
+        # Get the value of the cell straight from its sheet
+        sheet_idx = self._wb.sheet_to_idx.get(sheet.lower())
+        if sheet_idx is None:
+            e = KeyError(f"{sheet} is not a valid sheet!")
+            return CellError(CellErrorType.BAD_REFERENCE, detail=f"{e}")
+        return self._cell_value(self._wb.sheets[sheet_idx].get_cells().get(loc))
+
+    def lookup_range(self, sheet, top, left, bottom, right):
+        # Return the values of the cells from (top, left) to (bottom, right)
+        # in row-major order, and record the range as a single parent (see
+        # DependencyGraph) rather than each of its cells
+        if sheet is None:
+            sheet = self._default_sheet
+        self._parent_cells.add((sheet.lower(), range_loc(top, left, bottom, right)))
+
+        sheet_idx = self._wb.sheet_to_idx.get(sheet.lower())
+        if sheet_idx is None:
+            e = KeyError(f"{sheet} is not a valid sheet!")
+            error = CellError(CellErrorType.BAD_REFERENCE, detail=f"{e}")
+            return [error] * ((bottom - top + 1) * (right - left + 1))
+        cells = self._wb.sheets[sheet_idx].get_cells()
+        return [self._cell_value(cells.get(loc_str(row, col)))
+                for row in range(top, bottom + 1)
+                for col in range(left, right + 1)]
+
+    def _cell_value(self, cell):
+        # Value of a cell read by a formula
+        if cell is None:
+            return None
+        val = cell.get_value()
+
+        # If the value is a literal cell error, return the respective error
+        if type(val) is str:
+            p = val.upper()
+            if p in ERROR_TYPES:
+                val = CellError(ERROR_TYPES[p], detail=f"{p}")
+        return val
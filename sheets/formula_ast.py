@@ -0,0 +1,153 @@
+from decimal import Decimal
+from .cellerrortype import ERROR_TYPES
+from .formula_references import ref_position, unquote_sheet_name
+
+# Compact AST for formulas.  A Lark parse tree is converted into these nodes
+# once, by to_ast, and the nodes are what the parse cache stores and what the
+# compiler and the reference extraction work on.
+#
+# Nodes are immutable and use __slots__, so they have no per-instance dict.
+# Literals are already converted (Decimal numbers, unquoted strings, bools,
+# CellErrorType errors) and references are already resolved to positions:
+# a position is a (row, col, row_abs, col_abs) tuple, where the _abs flags
+# are True for the parts written with "$" (see
+# formula_references.ref_position).
+
+
+class Node:
+    # Base class of the AST nodes.  Subclasses list their fields in
+    # __slots__ and name the compiler method handling them in kind.
+    __slots__ = ()
+    kind = None
+
+    def __init__(self, *fields):
+        for name, value in zip(self.__slots__, fields):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} nodes are immutable")
+
+    def fields(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.fields() == other.fields()
+
+    def __hash__(self):
+        return hash((type(self),) + self.fields())
+
+    def __reduce__(self):
+        return type(self), self.fields()
+
+    def __repr__(self):
+        return f"{type(self).__name__}{self.fields()!r}"
+
+
+class Number(Node):
+    __slots__ = ("value",)
+    kind = "number"
+
+
+class String(Node):
+    __slots__ = ("value",)
+    kind = "string"
+
+
+class Bool(Node):
+    __slots__ = ("value",)
+    kind = "bool"
+
+
+class Error(Node):
+    # An error literal; text is the literal as written
+    __slots__ = ("error_type", "text")
+    kind = "error"
+
+
+class CellRef(Node):
+    # sheet is the unquoted sheet name, or None for the formula's own sheet
+    __slots__ = ("sheet", "position")
+    kind = "cell"
+
+
+class CellRange(Node):
+    # start and end are the positions of the two corners as written
+    __slots__ = ("sheet", "start", "end")
+    kind = "cell_range"
+
+
+class UnaryOp(Node):
+    __slots__ = ("op", "operand")
+    kind = "unary_op"
+
+
+class AddOp(Node):
+    __slots__ = ("op", "left", "right")
+    kind = "add_expr"
+
+
+class MulOp(Node):
+    __slots__ = ("op", "left", "right")
+    kind = "mul_expr"
+
+
+class Concat(Node):
+    __slots__ = ("left", "right")
+    kind = "concat_expr"
+
+
+class Compare(Node):
+    __slots__ = ("op", "left", "right")
+    kind = "compare_expr"
+
+
+class Call(Node):
+    # name is upper case; args is a tuple of nodes
+    __slots__ = ("name", "args")
+    kind = "function_expr"
+
+
+def _reference(children):
+    # (sheet, reference text) of a cell or cell_range tree
+    if len(children) == 2:
+        return unquote_sheet_name(str(children[0])), str(children[1])
+    return None, str(children[0])
+
+
+def to_ast(tree):
+    # Convert a Lark parse tree of a formula (either grammar) into AST nodes
+    data = tree.data
+    children = tree.children
+    if data == "number":
+        return Number(Decimal(children[0].value))
+    if data == "string":
+        s = str(children[0])
+        return String(s[1:-1] if s[0] == '"' and s[-1] == '"' else s)
+    if data == "bool":
+        return Bool(children[0].lower() != "false")
+    if data == "error":
+        return Error(ERROR_TYPES[children[0].upper()], str(children[0]))
+    if data == "parens":
+        return to_ast(children[0])
+    if data == "cell":
+        sheet, ref = _reference(children)
+        return CellRef(sheet, ref_position(ref))
+    if data == "cell_range":
+        sheet, refs = _reference(children)
+        start, end = refs.split(":")
+        return CellRange(sheet, ref_position(start), ref_position(end))
+    if data == "unary_op":
+        return UnaryOp(str(children[0]), to_ast(children[1]))
+    if data == "add_expr":
+        return AddOp(str(children[1]), to_ast(children[0]), to_ast(children[2]))
+    if data == "mul_expr":
+        return MulOp(str(children[1]), to_ast(children[0]), to_ast(children[2]))
+    if data == "concat_expr":
+        return Concat(to_ast(children[0]), to_ast(children[1]))
+    if data == "compare_expr":
+        return Compare(str(children[1]), to_ast(children[0]), to_ast(children[2]))
+    if data == "function_expr":
+        arg_list = children[1]
+        args = arg_list.children if arg_list.data == "arg_list" else [arg_list]
+        return Call(str(children[0]).upper(), tuple(to_ast(arg) for arg in args))
+    raise ValueError(f"Unexpected {data} in formula tree")
@@ -0,0 +1,389 @@
+import re
+from decimal import Decimal, DecimalException
+from .cellerror import CellError
+from .cellerrortype import CellErrorType, ERROR_TYPES
+from .helper import compare_helper
+from .functions import args_to_bool, args_to_num
+from .formula_ast import CellRange, String
+from .formula_references import (anchor, in_range, loc_str, ref_position,
+                                 unquote_sheet_name)
+
+_FALSE_PATTERN = re.compile("[Ff][Aa][Ll][Ss][Ee]")
+_TRUE_PATTERN = re.compile("[Tt][Rr][Uu][Ee]")
+
+# Functions that decide themselves which of their arguments get evaluated
+_LAZY_FUNCTIONS = ["IF", "IFERROR", "CHOOSE", "INDIRECT", "VLOOKUP", "HLOOKUP"]
+
+
+def _literal_error(val):
+    # Convert a literal error string to its CellError, or return None
+    if type(val) is str and val in ERROR_TYPES:
+        return CellError(ERROR_TYPES[val], detail=val)
+    return None
+
+
+def _to_decimal(val):
+    # Convert an operand to a finite Decimal, raising ValueError otherwise
+    val = Decimal(val) if val is not None else Decimal(0)
+    if not val.is_finite():
+        raise ValueError("Cannot use Inf/Nan to compute!")
+    return val
+
+
+def _numeric_operands(l_val, r_val):
+    # Return (error, l_val, r_val) with the operands converted to Decimals.
+    # error is the CellError the expression evaluates to, if any.
+    if isinstance(l_val, CellError):
+        return l_val, None, None
+    if isinstance(r_val, CellError):
+        return r_val, None, None
+
+    error = _literal_error(r_val) or _literal_error(l_val)
+    if error is not None:
+        return error, None, None
+
+    try:
+        return None, _to_decimal(l_val), _to_decimal(r_val)
+    except (DecimalException, ValueError, TypeError):
+        return CellError(CellErrorType.TYPE_ERROR,
+                         detail="arithmetic with illegal values"), None, None
+
+
+def _concat_operand(val):
+    # String form of a concatenation operand
+    val = str(val) if val is not None else ""
+    if _FALSE_PATTERN.match(val) is not None:
+        val = _FALSE_PATTERN.sub("FALSE", val)
+    if _TRUE_PATTERN.match(val) is not None:
+        val = _TRUE_PATTERN.sub("TRUE", val)
+    return val
+
+
+def _constant(value):
+    def constant(context):
+        return value
+    return constant
+
+
+def _error(error_type, detail):
+    # Closure that evaluates to a new CellError of the given type
+    def error(context):
+        return CellError(error_type, detail=detail)
+    return error
+
+
+class FormulaCompiler:
+    # Compiles a formula AST (see formula_ast) into a nested Python closure,
+    # once, when the formula is set.  Recalculating the cell then calls the closure
+    # instead of walking the tree again.
+    #
+    # A compiled formula takes the EvaluationContext evaluating it, which
+    # provides the cell lookups, the default sheet and the set of parent
+    # cells, and returns the value of the formula.
+    def __init__(self, functions):
+        self._functions = functions
+        self._origin = None
+
+    def compile(self, node, origin=None):
+        # Return the closure computing the value of the AST node.  Given the (row, col)
+        # origin of the formula's cell, relative references are compiled as
+        # offsets from the cell being evaluated (EvaluationContext.get_origin), so
+        # the closure can be shared by every cell whose formula has the same
+        # R1C1 form (see formula_templates).
+        self._origin = origin
+        return self._compile(node)
+
+    def _compile(self, node):
+        return getattr(self, node.kind)(node)
+
+    def number(self, node):
+        return _constant(node.value)
+
+    def string(self, node):
+        return _constant(node.value)
+
+    def bool(self, node):
+        return _constant(node.value)
+
+    def error(self, node):
+        return _error(node.error_type, node.text)
+
+    def cell(self, node):
+        return self._cell_ref(node.sheet, node.position)
+
+    def _anchor(self, position, absolute=False):
+        # (row, col, row_rel, col_rel) of a position relative to the origin
+        # being compiled for (see formula_references.anchor)
+        return anchor(position, None if absolute else self._origin)
+
+    def _cell_ref(self, sheet, position, absolute=False):
+        # Closure looking up a single cell; sheet None is the default sheet
+        if not in_range(position):
+            return _error(CellErrorType.BAD_REFERENCE,
+                          f"{loc_str(position[0], position[1])} is out of range")
+        row, col, row_rel, col_rel = self._anchor(position, absolute)
+        if not (row_rel or col_rel):
+            loc = loc_str(row, col)
+
+            def cell(context):
+                return context.lookup(sheet, loc)
+            return cell
+
+        def relative_cell(context):
+            origin_row, origin_col = context.get_origin()
+            return context.lookup(sheet, loc_str(row + row_rel * origin_row,
+                                             col + col_rel * origin_col))
+        return relative_cell
+
+    def _range_bounds(self, node):
+        # Closure returning the (top row, left col, bottom row, right col) of
+        # a CellRange in the evaluated cell, or None when the range is out of
+        # bounds
+        if not (in_range(node.start) and in_range(node.end)):
+            return None
+        row1, col1, row1_rel, col1_rel = self._anchor(node.start)
+        row2, col2, row2_rel, col2_rel = self._anchor(node.end)
+        if not (row1_rel or col1_rel or row2_rel or col2_rel):
+            fixed = (min(row1, row2), min(col1, col2),
+                     max(row1, row2), max(col1, col2))
+
+            def bounds(context):
+                return fixed
+            return bounds
+
+        def relative_bounds(context):
+            origin_row, origin_col = context.get_origin()
+            top = row1 + row1_rel * origin_row
+            left = col1 + col1_rel * origin_col
+            bottom = row2 + row2_rel * origin_row
+            right = col2 + col2_rel * origin_col
+            return (min(top, bottom), min(left, right),
+                    max(top, bottom), max(left, right))
+        return relative_bounds
+
+    def cell_range(self, node):
+        # A range evaluates to the list of its values in row-major order
+        sheet = node.sheet
+        bounds = self._range_bounds(node)
+        if bounds is None:
+            return _error(CellErrorType.BAD_REFERENCE, "Range is out of bounds")
+
+        def cell_range(context):
+            return context.lookup_range(sheet, *bounds(context))
+        return cell_range
+
+    def add_expr(self, node):
+        left = self._compile(node.left)
+        right = self._compile(node.right)
+        subtract = node.op == "-"
+
+        def add_expr(context):
+            error, l_val, r_val = _numeric_operands(left(context), right(context))
+            if error is not None:
+                return error
+            return l_val - r_val if subtract else l_val + r_val
+        return add_expr
+
+    def mul_expr(self, node):
+        left = self._compile(node.left)
+        right = self._compile(node.right)
+        divide = node.op == "/"
+
+        def mul_expr(context):
+            error, l_val, r_val = _numeric_operands(left(context), right(context))
+            if error is not None:
+                return error
+            if divide:
+                if r_val == 0:
+                    return CellError(CellErrorType.DIVIDE_BY_ZERO, detail="can't divide by 0")
+                return l_val / r_val
+            return l_val * r_val
+        return mul_expr
+
+    def unary_op(self, node):
+        operand = self._compile(node.operand)
+        negate = node.op == "-"
+
+        def unary_op(context):
+            val = operand(context)
+            if isinstance(val, CellError):
+                return val
+            try:
+                val = _to_decimal(val)
+            except (DecimalException, ValueError, TypeError):
+                return CellError(CellErrorType.TYPE_ERROR, detail="unary_op with illegal values")
+            return -1 * val if negate else val
+        return unary_op
+
+    def concat_expr(self, node):
+        left = self._compile(node.left)
+        right = self._compile(node.right)
+
+        def concat_expr(context):
+            l_val = left(context)
+            r_val = right(context)
+            if isinstance(l_val, CellError):
+                return l_val
+            if isinstance(r_val, CellError):
+                return r_val
+            return _concat_operand(l_val) + _concat_operand(r_val)
+        return concat_expr
+
+    def compare_expr(self, node):
+        left = self._compile(node.left)
+        right = self._compile(node.right)
+        op = node.op
+
+        def compare_expr(context):
+            l_val = left(context)
+            r_val = right(context)
+            if isinstance(l_val, CellError):
+                return l_val
+            if isinstance(r_val, CellError):
+                return r_val
+            error = _literal_error(r_val) or _literal_error(l_val)
+            if error is not None:
+                return error
+            return compare_helper(l_val, r_val, op)
+        return compare_expr
+
+    def function_expr(self, node):
+        name = node.name
+        if name in _LAZY_FUNCTIONS:
+            return getattr(self, name)(node.args)
+
+        args = [self._compile(arg) for arg in node.args]
+        function = self._functions.get(name)
+        if function is None:
+            return _error(CellErrorType.BAD_NAME, f"{name} is not a function")
+
+        def function_expr(context):
+            # Ranges (and functions returning ranges) are spread into their values
+            values = []
+            for arg in args:
+                val = arg(context)
+                if isinstance(val, list):
+                    values.extend(val)
+                else:
+                    values.append(val)
+            try:
+                return function(*values)
+            except (ValueError, KeyError) as e:
+                if isinstance(e, KeyError):
+                    return CellError(CellErrorType.BAD_NAME, detail=e)
+                return CellError(CellErrorType.TYPE_ERROR, detail=e)
+        return function_expr
+
+    def IF(self, arg_nodes):
+        args = [self._compile(arg) for arg in arg_nodes]
+        if len(args) != 2 and len(args) != 3:
+            return _error(CellErrorType.TYPE_ERROR,
+                          "IF function takes exactly two or three arguments")
+        cond_arg, true_arg = args[0], args[1]
+        false_arg = args[2] if len(args) == 3 else _constant(False)
+
+        def IF(context):
+            try:
+                cond = args_to_bool([cond_arg(context)])[0]
+            except ValueError:
+                return CellError(CellErrorType.TYPE_ERROR,
+                                 detail="Cannot convert IF condition to boolean!")
+            return true_arg(context) if cond else false_arg(context)
+        return IF
+
+    def IFERROR(self, arg_nodes):
+        args = [self._compile(arg) for arg in arg_nodes]
+        if len(args) != 1 and len(args) != 2:
+            return _error(CellErrorType.TYPE_ERROR,
+                          "IFERROR function takes exactly one or two arguments")
+        value_arg = args[0]
+        error_arg = args[1] if len(args) == 2 else _constant("")
+
+        def IFERROR(context):
+            val = value_arg(context)
+            if isinstance(val, CellError):
+                return error_arg(context)
+            return val
+        return IFERROR
+
+    def CHOOSE(self, arg_nodes):
+        args = [self._compile(arg) for arg in arg_nodes]
+        if len(args) < 2:
+            return _error(CellErrorType.TYPE_ERROR,
+                          "CHOOSE function takes more than 2 arguments")
+
+        def CHOOSE(context):
+            try:
+                idx = args_to_num([args[0](context)])[0]
+            except ValueError:
+                return CellError(CellErrorType.TYPE_ERROR,
+                                 detail="Cannot convert CHOOSE index to numeric!")
+            if idx < 1 or idx > len(args) - 1:
+                return CellError(CellErrorType.TYPE_ERROR, detail="Index out of bounds")
+            return args[int(idx)](context)
+        return CHOOSE
+
+    def INDIRECT(self, arg_nodes):
+        # Only a string literal is accepted, so the reference is known here
+        if len(arg_nodes) != 1:
+            return _error(CellErrorType.TYPE_ERROR, "INDIRECT takes one argument")
+        if not isinstance(arg_nodes[0], String):
+            return _error(CellErrorType.PARSE_ERROR,
+                          "INDIRECT takes one argument surrounded by quotes")
+        sheet, ref = None, arg_nodes[0].value
+        if "!" in ref:
+            sheet, ref = ref.split("!")[:2]
+            sheet = unquote_sheet_name(sheet) if sheet else sheet
+        position = ref_position(ref)
+        if position is None:
+            return _error(CellErrorType.BAD_REFERENCE, f"{ref} is out of range")
+        return self._cell_ref(sheet, position, absolute=True)
+
+    def VLOOKUP(self, arg_nodes):
+        return self._lookup_function(arg_nodes, vertical=True)
+
+    def HLOOKUP(self, arg_nodes):
+        return self._lookup_function(arg_nodes, vertical=False)
+
+    def _lookup_function(self, args, vertical):
+        # VLOOKUP searches the first column of the range for the key and
+        # returns the idx-th column of that row; HLOOKUP searches the first
+        # row and returns the idx-th row of that column.
+        name = "VLOOKUP" if vertical else "HLOOKUP"
+        if len(args) != 3:
+            return _error(CellErrorType.TYPE_ERROR, f"{name} takes exactly three arguments")
+        if not isinstance(args[1], CellRange):
+            return _error(CellErrorType.TYPE_ERROR, f"{name} takes a cell range")
+        key_arg = self._compile(args[0])
+        idx_arg = self._compile(args[2])
+        sheet = args[1].sheet
+        bounds = self._range_bounds(args[1])
+        if bounds is None:
+            return _error(CellErrorType.BAD_REFERENCE, "Range is out of bounds")
+
+        def lookup_function(context):
+            top, left, bottom, right = bounds(context)
+            if vertical:
+                search = [loc_str(row, left) for row in range(top, bottom + 1)]
+                width = right - left + 1
+            else:
+                search = [loc_str(top, col) for col in range(left, right + 1)]
+                width = bottom - top + 1
+            key = key_arg(context)
+            try:
+                idx = int(idx_arg(context))
+            except (TypeError, ValueError, DecimalException):
+                return CellError(CellErrorType.TYPE_ERROR,
+                                 detail=f"Could not convert {name} index to number")
+            if idx < 1 or idx > width:
+                return CellError(CellErrorType.TYPE_ERROR,
+                                 detail=f"{idx} is not within the provided grid of cells!")
+            values = [context.lookup(sheet, loc) for loc in search]
+            for i, val in enumerate(values):
+                if val == key:
+                    if vertical:
+                        return context.lookup(sheet, loc_str(top + i, left + idx - 1))
+                    return context.lookup(sheet, loc_str(top + idx - 1, left + i))
+            return CellError(CellErrorType.TYPE_ERROR,
+                             detail=f"Could not find {key} in provided cells")
+        return lookup_function
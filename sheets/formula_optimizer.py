@@ -0,0 +1,113 @@
+from decimal import Decimal
+from .cellerror import CellError
+from .cellerrortype import CellErrorType
+from .functions import args_to_bool, args_to_num
+from .formula_ast import (AddOp, Bool, Call, Compare, Concat, Error, MulOp,
+                          Number, String, UnaryOp)
+
+# Constant folding, run on the AST of a formula when it is set, before the
+# formula is compiled.  Subexpressions that don't read any cell are evaluated
+# once, with the compiler itself so that the results are exactly what
+# evaluating them would give, and replaced by a literal.  IF, IFERROR and
+# CHOOSE with a constant condition or index are replaced by the argument they
+# would pick, which also drops the references of the other arguments from the
+# formula's dependencies.
+
+_LITERALS = (Number, String, Bool, Error)
+
+# Functions that are never evaluated here: INDIRECT and the lookups read
+# cells, and IF, IFERROR and CHOOSE are simplified instead
+_UNFOLDABLE = ("INDIRECT", "VLOOKUP", "HLOOKUP", "IF", "IFERROR", "CHOOSE")
+
+
+def fold_constants(node, compiler):
+    # Return node with its constant subexpressions folded, evaluating them
+    # with compiler (a FormulaCompiler)
+    if isinstance(node, UnaryOp):
+        operand = fold_constants(node.operand, compiler)
+        return _evaluate(UnaryOp(node.op, operand), compiler, operand)
+    if isinstance(node, (AddOp, MulOp, Compare)):
+        left = fold_constants(node.left, compiler)
+        right = fold_constants(node.right, compiler)
+        return _evaluate(type(node)(node.op, left, right), compiler, left, right)
+    if isinstance(node, Concat):
+        left = fold_constants(node.left, compiler)
+        right = fold_constants(node.right, compiler)
+        return _evaluate(Concat(left, right), compiler, left, right)
+    if isinstance(node, Call):
+        args = tuple(fold_constants(arg, compiler) for arg in node.args)
+        if node.name == "IF":
+            return _fold_if(node, args)
+        if node.name == "IFERROR":
+            return _fold_iferror(node, args)
+        if node.name == "CHOOSE":
+            return _fold_choose(node, args)
+        if node.name in _UNFOLDABLE:
+            return Call(node.name, args)
+        return _evaluate(Call(node.name, args), compiler, *args)
+    return node
+
+
+def _literal_value(node):
+    # Value a literal node evaluates to
+    if isinstance(node, Error):
+        return CellError(node.error_type, detail=node.text)
+    return node.value
+
+
+def _literal(value):
+    # Literal node evaluating to value, or None if there is none
+    if isinstance(value, bool):
+        return Bool(value)
+    if isinstance(value, Decimal):
+        return Number(value)
+    if isinstance(value, str):
+        return String(value)
+    if isinstance(value, CellError):
+        return Error(value.get_type(), str(value.get_detail()))
+    return None
+
+
+def _evaluate(node, compiler, *operands):
+    # Replace node by its value if all of its operands are literals
+    if not all(isinstance(operand, _LITERALS) for operand in operands):
+        return node
+    try:
+        literal = _literal(compiler.compile(node)(None))
+    except Exception:
+        # The node fails to evaluate: leave it for the compiled formula,
+        # which only evaluates it if it is reached
+        return node
+    return node if literal is None else literal
+
+
+def _fold_if(node, args):
+    if len(args) != 2 and len(args) != 3 or not isinstance(args[0], _LITERALS):
+        return Call(node.name, args)
+    try:
+        cond = args_to_bool([_literal_value(args[0])])[0]
+    except ValueError:
+        return Error(CellErrorType.TYPE_ERROR, "Cannot convert IF condition to boolean!")
+    if cond:
+        return args[1]
+    return args[2] if len(args) == 3 else Bool(False)
+
+
+def _fold_iferror(node, args):
+    if len(args) != 1 and len(args) != 2 or not isinstance(args[0], _LITERALS):
+        return Call(node.name, args)
+    if isinstance(args[0], Error):
+        return args[1] if len(args) == 2 else String("")
+    return args[0]
+
+
+def _fold_choose(node, args):
+    if len(args) < 2 or not isinstance(args[0], _LITERALS):
+        return Call(node.name, args)
+    try:
+        idx = args_to_num([_literal_value(args[0])])[0]
+    except ValueError:
+        return Call(node.name, args)
+    if idx < 1 or idx > len(args) - 1:
+        return Call(node.name, args)
+    return args[int(idx)]
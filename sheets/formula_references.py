@@ -0,0 +1,193 @@
+import re
+from functools import lru_cache
+from .helper import column_index_from_string
+
+# Static reference extraction.  The cells a formula depends on are found from
+# its AST alone, without evaluating it, so that a dependency graph can be
+# built before any cell is evaluated.
+#
+# References go through three forms:
+#  - extract_references(node): (sheet, start, end) positions as written
+#  - anchor_references(references, origin): position-independent anchors,
+#    shared by every cell using the same compiled template
+#  - reference_cells(anchored, origin, sheet): the (sheet, loc) cells and
+#    ranges the formula of the cell at origin depends on
+#
+# scan_references finds the references in the formula text instead, without
+# parsing it, for the code that rewrites or keys formulas by their text.
+
+_CELLREF = re.compile(r"^(\$?)([A-Za-z]+)(\$?)([0-9]+)$")
+
+# Kinds of the AST nodes with a left and a right operand
+_BINARY_KINDS = ("add_expr", "mul_expr", "concat_expr", "compare_expr")
+
+# Tokens of formula text that can contain something looking like a cell
+# reference.  String literals, quoted sheet names, error literals and names
+# are matched whole so that only real references are reported.  A reference
+# directly followed by "!" is a sheet name and one followed by "(" is a
+# function name.  The lexer terminals are in formulas_lalr.lark.
+_REFERENCE_TOKENS = re.compile(r"""
+      "[^"]*"
+    | (?:(?P<sheet>'[^']*'|[A-Za-z_][A-Za-z0-9_]*)\s*!\s*)?
+      (?P<start>\$?[A-Za-z]+\$?[1-9][0-9]*)
+      (?::(?P<end>\$?[A-Za-z]+\$?[1-9][0-9]*))?
+      (?![A-Za-z0-9_!(:]|\s*\()
+    | '[^']*'
+    | \#[A-Za-z0-9/]+[!?]
+    | [A-Za-z_][A-Za-z0-9_]*
+    """, re.VERBOSE)
+
+
+@lru_cache(maxsize=1 << 16)
+def loc_str(row, col):
+    # Get the string location from a row and column index
+    col_str = ""
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        col_str = chr(65 + remainder) + col_str
+    return col_str + str(row)
+
+
+def unquote_sheet_name(sheet):
+    # Sheet name of a reference without the quotes it may be written with
+    if sheet[0] == "'" and sheet[-1] == "'":
+        return sheet[1:-1]
+    return sheet
+
+
+def ref_position(ref):
+    # Position of a cell reference such as "$A1", or None if it is not one
+    match = _CELLREF.match(ref)
+    if match is None:
+        return None
+    return (int(match.group(4)), column_index_from_string(match.group(2)),
+            match.group(3) == "$", match.group(1) == "$")
+
+
+def _indirect_reference(args):
+    # (sheet, position) of INDIRECT with a single string literal argument,
+    # made absolute because INDIRECT does not move with the cell, or None
+    if len(args) != 1 or args[0].kind != "string":
+        return None
+    sheet, ref = None, args[0].value
+    if "!" in ref:
+        sheet, ref = ref.split("!")[:2]
+        sheet = unquote_sheet_name(sheet) if sheet else sheet
+    position = ref_position(ref)
+    if position is None:
+        return None
+    return sheet, (position[0], position[1], True, True)
+
+
+def scan_references(formula):
+    # Iterate over the cell references and ranges in formula text.  Yields a
+    # regex match for each one, with the groups "sheet" (the sheet name as
+    # written, or None), "start" and "end" (None for a single cell).
+    for match in _REFERENCE_TOKENS.finditer(formula):
+        if match.group("start") is not None:
+            yield match
+
+
+def split_ref(ref):
+    # (col_abs, col, row_abs, row) of a cell reference such as "$A1", where
+    # col_abs and row_abs are "$" or ""
+    match = _CELLREF.match(ref)
+    return match.group(1), match.group(2), match.group(3), int(match.group(4))
+
+
+def extract_references(node):
+    # Every cell and range referenced by a formula AST, in the order they
+    # appear.  Returns (sheet, start, end) triples where sheet is the
+    # unquoted sheet name, or None for the formula's own sheet, and start and
+    # end are positions (see formula_ast); for a single cell start is end.
+    # All arguments of IF, IFERROR and CHOOSE are included whichever one is
+    # taken, as is the literal argument of INDIRECT, so this is a superset of
+    # the cells that evaluating the formula reads.
+    #
+    # The nodes are told apart by their kind, as the compiler does, since
+    # formula_ast builds on the helpers of this module.
+    references = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        kind = node.kind
+        if kind == "cell":
+            references.append((node.sheet, node.position, node.position))
+        elif kind == "cell_range":
+            references.append((node.sheet, node.start, node.end))
+        elif kind == "function_expr":
+            if node.name == "INDIRECT":
+                reference = _indirect_reference(node.args)
+                if reference is not None:
+                    references.append((reference[0], reference[1], reference[1]))
+            stack.extend(reversed(node.args))
+        elif kind == "unary_op":
+            stack.append(node.operand)
+        elif kind in _BINARY_KINDS:
+            stack.append(node.right)
+            stack.append(node.left)
+    return references
+
+
+def in_range(position):
+    # Whether a position is inside the bounds of a sheet
+    return 1 <= position[0] <= 9999 and 1 <= position[1] <= 475254
+
+
+def anchor(position, origin=None):
+    # (row, col, row_rel, col_rel) of a position.  Relative to an origin
+    # (row, col), a row or column without "$" is stored as an offset from the
+    # origin and has its _rel flag set to 1, so that in the cell at
+    # (o_row, o_col) the reference is at
+    # (row + row_rel * o_row, col + col_rel * o_col).
+    row, col, row_abs, col_abs = position
+    if origin is None:
+        return row, col, 0, 0
+    row_rel = 0 if row_abs else 1
+    col_rel = 0 if col_abs else 1
+    return (row - row_rel * origin[0], col - col_rel * origin[1],
+            row_rel, col_rel)
+
+
+def anchor_references(references, origin):
+    # Anchor the references extracted from the formula of the cell at origin.
+    # Returns (sheet, start anchor, end anchor) triples.  References that are
+    # out of range are dropped since they never read a cell.
+    return tuple((sheet, anchor(start, origin), anchor(end, origin))
+                 for sheet, start, end in references
+                 if in_range(start) and in_range(end))
+
+
+def resolve_references(anchored, origin):
+    # (sheet, top, left, bottom, right) of each anchored reference in the cell
+    # at origin
+    o_row, o_col = origin
+    regions = []
+    for sheet, (row1, col1, row1_rel, col1_rel), (row2, col2, row2_rel, col2_rel) in anchored:
+        row1 += row1_rel * o_row
+        col1 += col1_rel * o_col
+        row2 += row2_rel * o_row
+        col2 += col2_rel * o_col
+        regions.append((sheet, min(row1, row2), min(col1, col2),
+                        max(row1, row2), max(col1, col2)))
+    return regions
+
+
+def range_loc(top, left, bottom, right):
+    # Location of the cells from (top, left) to (bottom, right), such as
+    # "A1:C9", or of the one cell such as "A1"
+    if top == bottom and left == right:
+        return loc_str(top, left)
+    return loc_str(top, left) + ":" + loc_str(bottom, right)
+
+
+def reference_cells(anchored, origin, sheet_name):
+    # Set of (lower case sheet name, location) of every cell and range
+    # referenced by the formula of the cell at origin on sheet_name.  A range
+    # is one location such as "A1:C9" (see DependencyGraph).
+    cells = set()
+    default_sheet = sheet_name.lower()
+    for sheet, top, left, bottom, right in resolve_references(anchored, origin):
+        sheet = default_sheet if sheet is None else sheet.lower()
+        cells.add((sheet, range_loc(top, left, bottom, right)))
+    return cells
@@ -0,0 +1,80 @@
+import re
+from .helper import column_index_from_string, column_string_from_index
+from .formula_references import scan_references, split_ref, unquote_sheet_name
+
+# Rewrites the references in formula text for rename_sheet, move_cells and
+# copy_cells.  The formula is scanned once for its references (see
+# formula_references.scan_references), only the sheet names and cell
+# references are replaced, and everything else is kept exactly as written, so
+# no parse is needed.
+
+# Sheet names that can be written without quotes
+_UNQUOTED_SHEET_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def quote_sheet_name(sheet_name):
+    # Sheet name as it should appear in a formula, quoted iff necessary
+    if _UNQUOTED_SHEET_NAME.match(sheet_name):
+        return sheet_name
+    return f"'{sheet_name}'"
+
+
+def rename_sheet_references(formula, sheet_name, new_sheet_name):
+    # Replace the sheet name of every reference to sheet_name (matched case
+    # insensitively) with new_sheet_name.  References without a sheet name
+    # are left alone.
+    sheet_name = sheet_name.lower()
+    new_sheet = quote_sheet_name(new_sheet_name)
+    pieces = []
+    pos = 0
+    for match in scan_references(formula):
+        sheet = match.group("sheet")
+        if sheet is None or unquote_sheet_name(sheet).lower() != sheet_name:
+            continue
+        pieces.append(formula[pos:match.start("sheet")])
+        pieces.append(new_sheet)
+        pos = match.end("sheet")
+    pieces.append(formula[pos:])
+    return "".join(pieces)
+
+
+def _shift_ref(ref, d_col, d_row):
+    # Shift the relative parts of a cell reference, or return None if it ends
+    # up outside the sheet.  Parts that don't move keep their case.
+    col_abs, col, row_abs, row = split_ref(ref)
+    if not row_abs:
+        row += d_row
+    if not col_abs and d_col:
+        col_index = column_index_from_string(col) + d_col
+        if col_index < 1 or col_index > 475254:
+            return None
+        col = column_string_from_index(col_index)
+    if row < 1 or row > 9999:
+        return None
+    return f"{col_abs}{col}{row_abs}{row}"
+
+
+def shift_references(formula, d_col, d_row):
+    # Move every relative reference in formula by d_col columns and d_row
+    # rows, as when the cell holding it is copied or moved.  "$" parts are
+    # absolute and stay put.  A reference that would leave the sheet becomes
+    # #REF!, sheet name included.
+    pieces = []
+    pos = 0
+    for match in scan_references(formula):
+        start = _shift_ref(match.group("start"), d_col, d_row)
+        end = match.group("end")
+        if end is not None:
+            end = _shift_ref(end, d_col, d_row)
+        pieces.append(formula[pos:match.start()])
+        if start is None or (match.group("end") is not None and end is None):
+            pieces.append("#REF!")
+        else:
+            pieces.append(formula[match.start():match.start("start")])
+            pieces.append(start)
+            if end is not None:
+                pieces.append(formula[match.end("start"):match.start("end")])
+                pieces.append(end)
+        pos = match.end()
+    pieces.append(formula[pos:])
+    return "".join(pieces)
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from .helper import column_index_from_string
+from .formula_references import (extract_references, anchor_references,
+                                 scan_references, split_ref)
+from .formula_optimizer import fold_constants
+
+
+def r1c1_key(formula, row, col):
+    # Position-independent key of a formula in the cell at (row, col).  Every
+    # cell reference is replaced by its R1C1 form: a (row, col) offset from
+    # the cell for relative parts, the row or column itself for "$" parts.
+    # The formulas "=A1+B2" in C3 and "=B2+C3" in D4 get the same key.  The
+    # key is a tuple alternating between the text around the references and
+    # the references themselves, so it cannot collide with a formula whose
+    # text happens to look like R1C1.
+    key = []
+    pos = 0
+    for match in scan_references(formula):
+        for group in ("start", "end"):
+            ref = match.group(group)
+            if ref is None:
+                continue
+            col_abs, ref_col, row_abs, ref_row = split_ref(ref)
+            ref_col = column_index_from_string(ref_col)
+            # Out of range references are kept as text; they are an error in
+            # every cell
+            if ref_row > 9999 or ref_col > 475254:
+                continue
+            key.append(formula[pos:match.start(group)])
+            key.append((ref_row if row_abs else ref_row - row, row_abs == "$",
+                        ref_col if col_abs else ref_col - col, col_abs == "$"))
+            pos = match.end(group)
+    key.append(formula[pos:])
+    return tuple(key)
+
+
+class FormulaTemplates:
+    # Bounded LRU cache of R1C1 key -> compiled formula.  Formulas that only
+    # differ by a relative offset, such as the cells produced by copy_cells or
+    # by filling a pattern down a column, are parsed and compiled once and the
+    # compiled template is shared by all of them.  The template reads the
+    # position of the cell being evaluated from the EvaluationContext, so it is
+    # bound to each cell when that cell is evaluated.
+    #
+    # Each template also carries the anchored cells and ranges its formula
+    # references (template.references, see formula_references), extracted
+    # from the AST when it is compiled.  This gives the parents of a cell
+    # without evaluating it.
+    #
+    # Constant subexpressions are folded (see formula_optimizer) before the
+    # template is compiled, so the references extracted are those of the
+    # folded formula: =IF(TRUE, A1, B1) only depends on A1.
+    def __init__(self, compiler, parse, parse_many, max_size=4096):
+        self._compiler = compiler
+        # Functions parsing a formula string into an AST, and a list of
+        # formulas into a dict of formula -> AST (see ParseCache.parse_many)
+        self._parse = parse
+        self._parse_many = parse_many
+        self._max_size = max_size
+        self._templates = OrderedDict()
+        # Lookup counters
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, formula, row, col):
+        # Return the compiled template of formula in the cell at (row, col),
+        # compiling it on a miss.  Parse errors propagate to the caller and
+        # are not cached.
+        key = r1c1_key(formula, row, col)
+        template = self._templates.get(key)
+        if template is not None:
+            self._hits += 1
+            self._templates.move_to_end(key)
+            return template
+
+        self._misses += 1
+        return self._add(key, self._parse(formula), row, col)
+
+    def compile_many(self, cells):
+        # Compile the templates of many (formula, row, col) at once, before
+        # the cells are set.  Only one formula per missing template is
+        # parsed, and those are parsed in a single parse_many batch.  Formulas
+        # that don't parse are skipped; get() reports them when they are set.
+        # Callers should keep batches well under max_size so that the
+        # templates are still cached when the cells are set.
+        pending = {}
+        for formula, row, col in cells:
+            key = r1c1_key(formula, row, col)
+            if key not in self._templates and key not in pending:
+                self._misses += 1
+                pending[key] = (formula, row, col)
+        asts = self._parse_many([formula for formula, _, _ in pending.values()])
+        for key, (formula, row, col) in pending.items():
+            ast = asts.get(formula)
+            if ast is not None:
+                self._add(key, ast, row, col)
+
+    def _add(self, key, ast, row, col):
+        # Compile ast in the cell at (row, col) and cache it as the template
+        # of key
+        ast = fold_constants(ast, self._compiler)
+        template = self._compiler.compile(ast, (row, col))
+        template.references = anchor_references(extract_references(ast), (row, col))
+        self._templates[key] = template
+        # Evict the least recently used template once we are over capacity
+        if len(self._templates) > self._max_size:
+            self._templates.popitem(last=False)
+        return template
+
+    def get_hits(self):
+        return self._hits
+
+    def get_misses(self):
+        return self._misses
+
+    def get_stats(self):
+        # Return a snapshot of the template counters
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "size": len(self._templates),
+                "max_size": self._max_size}
+
+    def clear(self):
+        # Drop all templates and reset the counters
+        self._templates.clear()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._templates)
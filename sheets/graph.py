@@ -1,40 +1,479 @@
-from collections import defaultdict, deque
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+from functools import lru_cache
+from .helper import column_index_from_string
+from .range_index import RangeIndex
 
+_LOC = re.compile(r"^([A-Z]+)([0-9]+)(?::([A-Z]+)([0-9]+))?$")
 
-# Class to represent a graph
-class Graph:
-    def __init__(self, graph, v):
-        self.graph = graph  # dictionary containing adjacency List
-        self.v = v  # No. of vertices #CHANGE
+# Keys of the topological order given to new places in it, so that a cycle
+# that breaks can be given the keys between its own and the next (see _split)
+_KEY_ROOM = 1 << 40
 
-    # function to add an edge to graph
-    def add_edge(self, u, v):
-        self.graph[u].append(v)
 
-    def topological_sort(self):
-        # Mark all the vertices as not visited
-        visited = [False] * self.v
+@lru_cache(maxsize=1 << 16)
+def _bounds(loc):
+    # (top, left, bottom, right) of a key's location, a cell ("B5") or a
+    # range ("A1:C9", top left to bottom right), or None
+    match = _LOC.match(loc)
+    if match is None:
+        return None
+    top, left = int(match.group(2)), column_index_from_string(match.group(1))
+    if match.group(3) is None:
+        return top, left, top, left
+    return top, left, int(match.group(4)), column_index_from_string(match.group(3))
+
+
+# Class to represent the dependencies between the cells of a workbook
+class DependencyGraph:
+    # One graph per workbook, kept up to date as cells are set rather than
+    # rebuilt for every write.  Cells are identified by (sheet, loc) keys,
+    # with the sheet name in lower case and the location in upper case.  A
+    # key does not need a cell behind it: references to empty cells and to
+    # sheets that don't exist are edges like any other, so the cells reading
+    # them are found when the cell is set or the sheet is created.
+    #
+    # Internally every key with an edge gets a small integer id, and the
+    # forward (children) and reverse (parents) edges are sets of ids, so
+    # adding or removing an edge is O(1).  Ids of keys left without edges are
+    # reused.
+    #
+    # The graph also keeps a topological order of its keys, updated as edges
+    # are added with the Pearce-Kelly algorithm: an edge that already goes
+    # forward in the order costs nothing, and one that goes backward only
+    # reorders the keys between its two ends.  Recalculation visits the
+    # dirty keys in this order instead of sorting them.
+    #
+    # The keys on a circular reference are kept together as a cluster, a
+    # strongly connected component of the graph, which has a single place in
+    # the order.  An edge that closes a cycle merges the keys on the cycle,
+    # the ones both reached by the forward search and reaching the backward
+    # search of Pearce-Kelly, into one cluster.  Removing an edge within a
+    # cluster can only split that cluster, so its components are found again
+    # from its own keys, and take consecutive places in the order where the
+    # cluster was.  Every other change leaves the clusters as they are.
+    #
+    # A range of cells, such as the A1:A9999 of SUM(A1:A9999), is one key
+    # (sheet, "A1:A9999") rather than an edge from each of its cells.  Ranges
+    # are kept in a spatial index per sheet (see RangeIndex): the cells a
+    # write may change are found from the ranges covering the written cell,
+    # and a cell in a range that has edges of its own gets an edge to the
+    # range, so that it is ordered before it.  Cells in a range without
+    # edges of their own, typically values, are not in the graph at all.
+    def __init__(self):
+        self._ids = {}  # key -> id
+        self._keys = []  # id -> key, None for free ids
+        self._parents = []  # id -> set of ids it references
+        self._children = []  # id -> set of ids referencing it
+        self._order = []  # id -> key of its place in the topological order
+        self._room = []  # id -> number of keys from its own that it owns
+        self._next_key = 0  # key of the next new place
+        self._cluster = {}  # id -> set of ids of its cluster, if on a cycle
+        self._uncycled = set()  # keys no longer on a cycle (see take_uncycled)
+        self._free = []  # ids to reuse
+        self._sheet_ids = defaultdict(set)  # sheet -> ids of keys in it
+        self._ranges = {}  # id -> (top, left, bottom, right) of range keys
+        self._range_index = defaultdict(RangeIndex)  # sheet -> range ids
+        self._cell_rows = defaultdict(dict)  # sheet -> col -> [(row, id)]
+        # Instrumentation counters (see get_stats)
+        self._recalcs = 0
+        self._recalc_visits = 0
+        self._reorders = 0
+        self._reorder_visits = 0
+        self._scc_passes = 0
+        self._scc_visits = 0
+
+    def _id(self, key):
+        # Id of key, giving it one if it has none
+        node = self._ids.get(key)
+        if node is not None:
+            return node
+        if self._free:
+            node = self._free.pop()
+            self._keys[node] = key
+        else:
+            node = len(self._keys)
+            self._keys.append(key)
+            self._parents.append(set())
+            self._children.append(set())
+            self._order.append(None)
+            self._room.append(None)
+        # New keys have no edges, so any unused place will do
+        self._order[node] = self._next_key
+        self._room[node] = _KEY_ROOM
+        self._next_key += _KEY_ROOM
+        self._ids[key] = node
+        self._sheet_ids[key[0]].add(node)
+
+        # Link the key with the ranges it is in, or the cells in it
+        bounds = _bounds(key[1])
+        if bounds is None:
+            return node
+        top, left, bottom, right = bounds
+        if (top, left) != (bottom, right):
+            self._ranges[node] = bounds
+            self._range_index[key[0]].add(node, *bounds)
+            for cell in self._cells_in(key[0], bounds):
+                self._add_edge(cell, node)
+        else:
+            insort(self._cell_rows[key[0]].setdefault(left, []), (top, node))
+            if key[0] in self._range_index:
+                for cell_range in self._range_index[key[0]].covering(top, left):
+                    self._add_edge(node, cell_range)
+        return node
+
+    def _cells_in(self, sheet, bounds):
+        # Ids of the cell keys of sheet within bounds
+        top, left, bottom, right = bounds
+        columns = self._cell_rows.get(sheet, {})
+        if right - left + 1 > len(columns):
+            columns = [col for col in columns if left <= col <= right]
+        else:
+            columns = [col for col in range(left, right + 1) if col in columns]
+        cells = []
+        for col in columns:
+            rows = self._cell_rows[sheet][col]
+            for i in range(bisect_left(rows, (top,)), len(rows)):
+                if rows[i][0] > bottom:
+                    break
+                cells.append(rows[i][1])
+        return cells
+
+    def _release(self, node):
+        # Free the id of a key that has no edges left.  The edges of a cell
+        # to the ranges it is in don't count, and neither do the edges of a
+        # range to the cells in it.
+        if self._keys[node] is None:
+            return
+        if node in self._ranges:
+            if self._children[node]:
+                return
+            cells = list(self._parents[node])
+            for cell in cells:
+                self._remove_edge(cell, node)
+            sheet = self._keys[node][0]
+            self._range_index[sheet].remove(node, *self._ranges.pop(node))
+            if not self._range_index[sheet]:
+                del self._range_index[sheet]
+            for cell in cells:
+                self._release(cell)
+        else:
+            if self._parents[node] or any(child not in self._ranges
+                                          for child in self._children[node]):
+                return
+            for cell_range in list(self._children[node]):
+                self._remove_edge(node, cell_range)
+            bounds = _bounds(self._keys[node][1])
+            if bounds is not None:
+                rows = self._cell_rows[self._keys[node][0]]
+                rows[bounds[1]].remove((bounds[0], node))
+                if not rows[bounds[1]]:
+                    del rows[bounds[1]]
+                if not rows:
+                    del self._cell_rows[self._keys[node][0]]
+        key = self._keys[node]
+        del self._ids[key]
+        self._sheet_ids[key[0]].discard(node)
+        if not self._sheet_ids[key[0]]:
+            del self._sheet_ids[key[0]]
+        self._keys[node] = None
+        self._free.append(node)
+
+    def set_parents(self, key, parents):
+        # Make parents the set of keys that key references.  Only the edges
+        # that changed are touched.  Returns True if key gained a parent.
+        parents = set(parents)
+        node = self._ids.get(key)
+        if node is None:
+            if not parents:
+                return False
+            node = self._id(key)
+        old = self._parents[node]
+        new = {self._id(parent) for parent in parents}
+        removed, added = old - new, new - old
+        for parent in removed:
+            self._remove_edge(parent, node)
+        for parent in added:
+            self._add_edge(parent, node)
+        for parent in removed:
+            self._release(parent)
+        self._release(node)
+        return bool(added)
+
+    def _add_edge(self, parent, child):
+        self._reorder(parent, child)
+        self._children[parent].add(child)
+        self._parents[child].add(parent)
+
+    def _remove_edge(self, parent, child):
+        self._children[parent].discard(child)
+        self._parents[child].discard(parent)
+        # Only an edge within a cluster can break a cycle
+        cluster = self._cluster.get(child)
+        if cluster is not None and parent in cluster:
+            self._split(cluster)
+
+    def _members(self, node):
+        # Ids sharing the place of node in the order: its cluster, or itself
+        cluster = self._cluster.get(node)
+        return (node,) if cluster is None else cluster
+
+    def _reorder(self, parent, child):
+        # Update the order for a new edge from parent to child (Pearce-Kelly),
+        # merging the places on the cycle it closes, if any, into a cluster
+        order = self._order
+        lower, upper = order[child], order[parent]
+        if lower > upper:
+            return
+        if lower == upper:
+            # Both ends already share a place, unless a key references itself
+            if parent == child and parent not in self._cluster:
+                self._cluster[parent] = {parent}
+            return
+        # The places after child and the places before parent, within the
+        # affected region, swap keys while keeping their relative order.  The
+        # places in both are on the new cycle, and go in between, as one.
+        self._reorders += 1
+        forward = self._region(child, upper, self._children, True)
+        backward = self._region(parent, lower, self._parents, False)
+        cycle = forward.keys() & backward.keys()
+        before = [backward[key] for key in sorted(backward) if key not in cycle]
+        after = [forward[key] for key in sorted(forward) if key not in cycle]
+        keys = sorted((order[node], self._room[node])
+                      for node in {**backward, **forward}.values())
+        for node, (key, room) in zip(before, keys):
+            self._place(self._members(node), key, room)
+        for node, (key, room) in zip(after, keys[len(keys) - len(after):]):
+            self._place(self._members(node), key, room)
+        if cycle:
+            cluster = set()
+            for key in cycle:
+                cluster.update(self._members(forward[key]))
+            for node in cluster:
+                self._cluster[node] = cluster
+            self._place(cluster, *keys[len(before)])
+
+    def _place(self, nodes, key, room):
+        for node in nodes:
+            self._order[node] = key
+            self._room[node] = room
+
+    def _region(self, start, bound, edges, forward):
+        # Places reachable from the place of start through edges (children
+        # if forward, else parents) whose key is on the start side of bound,
+        # or is bound, which means the new edge closes a cycle.  Returns a
+        # dict of their keys to one of their ids.
+        order = self._order
+        found = {order[start]: start}
+        stack = [start]
+        while stack:
+            for node in self._members(stack.pop()):
+                self._reorder_visits += 1
+                for other in edges[node]:
+                    key = order[other]
+                    if key in found:
+                        continue
+                    if (key <= bound) if forward else (key >= bound):
+                        found[key] = other
+                        # The edges of the place at bound leave the region
+                        if key != bound:
+                            stack.append(other)
+        return found
+
+    def _split(self, cluster):
+        # Find the components of a cluster again after an edge within it was
+        # removed.  They take keys from the cluster's own room, in order.
+        components = self._components(cluster)
+        node = components[0][0]
+        if len(components) == 1 and (len(cluster) > 1 or node in self._children[node]):
+            return
+        if self._room[node] < len(components):
+            self._relabel()
+        key, room = self._order[node], self._room[node] // len(components)
+        for i, component in enumerate(components):
+            self._place(component, key + i * room, room)
+            if len(component) > 1 or component[0] in self._children[component[0]]:
+                members = set(component)
+                for member in component:
+                    self._cluster[member] = members
+            else:
+                del self._cluster[component[0]]
+                self._uncycled.add(self._keys[component[0]])
+
+    def _relabel(self):
+        # Give every place a new key, in the same order, with room to split
+        keys = {}
+        for node, key in enumerate(self._keys):
+            if key is not None:
+                keys[self._order[node]] = None
+        keys = {key: i * _KEY_ROOM for i, key in enumerate(sorted(keys))}
+        for node, key in enumerate(self._keys):
+            if key is not None:
+                self._order[node] = keys[self._order[node]]
+                self._room[node] = _KEY_ROOM
+        self._next_key = len(keys) * _KEY_ROOM
+
+    def take_uncycled(self):
+        # Keys that were on a circular reference and no longer are on any
+        # since the last call.  Their values need computing again, even if
+        # the values they read are the same.
+        uncycled, self._uncycled = self._uncycled, set()
+        return uncycled
+
+    def parents(self, key):
+        # Keys referenced by key
+        node = self._ids.get(key)
+        if node is None:
+            return set()
+        return {self._keys[parent] for parent in self._parents[node]}
+
+    def children(self, key):
+        # Keys referencing key, and the ranges it is in
+        return {self._keys[child] for child in self._child_ids(key)}
+
+    def _child_ids(self, key):
+        # Ids of the children of key, which need not have an id itself
+        node = self._ids.get(key)
+        if node is not None:
+            return self._children[node]
+        bounds = _bounds(key[1])
+        if bounds is None or key[0] not in self._range_index:
+            return ()
+        return self._range_index[key[0]].covering(bounds[0], bounds[1])
+
+    def cycle(self, key):
+        # Keys on a circular reference with key, key included: its cluster,
+        # or an empty set if key is on none
+        cluster = self._cluster.get(self._ids.get(key))
+        if cluster is None:
+            return set()
+        return {self._keys[node] for node in cluster}
+
+    def bounds(self, key):
+        # (top, left, bottom, right) of the location of key, or None
+        return _bounds(key[1])
+
+    def is_range(self, key):
+        # Whether key is a range of several cells rather than a cell
+        bounds = _bounds(key[1])
+        return bounds is not None and bounds[:2] != bounds[2:]
+
+    def keys_in_sheet(self, sheet):
+        # Keys with edges in the sheet named sheet (lower case)
+        return {self._keys[node] for node in self._sheet_ids.get(sheet, ())}
+
+    def recalc_order(self, keys):
+        # Order in which to recompute keys and everything that depends on
+        # them, directly or not.  Returns (order, cyclic): cyclic is the set
+        # of keys on a circular reference, and order lists the other keys
+        # topologically, each after all of its parents.  Only the dependents
+        # of keys are visited.
+        self._recalcs += 1
+        roots = [child for key in keys for child in
+                 ((self._ids[key],) if key in self._ids else self._child_ids(key))]
+        reachable = set(roots)
+        stack = list(roots)
+        while stack:
+            for child in self._children[stack.pop()]:
+                if child not in reachable:
+                    reachable.add(child)
+                    stack.append(child)
+        self._recalc_visits += len(reachable)
+        return self._order_nodes(reachable, keys)
+
+    def order(self, keys):
+        # Order in which to recompute just keys, as (order, cyclic) like
+        # recalc_order
+        return self._order_nodes({self._ids[key] for key in keys if key in self._ids}, keys)
+
+    def _order_nodes(self, nodes, keys):
+        # (order, cyclic) of the ids in nodes; the keys of keys without an id
+        # have no parents and go first.  The clusters give the cycles, and the
+        # maintained order the order around them.
+        isolated = [key for key in dict.fromkeys(keys) if key not in self._ids]
+        cluster = self._cluster
+        cyclic = {self._keys[node] for node in nodes if node in cluster}
+        if cyclic:
+            nodes = [node for node in nodes if node not in cluster]
+        order = [self._keys[node]
+                 for node in sorted(nodes, key=self._order.__getitem__)]
+        return isolated + order, cyclic
+
+    def _components(self, nodes):
+        # Strongly connected components of the subgraph of nodes, in
+        # topological order (Tarjan's algorithm, without recursion), by
+        # list of ids
+        self._scc_passes += 1
+        self._scc_visits += len(nodes)
+        index = {}
+        low = {}
         stack = []
-        # Double ended queue for nodes with no incoming edges
-        queue = deque()
-        # Store number of edges for a node
-        num_edges = [0] * self.v
-        for i in range(self.v):
-            for j in self.graph[i]:
-                num_edges[j] += 1
-        # Enqueue vertices with no incoming edges
-        min_edges = min(num_edges)
-        for i in range(self.v):
-            if num_edges[i] == min_edges:
-                queue.append(i)
-        while queue:
-            curr = queue.popleft()
-            visited[curr] = True
-            stack.append(curr)
-            # Decrease the edge count of all neighbors
-            for neighbor in self.graph[curr]:
-                num_edges[neighbor] -= 1
-                # Enqueue if a neighbor no incoming edges
-                if num_edges[neighbor] == 0:
-                    queue.append(neighbor)
-        return stack
+        on_stack = set()
+        components = []
+        for root in nodes:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self._children[root]))]
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in nodes:
+                        continue
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self._children[child])))
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+        # Tarjan's algorithm finds the components sinks first
+        components.reverse()
+        return components
+
+    def get_stats(self):
+        # Return a snapshot of the instrumentation counters: recalc_order
+        # calls and the keys they visited, order updates for backward edges
+        # and the keys they visited, and the clusters split and the keys they
+        # had
+        return {"recalcs": self._recalcs,
+                "recalc_visits": self._recalc_visits,
+                "reorders": self._reorders,
+                "reorder_visits": self._reorder_visits,
+                "scc_passes": self._scc_passes,
+                "scc_visits": self._scc_visits,
+                "keys": len(self._ids),
+                "ranges": len(self._ranges),
+                "cyclic": len(self._cluster)}
+
+    def reset_stats(self):
+        self._recalcs = 0
+        self._recalc_visits = 0
+        self._reorders = 0
+        self._reorder_visits = 0
+        self._scc_passes = 0
+        self._scc_visits = 0
+
+    def __contains__(self, key):
+        return key in self._ids
+
+    def __len__(self):
+        return len(self._ids)
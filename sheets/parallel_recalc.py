@@ -0,0 +1,109 @@
+from concurrent.futures import ProcessPoolExecutor
+from .cell import Cell
+
+# Recalculation only sends a connected part of the cells to recompute to a
+# worker process if its formulas read at least this many cells (see
+# part_reads); smaller parts cost more to send than to compute in process
+PARALLEL_THRESHOLD = 100000
+
+# The worker compiles every formula it is sent again, which costs about as
+# much as reading a few hundred cells, so a part must also read at least this
+# many cells per cell of it to be worth sending
+READS_PER_CELL = 500
+
+
+def components(graph, keys):
+    # Split keys into the parts that are connected by the edges of graph
+    # between them, whichever way they go.  Returns a list of lists of keys,
+    # each in the order of keys.
+    index = {key: i for i, key in enumerate(keys)}
+    root = list(range(len(keys)))
+
+    def find(i):
+        while root[i] != i:
+            root[i] = root[root[i]]
+            i = root[i]
+        return i
+
+    for i, key in enumerate(keys):
+        for parent in graph.parents(key):
+            j = index.get(parent)
+            if j is not None:
+                root[find(i)] = find(j)
+    parts = {}
+    for i, key in enumerate(keys):
+        parts.setdefault(find(i), []).append(key)
+    return list(parts.values())
+
+
+def levels(graph, order):
+    # Group the keys of order, which is in topological order, by level: a
+    # cell is one level after the deepest cell of order it reads, so the cells
+    # of a level only read cells of the levels before it.  A range is one
+    # level after the deepest of its cells, and the cells reading it are in
+    # its level, so ranges add no levels.  Returns a list of lists of keys,
+    # each in the order of order.
+    level = {}
+    grouped = []
+    for key in order:
+        depth = 0
+        for parent in graph.parents(key):
+            if parent in level:
+                depth = max(depth, level[parent] + (not graph.is_range(parent)))
+        if graph.is_range(key):
+            depth = max((level[parent] + 1 for parent in graph.parents(key)
+                         if parent in level), default=0)
+        level[key] = depth
+        if depth == len(grouped):
+            grouped.append([])
+        grouped[depth].append(key)
+    return grouped
+
+
+def part_reads(graph, part):
+    # Estimate of the work of computing part: the number of cells its
+    # formulas read, counting every cell of the ranges they read
+    reads = 0
+    for key in part:
+        if graph.is_range(key):
+            top, left, bottom, right = graph.bounds(key)
+            reads += (bottom - top + 1) * (right - left + 1)
+        else:
+            reads += len(graph.parents(key))
+    return reads
+
+
+def _recalc_part(parser_mode, sheet_names, inputs, formulas):
+    # Compute a part of the cells in a worker process, in a workbook of its
+    # own holding the values the part reads.  inputs are (sheet, loc, value)
+    # and formulas (sheet, loc, contents).  The formulas are set in one batch,
+    # so their templates are compiled together and each of them is computed
+    # once.  Returns the (sheet, loc, value, parents) of the formulas; parents
+    # are the keys each of them read.
+    from .workbook import Workbook
+    wb = Workbook(parser_mode)
+    for sheet_name in sheet_names:
+        wb.new_sheet(sheet_name)
+    for sheet_name, loc, value in inputs:
+        cell = Cell(sheet_name, loc)
+        cell.set_value(value)
+        wb.get_sheet(sheet_name).set_cell(loc, cell)
+    by_sheet = {}
+    for sheet_name, loc, contents in formulas:
+        by_sheet.setdefault(sheet_name, {})[loc] = contents
+    with wb.batch():
+        for sheet_name, cells in by_sheet.items():
+            wb.set_cells_contents(sheet_name, cells)
+    return [(sheet_name, loc, wb.get_sheet(sheet_name).get_cell(loc).get_value(),
+             wb.graph.parents((sheet_name.lower(), loc)))
+            for sheet_name, loc, _ in formulas]
+
+
+def recalc_parts(executor, parser_mode, sheet_names, parts):
+    # Compute parts, each a (inputs, formulas) pair as _recalc_part takes,
+    # in the worker processes of executor, a ProcessPoolExecutor that one
+    # recalculation reuses for all of its parts.  Returns the results of
+    # each part.
+    return list(executor.map(
+        _recalc_part, [parser_mode] * len(parts), [sheet_names] * len(parts),
+        [inputs for inputs, _ in parts], [formulas for _, formulas in parts]))
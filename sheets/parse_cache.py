@@ -0,0 +1,137 @@
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from lark import exceptions
+from .parsers import get_parser
+from .formula_ast import to_ast
+
+# parse_many only spreads the parsing over worker processes for at least this
+# many formulas that are not cached; below it, starting the workers costs
+# more than it saves
+PARALLEL_THRESHOLD = 1000
+
+
+def _parse_chunk(parser_mode, formulas):
+    # Parse a chunk of formulas in a worker process.  Returns the (formula,
+    # AST) pairs of the formulas that parse; the ASTs are pickled back to the
+    # parent.
+    parser = get_parser(parser_mode)
+    parsed = []
+    for formula in formulas:
+        try:
+            parsed.append((formula, to_ast(parser.parse(formula))))
+        except exceptions.LarkError:
+            continue
+    return parsed
+
+
+class ParseCache:
+    # Bounded LRU cache of formula string -> AST (see formula_ast).  Setting a
+    # formula that was seen before reuses its AST instead of running the
+    # parser again.  AST nodes are immutable, so one AST can safely be shared
+    # between cells.
+    def __init__(self, parser_mode="lalr", max_size=4096):
+        # The parser is only loaded on the first miss (see parsers.get_parser)
+        self._parser_mode = parser_mode
+        self._max_size = max_size
+        self._asts = OrderedDict()
+        # Lookup counters
+        self._hits = 0
+        self._misses = 0
+
+    def parse(self, formula):
+        # Return the AST of formula, parsing it on a miss.  Parse errors
+        # propagate to the caller and are not cached.
+        ast = self._asts.get(formula)
+        if ast is not None:
+            self._hits += 1
+            self._asts.move_to_end(formula)
+            return ast
+
+        self._misses += 1
+        ast = to_ast(get_parser(self._parser_mode).parse(formula))
+        self._asts[formula] = ast
+        # Evict the least recently used formula once we are over capacity
+        if len(self._asts) > self._max_size:
+            self._asts.popitem(last=False)
+        return ast
+
+    def parse_many(self, formulas, max_workers=None,
+                   threshold=PARALLEL_THRESHOLD):
+        # Parse many formulas at once, returning a dict of formula -> AST.
+        # Identical formulas are parsed once, and formulas already in the
+        # cache are not parsed again.  If at least threshold formulas are
+        # left, they are split between max_workers processes (default: one
+        # per CPU).  Formulas that don't parse are left out of the result;
+        # parse() raises their error when they are set.
+        result = {}
+        missing = []
+        for formula in dict.fromkeys(formulas):
+            ast = self._asts.get(formula)
+            if ast is not None:
+                self._hits += 1
+                self._asts.move_to_end(formula)
+                result[formula] = ast
+            else:
+                self._misses += 1
+                missing.append(formula)
+
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if len(missing) < threshold or max_workers < 2:
+            parsed = _parse_chunk(self._parser_mode, missing)
+        else:
+            # A few chunks per worker keeps the workers busy when some
+            # chunks parse slower than others
+            size = -(-len(missing) // (max_workers * 4))
+            chunks = [missing[i:i + size] for i in range(0, len(missing), size)]
+            parsed = []
+            with ProcessPoolExecutor(max_workers) as executor:
+                for chunk in executor.map(_parse_chunk,
+                                          [self._parser_mode] * len(chunks), chunks):
+                    parsed.extend(chunk)
+
+        for formula, ast in parsed:
+            result[formula] = ast
+            self._asts[formula] = ast
+        while len(self._asts) > self._max_size:
+            self._asts.popitem(last=False)
+        return result
+
+    def get_parser_mode(self):
+        return self._parser_mode
+
+    def get_hits(self):
+        return self._hits
+
+    def get_misses(self):
+        return self._misses
+
+    def get_stats(self):
+        # Return a snapshot of the cache counters
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "size": len(self._asts),
+                "max_size": self._max_size}
+
+    def get_max_size(self):
+        return self._max_size
+
+    def set_max_size(self, max_size):
+        if max_size < 1:
+            raise ValueError("Cache size must be at least 1")
+        self._max_size = max_size
+        while len(self._asts) > self._max_size:
+            self._asts.popitem(last=False)
+
+    def clear(self):
+        # Drop all cached ASTs and reset the counters
+        self._asts.clear()
+        self._hits = 0
+        self._misses = 0
+
+    def __contains__(self, formula):
+        return formula in self._asts
+
+    def __len__(self):
+        return len(self._asts)
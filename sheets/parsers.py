@@ -0,0 +1,101 @@
+import hashlib
+import os
+import pickle
+
+from lark import Lark
+
+# Formula parsers by mode.  Parsers are built on first use instead of when the
+# package is imported, and the grammar files are found relative to this
+# package rather than to the working directory.
+#
+# Building the LALR(1) tables is most of the cost of creating the parser, so
+# the LALR parser is shipped serialized (Lark.save) in formulas_lalr.parser
+# and loaded from there.  The file starts with the SHA-256 of the grammar it
+# was built from; if the grammar has changed, or the file can't be read with
+# the installed version of Lark, the parser is rebuilt from the grammar and
+# the file rewritten.  Run "python -m sheets.parsers" to regenerate it.
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Grammar file and Lark options for each parser mode
+_GRAMMARS = {
+    "lalr": ("formulas_lalr.lark", {"start": "formula", "parser": "lalr"}),
+    "earley": ("formulas.lark", {"start": "formula"}),
+}
+# Modes whose parser is shipped serialized, and the file it is stored in
+_SERIALIZED = {"lalr": "formulas_lalr.parser"}
+
+PARSER_MODES = tuple(_GRAMMARS)
+
+_parsers = {}
+
+
+def get_parser(mode="lalr"):
+    # Return the Lark parser for mode, loading it on the first call
+    parser = _parsers.get(mode)
+    if parser is None:
+        if mode not in _GRAMMARS:
+            raise ValueError(f"{mode} is not a valid parser mode")
+        parser = _load_parser(mode)
+        _parsers[mode] = parser
+    return parser
+
+
+def _read_grammar(mode):
+    with open(os.path.join(_DIR, _GRAMMARS[mode][0]), encoding="utf8") as f:
+        return f.read()
+
+
+def _grammar_digest(grammar):
+    return hashlib.sha256(grammar.encode("utf8")).hexdigest()
+
+
+def _build_parser(mode, grammar):
+    return Lark(grammar, **_GRAMMARS[mode][1])
+
+
+def _load_parser(mode):
+    grammar = _read_grammar(mode)
+    if mode not in _SERIALIZED:
+        return _build_parser(mode, grammar)
+
+    path = os.path.join(_DIR, _SERIALIZED[mode])
+    digest = _grammar_digest(grammar)
+    try:
+        with open(path, "rb") as f:
+            if pickle.load(f) == digest:
+                return Lark.load(f)
+    except Exception:
+        # A missing, truncated or incompatible file is rebuilt below
+        pass
+
+    parser = _build_parser(mode, grammar)
+    try:
+        _save_parser(parser, path, digest)
+    except OSError:
+        # The package directory may be read-only; the parser still works
+        pass
+    return parser
+
+
+def _save_parser(parser, path, digest):
+    # Write to a temporary file first so that a concurrent reader never sees
+    # a partial parser
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(digest, f)
+        parser.save(f)
+    os.replace(tmp_path, path)
+
+
+def build_serialized_parsers():
+    # Rebuild the serialized parsers from their grammars
+    for mode, filename in _SERIALIZED.items():
+        grammar = _read_grammar(mode)
+        parser = _build_parser(mode, grammar)
+        _save_parser(parser, os.path.join(_DIR, filename), _grammar_digest(grammar))
+        _parsers[mode] = parser
+
+
+if __name__ == "__main__":
+    build_serialized_parsers()
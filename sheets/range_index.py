@@ -0,0 +1,80 @@
+from .formula_references import in_range
+
+# Rows and columns of a sheet are at most 9999 and 475254 (see in_range), so
+# both fit in a segment tree of fixed size
+_ROW_LEAVES = 1 << 14
+_COL_LEAVES = 1 << 19
+
+
+def _segments(low, high, leaves):
+    # Nodes of a segment tree with leaves leaves whose intervals exactly
+    # cover [low, high]: at most two per level.  Node 1 is the root and the
+    # children of node n are 2n and 2n + 1, so the leaf of i is leaves + i.
+    low += leaves
+    high += leaves + 1
+    while low < high:
+        if low & 1:
+            yield low
+            low += 1
+        if high & 1:
+            high -= 1
+            yield high
+        low >>= 1
+        high >>= 1
+
+
+class RangeIndex:
+    # Rectangles of cells of one sheet, found by the cells they cover.
+    #
+    # A two-level segment tree: a rectangle is stored in the row nodes
+    # covering its rows and, within each of them, in the column nodes
+    # covering its columns.  The rectangles covering a cell are then stored
+    # in the nodes on the paths from the cell's row and column leaves to the
+    # root, so finding them takes O(log rows * log cols) lookups plus the
+    # rectangles found, however large they are.  Only the nodes holding a
+    # rectangle are kept.
+    def __init__(self):
+        self._nodes = {}  # row node -> col node -> set of items
+        self._size = 0
+
+    def add(self, item, top, left, bottom, right):
+        # Store item as covering rows top to bottom of columns left to right
+        for row_node in _segments(top, bottom, _ROW_LEAVES):
+            cols = self._nodes.setdefault(row_node, {})
+            for col_node in _segments(left, right, _COL_LEAVES):
+                cols.setdefault(col_node, set()).add(item)
+        self._size += 1
+
+    def remove(self, item, top, left, bottom, right):
+        # Remove an item stored with the same bounds
+        for row_node in _segments(top, bottom, _ROW_LEAVES):
+            cols = self._nodes[row_node]
+            for col_node in _segments(left, right, _COL_LEAVES):
+                items = cols[col_node]
+                items.discard(item)
+                if not items:
+                    del cols[col_node]
+            if not cols:
+                del self._nodes[row_node]
+        self._size -= 1
+
+    def covering(self, row, col):
+        # Items whose rectangle contains the cell at (row, col)
+        found = []
+        if not in_range((row, col)):
+            return found
+        row_node = row + _ROW_LEAVES
+        while row_node:
+            cols = self._nodes.get(row_node)
+            if cols is not None:
+                col_node = col + _COL_LEAVES
+                while col_node:
+                    items = cols.get(col_node)
+                    if items is not None:
+                        found.extend(items)
+                    col_node >>= 1
+            row_node >>= 1
+        return found
+
+    def __len__(self):
+        return self._size
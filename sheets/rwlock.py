@@ -0,0 +1,83 @@
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    # Readers-writer lock: any number of threads may hold it for reading at
+    # once, but a thread holding it for writing holds it alone.  Waiting
+    # writers go before new readers, so a steady flow of reads cannot keep a
+    # write out forever.
+    #
+    # The lock is reentrant: a thread may acquire it again in the mode it
+    # holds it in, and the writer may also acquire it for reading.  A reader
+    # may not acquire it for writing, as two readers doing so would wait for
+    # each other; a RuntimeError is raised instead.
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}  # thread id -> number of reads it holds
+        self._writer = None  # thread id of the writer
+        self._writes = 0  # number of writes the writer holds
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if me not in self._readers:
+                raise RuntimeError("The lock is not held for reading")
+            self._readers[me] -= 1
+            if not self._readers[me]:
+                del self._readers[me]
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writes += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("A reader cannot acquire the lock for writing")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writes = 1
+
+    def release_write(self):
+        with self._cond:
+            if self._writer != threading.get_ident():
+                raise RuntimeError("The lock is not held for writing")
+            self._writes -= 1
+            if not self._writes:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        # with lock.read(): ... holds the lock for reading during the block
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        # with lock.write(): ... holds the lock for writing during the block
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
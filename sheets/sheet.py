@@ -17,8 +17,20 @@ class Sheet:
         # Return max size of sheet
         return self._max_size
 
-    def update_sheet_extent(self):
-        # Update the sheet extent
+    def update_sheet_extent(self, cell=None, prev_cell=None):
+        # Update the sheet extent.  If cell was just set in place of
+        # prev_cell, only that change is looked at; the whole sheet is only
+        # scanned again when a cell on its edge is emptied.
+        if cell is not None:
+            (row, col) = cell.get_extent()
+            max_col, max_row = self._size
+            if cell.get_contents():
+                self._size = (max(col, max_col), max(row, max_row))
+                return
+            if prev_cell is None or not prev_cell.get_contents() or (
+                    col < max_col and row < max_row):
+                return
+
         max_col, max_row = 0, 0
         # Iterate through each location
         for cell in self._cells.values():
@@ -0,0 +1,78 @@
+import weakref
+from typing import Any, List, Optional
+
+
+class Snapshot:
+    # Read-only view of a workbook as it was when Workbook.snapshot() made it.
+    # It reads the cells of the workbook itself, and the old states the
+    # workbook keeps of the cells that changed since (see
+    # Workbook._keep_version), so it costs nothing to make and does not copy
+    # the workbook.  Writers may go on changing the workbook, from other
+    # threads too: reading a snapshot never waits for them.
+    #
+    # A snapshot holds on to the old states it may read until it is closed
+    # or garbage collected; with snapshot: ... closes it after the block.
+    def __init__(self, workbook, version, sheets):
+        self._workbook = workbook
+        self._version = version
+        # Lower case name -> (name, Sheet) of the sheets, in order
+        self._sheets = {sheet.get_name().lower(): (sheet.get_name(), sheet)
+                        for sheet in sheets}
+        # Releasing the snapshot lets the workbook drop the states that only
+        # it read
+        self._release = weakref.finalize(self, workbook._released.append, version)
+
+    def get_version(self) -> int:
+        return self._version
+
+    def num_sheets(self) -> int:
+        return len(self._sheets)
+
+    def list_sheets(self) -> List[str]:
+        return [name for name, _ in self._sheets.values()]
+
+    def get_cell_contents(self, sheet_name: str, location: str) -> Optional[str]:
+        # Return the contents of the specified cell when the snapshot was
+        # made.  Raises the errors Workbook.get_cell_contents raises.
+        return self._state(sheet_name, location)[0]
+
+    def get_cell_value(self, sheet_name: str, location: str) -> Any:
+        # Return the value of the specified cell when the snapshot was made.
+        # Raises the errors Workbook.get_cell_value raises.
+        return self._state(sheet_name, location)[1]
+
+    def close(self) -> None:
+        # Release the snapshot; it should not be read afterwards
+        self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _state(self, sheet_name, location):
+        # (contents, value) of a cell when the snapshot was made
+        if sheet_name[:1] == "'" and sheet_name[-1:] == "'":
+            sheet_name = sheet_name[1:-1]
+        if sheet_name.lower() not in self._sheets:
+            raise KeyError(f"{sheet_name} is not a valid sheet!")
+        _, sheet = self._sheets[sheet_name.lower()]
+        loc = location.upper()
+        try:
+            row, col = self._workbook._row_col(loc)
+        except (ValueError, IndexError):
+            raise ValueError(f"{location} is an invalid location")
+        max_col, max_row = sheet.get_max_size()
+        if col > max_col or row > max_row:
+            raise ValueError(f"{location} is an invalid location")
+
+        # The cell is read before its old states: a writer keeps the state
+        # of a cell before changing it, so if it changed after it was read,
+        # the old state is found
+        cell = sheet.get_cells().get(loc)
+        state = (None, None) if cell is None else (cell.get_contents(), cell.get_value())
+        for end, contents, value in self._workbook._history.get((sheet, loc), ()):
+            if end > self._version:
+                return contents, value
+        return state
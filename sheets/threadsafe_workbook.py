@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from typing import Optional, TextIO
+
+from .rwlock import RWLock
+from .snapshot import Snapshot
+from .workbook import Workbook
+
+# Workbook methods that only read it, which threads may call concurrently
+_READS = ("get_functions", "get_calc_mode", "num_sheets", "get_sheet",
+          "list_sheets", "get_sheet_extent", "get_cell_contents")
+
+# Workbook methods that read it, but compute the cells they read in lazy
+# mode (see Workbook.get_cell_value)
+_LAZY_READS = ("get_cell_value", "save_workbook")
+
+# Workbook methods that change it, which threads call one at a time.
+# get_level_widths updates the counters of the dependency graph.
+_WRITES = ("set_calc_mode", "recalculate", "get_level_widths", "new_sheet",
+           "del_sheet", "set_cell_contents", "set_cells_contents",
+           "set_region_contents", "move_sheet", "copy_sheet", "rename_sheet",
+           "notify_cells_changed", "move_cells", "copy_cells", "sort_region")
+
+
+class ThreadSafeWorkbook:
+    # Workbook that many threads can use at once.  It has the methods of
+    # Workbook, each of which runs atomically: the methods reading the
+    # workbook run concurrently with each other, and those changing it one at
+    # a time, with no reads in progress (see RWLock).
+    #
+    # Notification functions run while the change that caused them holds the
+    # lock, and are passed the wrapped workbook, which they may read.  A batch
+    # (see Workbook.batch) holds the lock from begin_batch() to
+    # commit_batch(), so other threads see all of its changes or none.
+    #
+    # Snapshots (see Workbook.snapshot) are read without the lock, so
+    # readers of a snapshot never wait for writers.
+    #
+    # workbook is the wrapped Workbook.  Using it directly, or the Sheet
+    # objects get_sheet returns, bypasses the lock.
+    def __init__(self, workbook: Optional[Workbook] = None):
+        self.workbook = Workbook() if workbook is None else workbook
+        self._lock = RWLock()
+        # Readers taking snapshots at once take turns to count them
+        self._snapshot_lock = threading.Lock()
+
+    @staticmethod
+    def load_workbook(fp: TextIO) -> ThreadSafeWorkbook:
+        # Load a workbook as Workbook.load_workbook does, wrapped
+        return ThreadSafeWorkbook(Workbook.load_workbook(fp))
+
+    def snapshot(self) -> Snapshot:
+        # Take a snapshot as Workbook.snapshot does.  It is a read, except in
+        # lazy mode, where out of date cells are computed first.
+        with self._lock.read():
+            if self.workbook.get_calc_mode() != "lazy":
+                with self._snapshot_lock:
+                    return self.workbook.snapshot()
+        with self._lock.write():
+            return self.workbook.snapshot()
+
+    @contextmanager
+    def batch(self):
+        # with wb.batch(): ... runs the block as a batch, as Workbook.batch
+        # does, holding the lock for writing
+        with self._lock.write():
+            with self.workbook.batch():
+                yield self
+
+    def begin_batch(self) -> None:
+        # Start a batch and hold the lock for writing until commit_batch()
+        self._lock.acquire_write()
+        try:
+            self.workbook.begin_batch()
+        except BaseException:
+            self._lock.release_write()
+            raise
+
+    def commit_batch(self) -> None:
+        # Commit the batch begin_batch() started and release the lock it took
+        with self._lock.write():
+            self.workbook.commit_batch()
+        self._lock.release_write()
+
+
+def _reading(name):
+    def method(self, *args, **kwargs):
+        with self._lock.read():
+            return getattr(self.workbook, name)(*args, **kwargs)
+    return method
+
+
+def _lazily_reading(name):
+    def method(self, *args, **kwargs):
+        with self._lock.read():
+            if self.workbook.get_calc_mode() != "lazy":
+                return getattr(self.workbook, name)(*args, **kwargs)
+        with self._lock.write():
+            return getattr(self.workbook, name)(*args, **kwargs)
+    return method
+
+
+def _writing(name):
+    def method(self, *args, **kwargs):
+        with self._lock.write():
+            return getattr(self.workbook, name)(*args, **kwargs)
+    return method
+
+
+for _names, _wrap in ((_READS, _reading), (_LAZY_READS, _lazily_reading),
+                      (_WRITES, _writing)):
+    for _name in _names:
+        _method = _wrap(_name)
+        _method.__name__ = _name
+        setattr(ThreadSafeWorkbook, _name, _method)
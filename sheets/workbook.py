@@ -14,46 +14,122 @@
 #        into your project in whatever way you see fit.
 from __future__ import annotations
 
-from collections import defaultdict
 
+import asyncio
 import itertools
+import os
 import re
-import copy
 import json
-from lark import Lark, exceptions
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from lark import exceptions
 
-from typing import Optional, List, TextIO, Tuple, Any
+from typing import Optional, Dict, List, TextIO, Tuple, Any
 from itertools import count, filterfalse
 
 from .sheet import Sheet
 from .cell import Cell
+from .snapshot import Snapshot
 from .cellerror import CellError
-from .cellerrortype import CellErrorType
-from .formula_parser import FormulaParser
-from .formula_editor import FormulaEditor
-from .graph import Graph
+from .cellerrortype import CellErrorType, ERROR_TYPES
+from .evaluation_context import EvaluationContext
+from .formula_compiler import FormulaCompiler
+from .formula_templates import FormulaTemplates
+from .formula_references import reference_cells, loc_str
+from .formula_rewriter import rename_sheet_references, shift_references
+from .graph import DependencyGraph
+from .parallel_recalc import (PARALLEL_THRESHOLD, READS_PER_CELL, components,
+                              levels, part_reads, recalc_parts)
 from .functions import functions
 from .sorter import rowAdapterObject
-
-# Illegal literal values map to CellErrorType
-_ERROR_TYPES = {"#ERROR!": CellErrorType.PARSE_ERROR,
-                "#CIRCREF": CellErrorType.CIRCULAR_REFERENCE,
-                "#REF!": CellErrorType.BAD_REFERENCE,
-                "#NAME?": CellErrorType.BAD_NAME,
-                "#VALUE!": CellErrorType.TYPE_ERROR,
-                "#DIV/0!": CellErrorType.DIVIDE_BY_ZERO
-                }
+from .parse_cache import ParseCache
+from .parsers import PARSER_MODES
+
+
+# How the cells depending on a changed cell are brought up to date:
+# "automatic" recomputes them as part of every change, "lazy" only marks them
+# dirty and computes them when their values are read, and "manual" only marks
+# them dirty, leaving them with their old values until recalculate() is
+# called.  In lazy and manual modes, changes to computed values are notified
+# when they are computed.
+CALC_MODES = ("automatic", "lazy", "manual")
+
+def _same_value(old, new):
+    # Whether the cells reading a cell can keep their values when its value
+    # goes from old to new.  Values that compare equal may still read
+    # differently (Decimal("1") == True, and Decimal("1.0") concatenates as
+    # "1.0"), so the types and the text of numbers must match too, and
+    # errors match on their type and detail.
+    if type(old) is not type(new):
+        return False
+    if isinstance(new, CellError):
+        return (old.get_type() == new.get_type() and
+                old.get_detail() == new.get_detail())
+    if isinstance(new, Decimal):
+        return str(old) == str(new)
+    return old == new
+
+
+# Default number of cells the async methods compute at a time
+ASYNC_CHUNK_SIZE = 500
+
+# Number of cells whose formulas _set_many compiles in one batch; well under
+# the size of the template cache, so the batch is still cached when it is set
+_COMPILE_BATCH = 2048
 
 class Workbook:
     # A workbook containing zero or more named spreadsheets.
     # Any and all operations on a workbook that may affect calculated cell
     # values should cause the workbook's contents to be updated properly.
 
-    PARSER = Lark.open('sheets/formulas.lark', start='formula')
+    # Parse trees of recently seen formulas, one cache per parser mode shared
+    # by all workbooks.  The LALR(1) grammar is the default; the original
+    # Earley grammar is kept and can be selected per workbook.  The parsers
+    # themselves are loaded on first use (see parsers.py).
+    PARSE_CACHES = {mode: ParseCache(mode) for mode in PARSER_MODES}
+    PARSE_CACHE = PARSE_CACHES["lalr"]
 
-    def __init__(self):
+    def __init__(self, parser_mode: str = "lalr", calc_mode: str = "automatic"):
         # Initialize a new empty workbook.
 
+        # Parser used for the formulas of this workbook ("lalr" or "earley")
+        if parser_mode not in self.PARSE_CACHES:
+            raise ValueError(f"{parser_mode} is not a valid parser mode")
+        self.parser_mode = parser_mode
+        self._parse_cache = self.PARSE_CACHES[parser_mode]
+        # Calculation mode (see CALC_MODES) and, in lazy and manual modes,
+        # the keys of the cells whose values are out of date.  Every cell
+        # depending on a dirty cell is dirty too.
+        if calc_mode not in CALC_MODES:
+            raise ValueError(f"{calc_mode} is not a valid calculation mode")
+        self._calc_mode = calc_mode
+        self._dirty = set()
+        # Lazy mode: the dirty cells that do need computing, because their
+        # formula was set or a cell they read changed value.  The other dirty
+        # cells only depend on one of these, and keep their value if nothing
+        # they read turns out to change.
+        self._stale = set()
+        # Number of batches begun and not committed (see begin_batch)
+        self._batch_depth = 0
+        # Lazy mode: keys of the formulas not computed since they were set,
+        # whose edges in the graph are all the cells they reference rather
+        # than the cells they read
+        self._provisional = set()
+        # Snapshots (see snapshot): the version of the next one, the number
+        # of live snapshots of each version and the newest of them, and the
+        # versions of the snapshots released since (see _prune_versions)
+        self._version = 0
+        self._snapshots = {}
+        self._newest_snapshot = -1
+        self._released = []
+        # (Sheet, loc) -> (end, contents, value) states a cell had before it
+        # changed, oldest first, kept while a snapshot may read them: the
+        # snapshots of the versions before end, and from the end of the state
+        # before, read that state (see _keep_version)
+        self._history = {}
+
         # List containing all of the sheets in the Workbook
         self.sheets = []
         # Dict mapping lower case sheet names to index in the self.sheets list
@@ -62,25 +138,147 @@ class Workbook:
         self.sheet_num = 0
         # Next default number if no sheet_name is input
         self.default_sheet_nums = set()
-        # Formula parser
-        # self.parser = Lark.open('sheets/formulas.lark', start='formula')
-        # Sheet name -> [ list of cells]
-        self.floating_cells = defaultdict(list)
-        # (cell sheet name, cell loc) -> cell object
-        self.bad_ref_cells = defaultdict(Cell)
+        # Dependencies between all the cells of the workbook
+        self.graph = DependencyGraph()
+        # Recalculation computes the connected parts of the cells to
+        # recompute that read at least parallel_threshold cells, and
+        # parallel_reads_per_cell cells per cell of the part, in up to
+        # recalc_workers processes (default: one per CPU), if there are
+        # several of them (see _recalc_in_parallel)
+        self.recalc_workers = None
+        self.parallel_threshold = PARALLEL_THRESHOLD
+        self.parallel_reads_per_cell = READS_PER_CELL
+        # The async methods (see aset_cell_contents) compute this many cells
+        # at a time before letting other tasks run
+        self.async_chunk_size = ASYNC_CHUNK_SIZE
         # Notifications cells list
         self.notification_functions = []
         # Cells whose values have been updated
         self.updated_cells = []
         # get_functions returns dictionary {func_name_str : func()}
         self.functions = functions()
-        self.fp = FormulaParser(self)
+        self.context = EvaluationContext(self)
+        self.compiler = FormulaCompiler(self.functions)
+        # Compiled formulas shared between cells with the same R1C1 form
+        self.templates = FormulaTemplates(self.compiler, self._parse_formula,
+                                          self._parse_formulas)
 
 
     def get_functions(self):
         # Return the dictionary of functions defined by functions.py
         return self.functions
 
+    def get_calc_mode(self) -> str:
+        return self._calc_mode
+
+    def set_calc_mode(self, calc_mode: str) -> None:
+        # Switch the calculation mode (see CALC_MODES).  Switching to
+        # automatic mode computes every dirty cell.
+        if calc_mode not in CALC_MODES:
+            raise ValueError(f"{calc_mode} is not a valid calculation mode")
+        self._calc_mode = calc_mode
+        if calc_mode == "automatic" and self._dirty and not self._batch_depth:
+            self._clean(list(self._dirty))
+            self._notify_cells_helper(self.updated_cells)
+
+    def recalculate(self, sheet_name: Optional[str] = None,
+                    region: Optional[str] = None) -> None:
+        # Bring the out of date cells up to date, as needed in manual mode,
+        # in a single pass in topological order, and notify the cells whose
+        # value changed.  Without arguments every cell is computed; given a
+        # sheet name, the cells of that sheet, and given a region of it as
+        # "A1:Z100" or "A1", the cells of the region.  The out of date cells
+        # they read, directly or not, are computed too, wherever they are.
+        #
+        # If the sheet name is not found, a KeyError is raised.  If the region
+        # is invalid, or given without a sheet name, a ValueError is raised.
+        if sheet_name is None:
+            if region is not None:
+                raise ValueError("A region needs a sheet name")
+            keys = list(self._dirty)
+        else:
+            if sheet_name[0] == "'" and sheet_name[-1] == "'":
+                sheet_name = sheet_name[1:-1]
+            if sheet_name.lower() not in self.sheet_to_idx:
+                raise KeyError(f"{sheet_name} is not a valid sheet!")
+            sheet_key = sheet_name.lower()
+            keys = [key for key in self._dirty
+                    if key[0] == sheet_key and not self.graph.is_range(key)]
+            if region is not None:
+                corners = region.split(":")
+                if len(corners) > 2 or not all(corners):
+                    raise ValueError(f"{region} is an invalid region")
+                (top, left), (bottom, right) = (
+                    self._row_col(self._check_loc(sheet_name, corner.upper())[1])
+                    for corner in (corners[0], corners[-1]))
+                top, bottom = min(top, bottom), max(top, bottom)
+                left, right = min(left, right), max(left, right)
+                keys = [key for key, (row, col) in
+                        ((key, self._row_col(key[1])) for key in keys)
+                        if top <= row <= bottom and left <= col <= right]
+        self._clean(keys)
+        self._notify_cells_helper(self.updated_cells)
+
+    def get_level_widths(self, sheet_name: str, location: str) -> List[int]:
+        # Return the number of cells in each topological level of the cells
+        # recomputed when the specified cell changes: the cells of a level
+        # only read cells of the levels before it, so they can be computed in
+        # parallel (see _recalc_by_level).  Cells on a cycle are left out.
+        #
+        # If the specified sheet name is not found, a KeyError is raised.
+        # If the cell location is invalid, a ValueError is raised.
+        sheet, loc = self._check_loc(sheet_name, location)
+        key = (sheet.get_name().lower(), loc)
+        order, _ = self.graph.recalc_order({key})
+        order = [other for other in order if other != key]
+        return [sum(not self.graph.is_range(other) for other in level)
+                for level in levels(self.graph, order)]
+
+    def snapshot(self) -> Snapshot:
+        # Return a read-only view of the contents and values of the cells of
+        # the workbook as they are now, which later changes do not affect
+        # (see Snapshot).  Out of date cells are computed first, as reading
+        # them would, except in manual mode.
+        if self._dirty and self._calc_mode != "manual":
+            self._clean(list(self._dirty))
+            self._notify_cells_helper(self.updated_cells)
+        if self._released:
+            self._prune_versions()
+        version = self._version
+        self._version += 1
+        self._snapshots[version] = self._snapshots.get(version, 0) + 1
+        self._newest_snapshot = version
+        return Snapshot(self, version, self.sheets)
+
+    @contextmanager
+    def batch(self):
+        # Group edits: with wb.batch(): ... runs begin_batch() before the
+        # block and commit_batch() after it, even if it raises
+        self.begin_batch()
+        try:
+            yield self
+        finally:
+            self.commit_batch()
+
+    def begin_batch(self) -> None:
+        # Start a batch of edits.  Until the batch is committed, any number
+        # of cell writes, copies, moves and sheet operations only update the
+        # dependency graph and mark the cells they affect dirty, as in lazy
+        # mode, and no notification is sent.  Batches can be nested; only
+        # committing the outermost one ends the batch.
+        self._batch_depth += 1
+
+    def commit_batch(self) -> None:
+        # End a batch begun with begin_batch().  In automatic mode the cells
+        # changed by the batch are recomputed together, each once, in
+        # topological order, and the cells whose value changed are notified
+        # once.  The edits of a batch are not undone if it fails part way.
+        if not self._batch_depth:
+            raise ValueError("No batch to commit")
+        self._end_batch()
+        if not self._batch_depth and self.updated_cells:
+            self._notify_cells_helper(self.updated_cells)
+
     def num_sheets(self) -> int:
         # Return the number of spreadsheets in the workbook.
         return self.sheet_num
@@ -149,23 +347,8 @@ class Workbook:
         self.sheets.append(sheet)
         self.sheet_num += 1
 
-        # If this sheet is in our floating cells list, we want to fill out the new sheet with
-        # previous cells that were assigned to this sheet, keeping the contents
-        # and children
-        if sheet_name.lower() in self.floating_cells.keys():
-            cells = self.floating_cells[sheet_name.lower()]
-            for cell in cells:
-                cell_sheet_name, cell_loc, child_cell_contents = cell.get_info()
-                for (child_sheet_name, child_loc) in cell.get_children_cells():
-                    self.set_cell_contents(
-                        child_sheet_name, child_loc, child_cell_contents, False)
-                self.set_cell_contents(cell_sheet_name, cell_loc, None, False)
-
-            # Remove this sheet from the floating cells "workbook"
-            del self.floating_cells[sheet_name.lower()]
-
-        # Update any cells that might correspond to the new sheet
-        self._update_bad_ref(sheet_name)
+        # Update any cells that referenced the sheet before it existed
+        self._update_sheet_references(sheet_name.lower())
         self._notify_cells_helper(self.updated_cells)
         return (self.sheet_num - 1, sheet_name)
 
@@ -203,8 +386,13 @@ class Workbook:
         self.sheets.pop(idx)
         self.sheet_num -= 1
 
-        # Update all cells affected
-        self._update_cells(cells, sheet)
+        # Drop the dependencies of the deleted cells and update the cells
+        # that referenced the sheet
+        for loc in cells:
+            self.graph.set_parents((sheet_name.lower(), loc), ())
+            self._discard_pending((sheet_name.lower(), loc))
+        self._update_sheet_references(sheet_name.lower())
+        self._notify_cells_helper(self.updated_cells)
 
     def get_sheet_extent(self, sheet_name: str) -> Tuple[int, int]:
         # Return a tuple (num-cols, num-rows) indicating the current extent of
@@ -252,33 +440,35 @@ class Workbook:
         sheet, loc = self._check_loc(sheet_name, location.upper())
 
         # Store the previous cell if it exists
-        prev_cell = None
-        if loc in sheet.get_cells().keys():
-            prev_cell = sheet.get_cell(loc)
-        elif (sheet_name,loc) in self.bad_ref_cells.keys():
-            prev_cell = self.bad_ref_cells.pop((sheet_name,loc))
+        prev_cell = sheet.get_cells().get(loc)
 
         # Create a new cell with the new given contents and strip it
         new_cell = Cell(sheet_name, loc, contents)
         content = new_cell.parse_cell()
-        value = None
-        prev_parent_cells = []
-        new_parent_cells = []
-        # Carry the children cells over from previous cell if it exists
-        if prev_cell is not None:
-            new_cell.set_children_cells(prev_cell.get_children_cells())
-            prev_parent_cells = set(prev_cell.get_parent_cells())
+        new_parent_cells = set()
+        key = (sheet_name.lower(), loc)
+        evaluated = True
 
         # If the new_cell is a formula:
         if new_cell.get_formula_cell_flag():
             try:
-                # Parse the content of the formula and get/set the value
-                tree = self.PARSER.parse(content)
-                self.fp.new_parsing(sheet_name, self)
-                value = self.fp.visit(tree)  
-                new_cell.set_value(value)
-                # Get the parent cells from the formula parser
-                new_parent_cells = set(self.fp.get_parent_cells())
+                # Compile the content of the formula and get/set the value
+                new_cell.set_compiled_formula(
+                    self._compile_formula(content, new_cell))
+                if self._deferred():
+                    new_parent_cells = self._static_parent_cells(new_cell)
+                if self._deferred() and new_parent_cells:
+                    # The formula is computed when read.  Until then its
+                    # references stand in for the cells it reads, and it
+                    # keeps the old value to tell whether it changed.  A
+                    # formula without references reads no cell, so it is
+                    # computed right away.
+                    new_cell.set_value(prev_cell.get_value() if prev_cell else None)
+                    self._provisional.add(key)
+                    evaluated = False
+                else:
+                    value, new_parent_cells = self._evaluate_formula(new_cell)
+                    new_cell.set_value(value)
 
             except (exceptions.LarkError, exceptions.UnexpectedCharacters) as e:
                 # If the formula can't be parsed, then set the value
@@ -290,165 +480,92 @@ class Workbook:
         # If the new_cell is not a formula
         else:
             # If the contents is an error, set value as error
-            if content in _ERROR_TYPES.keys():
-                new_cell.set_value(CellError(_ERROR_TYPES[content], detail=f"{str(content)}"))
+            if content in ERROR_TYPES.keys():
+                new_cell.set_value(CellError(ERROR_TYPES[content], detail=f"{str(content)}"))
             # Otherwise, set the value as is
             else:
                 new_cell.set_value(content)
 
-        # If the parent cells are not the same, then remove the children from the previous parents
-        if prev_parent_cells != new_parent_cells:
-            for (p_sheet, p_loc) in prev_parent_cells:
-                try:
-                    p_cell = self.sheets[self.sheet_to_idx[p_sheet.lower()]].get_cell(p_loc.upper())
-                    p_cell_children = p_cell.get_children_cells()
-                    p_cell_children.remove((sheet_name.lower(), loc.upper()))
-                    p_cell.set_children_cells(p_cell_children)
-                except (KeyError, ValueError):
-                    continue
-        
-        # Update the new parent cells
-        new_cell.set_parent_cells(list(new_parent_cells))
+        # Only the edges of this cell change in the dependency graph.  The
+        # cells of a cycle it broke need computing again.
+        rewired = self.graph.set_parents(key, new_parent_cells)
+        uncycled = list(self.graph.take_uncycled() - {key})
 
         # Check if the value is updated for the new cell
-        if (not prev_cell and new_cell.get_value() is not None) or (
+        if not evaluated:
+            pass
+        elif (not prev_cell and new_cell.get_value() is not None) or (
                 prev_cell is not None and new_cell.get_value() != prev_cell.get_value()):
             u_sheet_name, u_loc, _ = new_cell.get_info()
             self.updated_cells.append((u_sheet_name, u_loc))
 
-        # Check if the new cell is a bad reference
-        if isinstance(new_cell.get_value(), CellError) and new_cell.get_value(
-        ).get_type() == CellErrorType.BAD_REFERENCE:
-            self.bad_ref_cells[(sheet_name.lower(), loc.upper())] = new_cell
-
         # Update sheet.cells with the new_cell
+        self._keep_version(key)
         sheet.set_cell(loc, new_cell)
 
         # Update sheet extent
-        sheet.update_sheet_extent()
-        # Update the children_cells of the parent cells
-        self._update_children_cells(new_cell, sheet_name, loc)
-        # Check for circular dependencies in the newly set cell by iterating through children
-        # until the first cell visited is encountered again
-        circular_dependency_detected, visited_children = \
-                self._check_circular_dependency(sheet_name, loc)
-        
-
-        # If there is circular dependency: new_cell value is the error
-        # Otherwise update the values of all the children of new_cell
-        if circular_dependency_detected:
-            for cell in visited_children:
-                # GETTING OVERWRITTEN HERE
-                # if not isinstance(cell.get_value(), CellError):
-                cell.set_value(
-                    CellError(
-                        CellErrorType.CIRCULAR_REFERENCE,
-                        detail="Circular reference detected"))
-        # If there is no circular dependency, create a dependency graph
-        else:
-            if new_cell.get_children_cells() != []:
-                dependency_graph = Graph(defaultdict(list), 0)
-                dependency_graph = self._build_dependency_graph(
-                    new_cell, dependency_graph)
-                cells_in_dependency_graph = []
-                # Go through all keys (parent node) and values (children nodes)
-                # to find all nodes in graph
-                for key in dependency_graph.graph:
-                    cells_in_dependency_graph.append(key)
-                    for value in dependency_graph.graph[key]:
-                        cells_in_dependency_graph.append(value)
-                # Ensure no duplicates
-                cells_in_dependency_graph = list(
-                    set(cells_in_dependency_graph))
-                num_of_cells = len(cells_in_dependency_graph)
-                # Convert Cell objects to numeric equivalents to perform
-                # topological sort
-                dependency_graph_numeric_form = defaultdict(list)
-                # 2-way mapping of Cell objects to an index
-                # Index used as proxy to Cell object after topological sort
-                index_to_cell_dict = {}  # { Cell object : index (integer) }
-                cell_to_index_dict = {}  # { index: Cell object }
-                for i, cell in enumerate(cells_in_dependency_graph):
-                    index_to_cell_dict[i] = cell
-                    cell_to_index_dict[cell] = i
-
-                # Build dependency graph in numeric form without recursion
-                for i, cell in enumerate(cell_to_index_dict.keys()):
-                    if cell.get_children_cells == []:
-                        continue
-                    for child_cell_tuple in cell.get_children_cells():
-                        child_cell_sheet_name = child_cell_tuple[0]
-                        child_cell_location = child_cell_tuple[1]
-                        child_cell_sheet_idx = self.sheet_to_idx[child_cell_sheet_name.lower(
-                        )]
-                        child_cell = self.sheets[child_cell_sheet_idx].get_cell(
-                            child_cell_location)
-                        parent_cell_numeric = cell_to_index_dict[cell]
-                        child_cell_numeric = cell_to_index_dict[child_cell]
-
-                        dependency_graph_numeric_form[parent_cell_numeric].append(
-                            child_cell_numeric)
-                        
-                numeric_g = Graph(dependency_graph_numeric_form, num_of_cells)
-                # numeric_g.graph = dependency_graph_numeric_form
-                # numeric_g.v = num_of_cells
-                # Perform topological sort
-                order = numeric_g.topological_sort()
-                cell_order_evaluation = []
-                for pos in order[1:]:
-                    if index_to_cell_dict[pos] not in cell_order_evaluation:
-                        cell_order_evaluation.append(index_to_cell_dict[pos])
-
-                # Update the values of the cells according to the order
-                # given by the topological sort
-                for cell in cell_order_evaluation:
-                    sheet_name, loc, contents = cell.get_info()
-                    old_val = cell.get_value()
-                    if (sheet_name, loc, contents) != new_cell.get_info():
-                        # If the new cell is a formula, parse it and set the value
-                        if cell.get_formula_cell_flag():
-                            try:
-                                tree = self.PARSER.parse(contents)
-                                self.fp.new_parsing(sheet_name, self)
-                                value = self.fp.visit(tree)  
-                                cell.set_value(value)
-                                cell.set_parent_cells(list(set(self.fp.get_parent_cells())))
-                            except (exceptions.LarkError, exceptions.UnexpectedCharacters) as e:
-                                # If the formula can't be parsed, then set the
-                                # value accordingly
-                                cell.set_value(
-                                    CellError(
-                                        CellErrorType.PARSE_ERROR,
-                                        detail=f'{contents} could not be parsed'))
-                        # If the cell is not a formula, we dont't need to
-                        # update anything
-                        else:
-                            pass
-                    
-                    # Update the children cells of the new cell
-                    self._update_children_cells(cell, sheet_name, loc)
+        sheet.update_sheet_extent(new_cell, prev_cell)
 
-                    # Add the cell to nofitications if the value changes
-                    if cell.get_value() != old_val:
-                        self.updated_cells.append((sheet_name, loc))
+        # Update the values of the cells that depend on the new cell.  They
+        # only need computing if its value changed, or if it reads a new cell
+        # and so may have closed a cycle.
+        if not evaluated:
+            self._cells_changed([key] + uncycled)
+        else:
+            self._discard_pending(key)
+            old_val = prev_cell.get_value() if prev_cell is not None else None
+            if rewired or uncycled or not _same_value(old_val, new_cell.get_value()):
+                self._cells_changed(uncycled, [key])
 
-                # With the new cell contents, check if there is a circular dependency
-                circular_dependency_detected, visited_children = \
-                        self._check_circular_dependency(sheet_name, loc)
-                
-                # If there is a circular dependency, set all relevant cells to
-                # the CIRCULAR_REFERENCE error
-                if circular_dependency_detected:
-                    for cell in visited_children:
-                        cell.set_value(
-                            CellError(
-                                CellErrorType.CIRCULAR_REFERENCE,
-                                detail="Circular reference detected"))
         # Notify cells that have been updated
         # Check that some cell values have been updated
         if len(self.updated_cells) != 0 and notify:
             self._notify_cells_helper(self.updated_cells)
 
+    def set_cells_contents(self, sheet_name: str,
+                           cells: Dict[str, Optional[str]]) -> None:
+        # Set the contents of many cells of the specified sheet in one call,
+        # given a dict of location -> contents, as set_cell_contents() would
+        # one at a time.
+        #
+        # Every location is checked before any cell is set: if the sheet name
+        # is not found, a KeyError is raised, and if a location is invalid, a
+        # ValueError is raised, leaving the workbook unchanged.
+        #
+        # The formulas are compiled together, and the cells depending on the
+        # new contents are recomputed once, in dependency order, after all of
+        # them are set.  A single notification is sent for the cells whose
+        # value changed.
+        if sheet_name[0] == "'" and sheet_name[-1] == "'":
+            sheet_name = sheet_name[1:-1]
+        checked = []
+        for location, contents in cells.items():
+            _, loc = self._check_loc(sheet_name, location.upper())
+            checked.append((loc, contents))
+        self._set_many(sheet_name, checked)
+
+    def set_region_contents(self, sheet_name: str, start_location: str,
+                            rows: List[List[Optional[str]]]) -> None:
+        # Set the contents of a rectangle of cells from a list of rows, each
+        # a list of contents, with rows[0][0] going into start_location, the
+        # top-left cell.  Rows may have different lengths; a contents of None
+        # empties its cell.  Behaves as set_cells_contents().
+        if sheet_name[0] == "'" and sheet_name[-1] == "'":
+            sheet_name = sheet_name[1:-1]
+        _, start = self._check_loc(sheet_name, start_location.upper())
+        top, col = self._extract_row_col_from_loc(start)
+        left = self._column_index_from_string(col)
+        checked = []
+        for i, row in enumerate(rows):
+            for j, contents in enumerate(row):
+                try:
+                    loc = self._cell_loc_str_from_indexes((top + i, left + j))
+                except ValueError:
+                    raise ValueError(
+                        f"The region at {start_location} is out of bounds")
+                checked.append((loc, contents))
+        self._set_many(sheet_name, checked)
+
     def get_cell_contents(
             self,
             sheet_name: str,
@@ -505,6 +622,13 @@ class Workbook:
         if loc not in sheet.get_cells().keys():
             return None
 
+        # In lazy mode, compute the cell first if it is out of date.  In
+        # manual mode it keeps its old value until recalculate() is called.
+        key = (sheet.get_name().lower(), loc)
+        if key in self._dirty and self._calc_mode != "manual":
+            self._clean([key])
+            self._notify_cells_helper(self.updated_cells)
+
         # Return the contents of the sheet
         return sheet.get_cell(loc).get_value()
 
@@ -516,7 +640,10 @@ class Workbook:
         #
         # If an IO write error occurs (unlikely but possible), let any raised
         # exception propagate through.
+        json.dump(self._json_dict(), fp)
 
+    def _json_dict(self):
+        # The JSON object save_workbook writes
         json_dict = {}
         # The json will be formatted so that
         # "sheets": sheets_value_list
@@ -540,8 +667,7 @@ class Workbook:
             sheets_value_list.append(sheets_dict)
 
         json_dict["sheets"] = sheets_value_list
-
-        json.dump(json_dict, fp)
+        return json_dict
 
     @staticmethod
     def load_workbook(fp: TextIO) -> Workbook:
@@ -566,10 +692,19 @@ class Workbook:
         wb = Workbook()
         with open(fp, 'r') as f:
             json_str = f.read()
+        for sheet_name, sheet_cells in Workbook._sheets_from_json(json_str):
+            wb.new_sheet(sheet_name)
+            wb._set_many(sheet_name, sheet_cells.items())
+        return wb
+
+    @staticmethod
+    def _sheets_from_json(json_str):
+        # The (name, cell-contents) of the sheets of a workbook in JSON
+        # format, checked as load_workbook describes
         loaded_workbook_dict = json.loads(json_str)
         # Loading empty json should result in empty workbook
         if not loaded_workbook_dict:
-            return wb
+            return []
 
         if "sheets" not in loaded_workbook_dict:
             raise KeyError('Expected "sheets" key in json')
@@ -579,6 +714,7 @@ class Workbook:
 
         # Accessing "sheets" list from json
         sheets_in_wb = loaded_workbook_dict["sheets"]
+        sheets = []
         for sheet in sheets_in_wb:
             # Each element in sheets_in_wb list (iterating through value
             # of key "sheets") should be of type dictionary with keys
@@ -602,8 +738,6 @@ class Workbook:
                 raise TypeError(
                     "A sheet has cell-contents that is not in dictionary form")
 
-            # Add new sheet and associated cells if no errors so far
-            wb.new_sheet(sheet_name)
             for cell in sheet_cells:
                 if not isinstance(cell, str):
                     raise TypeError("A cell location is not a string")
@@ -612,7 +746,58 @@ class Workbook:
                 if not isinstance(cell_content, str):
                     raise TypeError("A cell's content is not a string")
 
-                wb.set_cell_contents(sheet_name, cell, cell_content)
+            sheets.append((sheet_name, sheet_cells))
+        return sheets
+
+    async def aset_cell_contents(self, sheet_name: str, location: str,
+                                 contents: Optional[str]) -> None:
+        # set_cell_contents for asyncio.  The cells depending on the cell are
+        # computed async_chunk_size at a time, and other tasks run between
+        # the chunks (see _arecalculate).  Until then the workbook is in a
+        # batch: reading a cell computes it, and the changed cells are
+        # notified once, at the end.  Raises the errors set_cell_contents
+        # raises.
+        with self.batch():
+            self.set_cell_contents(sheet_name, location, contents)
+            if self._calc_mode == "automatic":
+                await self._arecalculate()
+
+    async def aset_cells_contents(self, sheet_name: str,
+                                  cells: Dict[str, Optional[str]]) -> None:
+        # set_cells_contents for asyncio, as aset_cell_contents
+        with self.batch():
+            self.set_cells_contents(sheet_name, cells)
+            if self._calc_mode == "automatic":
+                await self._arecalculate()
+
+    async def asave(self, fp: TextIO) -> None:
+        # save_workbook for asyncio.  The out of date cells are computed
+        # first as in aset_cell_contents, except in manual mode, and the file
+        # is written in a worker thread.
+        if self._calc_mode != "manual":
+            with self.batch():
+                await self._arecalculate()
+        await asyncio.to_thread(json.dump, self._json_dict(), fp)
+
+    @staticmethod
+    async def aload(fp: TextIO) -> Workbook:
+        # load_workbook for asyncio.  The file is read in a worker thread,
+        # and the cells are set and then computed async_chunk_size at a
+        # time, other tasks running between the chunks.  Raises the errors
+        # load_workbook raises.
+        def read():
+            with open(fp, 'r') as f:
+                return f.read()
+        json_str = await asyncio.to_thread(read)
+        wb = Workbook()
+        with wb.batch():
+            for sheet_name, sheet_cells in Workbook._sheets_from_json(json_str):
+                wb.new_sheet(sheet_name)
+                cells = list(sheet_cells.items())
+                for start in range(0, len(cells), wb.async_chunk_size):
+                    wb._set_many(sheet_name, cells[start:start + wb.async_chunk_size])
+                    await asyncio.sleep(0)
+            await wb._arecalculate()
         return wb
 
     def move_sheet(self, sheet_name: str, index: int):
@@ -689,12 +874,11 @@ class Workbook:
         self.new_sheet(copy_name)
 
         # Set cells in new sheet to be cells of copied sheet
-        for cell_loc in cells_to_be_copied:
-            old_cell_contents = cells_to_be_copied[cell_loc].get_contents()
-            self.set_cell_contents(copy_name, cell_loc, old_cell_contents, notify=False)
+        self._set_many(copy_name,
+                       [(cell_loc, cell.get_contents())
+                        for cell_loc, cell in list(cells_to_be_copied.items())],
+                       notify=False)
 
-        # Update any cells that have parents with sheet name copy_cell
-        self._update_bad_ref(copy_name)
         self._notify_cells_helper(self.updated_cells)
         return (self.sheet_num - 1, copy_name)
 
@@ -744,65 +928,48 @@ class Workbook:
             num = int(sheet_name[5::])
             self.default_sheet_nums.remove(num)
 
-        # Set the new name of the sheet
-        temp_sheet = copy.deepcopy(sheet)
+        old_sheet, new_sheet = sheet_name.lower(), new_sheet_name.lower()
+        # Formulas referencing the sheet, found before its cells move
+        referencing = set()
+        for key in self.graph.keys_in_sheet(old_sheet):
+            referencing |= self.graph.children(key)
+
+        # Set the new name of the sheet and update the sheet name to idx
+        # dictionary
         sheet.set_name(new_sheet_name)
+        idx = self.sheet_to_idx.pop(old_sheet)
+        self.sheet_to_idx[new_sheet] = idx
 
-        # Updating sheet name to idx dictionary
-        idx = self.sheet_to_idx.pop(sheet_name.lower())
-        self.sheet_to_idx[new_sheet_name.lower()] = idx
-        self.sheets[idx] = sheet
-
-        # Temporarily keep the old sheet for computation
-        self.sheets.append(temp_sheet)
-        self.sheet_to_idx[sheet_name.lower()] = len(self.sheets) - 1
-        # Update the sheets list with the newly named sheet
-        self.sheets[idx] = sheet
-        # Update all related cells in the sheet
-        cells = sheet.get_cells()
-        for cell_loc in cells:
-            # For each cell in the sheet:
-            cell = sheet.get_cell(cell_loc)
-            # For each child of the cell
-            for (child_sheet, child_loc) in cell.get_children_cells():
-                child = self.get_sheet(child_sheet.lower()).get_cell(child_loc)
-                # if the child is a formula, we will compute on it
-                if child.get_formula_cell_flag():
-                    # Compute the new formula with the changed name
-                    contents = self._update_formula(
-                        child, sheet_name, new_sheet_name, None)
-                    # Update the contents/value of the cell
-                    self.set_cell_contents(child_sheet, child_loc, contents, notify=False)
-                    # Remove the tuple of the old name and add the new one to
-                    # the parents
-            # For each parent of the cell
-            for (parent_sheet, parent_loc) in cell.get_parent_cells():
-                parent = self.get_sheet(
-                    parent_sheet.lower()).get_cell(parent_loc)
-                # Remove the tuple of the old name and add the new one to the
-                # children
-                try:
-                    children_of_parents = parent.get_children_cells()
-                    children_of_parents.remove((sheet_name.lower(), cell_loc.upper()))
-                    children_of_parents.append((new_sheet_name.lower(), cell_loc.upper()))
-                    parent.set_children_cells(children_of_parents)
-                except ValueError:
+        # The formulas are rewritten in a batch (see begin_batch), so the
+        # cells depending on them are recomputed once at the end
+        self._batch_depth += 1
+        try:
+            # The cells of the sheet are now under the new name: drop the
+            # dependencies of their old keys and set each of them again,
+            # with their own references to the sheet renamed
+            cells = list(sheet.get_cells().items())
+            for cell_loc, _ in cells:
+                self.graph.set_parents((old_sheet, cell_loc), ())
+                self._discard_pending((old_sheet, cell_loc))
+            self._set_many(new_sheet_name,
+                           [(cell_loc, self._update_formula(cell, sheet_name, new_sheet_name, None))
+                            for cell_loc, cell in cells],
+                           notify=False)
+
+            # Rename the references in the formulas of the other sheets
+            for (child_sheet, child_loc) in referencing:
+                child = self._get_cell((child_sheet, child_loc))
+                if child is None or child_sheet == old_sheet:
                     continue
-
-            # If the cell is a formula, update it with the new sheet name if we need to
-            # Recalculate the value of the cell with the new formula
-            if cell.get_formula_cell_flag():
-                contents = self._update_formula(
-                    cell, sheet_name, new_sheet_name, None)
-            else:
-                contents = cell.get_contents()
-            self.set_cell_contents(new_sheet_name, cell_loc, contents, notify=False)
-
-        idx = self.sheet_to_idx.pop(sheet_name.lower())
-        del self.sheets[idx]
-        # Update any cells that may have parents with new_sheet_name
+                contents = self._update_formula(child, sheet_name, new_sheet_name, None)
+                self.set_cell_contents(child_sheet, child_loc, contents, notify=False)
+
+            # Update any cells that referenced new_sheet_name before it
+            # existed
+            self._update_sheet_references(new_sheet)
+        finally:
+            self._end_batch()
         self._notify_cells_helper(self.updated_cells)
-        self._update_bad_ref(new_sheet_name)
 
     def notify_cells_changed(self,
                              notify_function) -> None:
@@ -880,18 +1047,20 @@ class Workbook:
         if to_sheet is None:
             to_sheet = sheet_name
 
-        # "Delete" contents of cells that were selected to be moved
-        for cell in cells_to_copy:
-            self.set_cell_contents(sheet_name, cell.get_info()[1], None, False)
-
-        # "Paste" contents of copied cells into destination cells
-        for i, cell_loc_str in enumerate(destination_cell_loc_strings):
-            # Update formula of cell, then set contents
-            self.set_cell_contents(
-                to_sheet,
-                cell_loc_str,
-                destination_cell_contents[i], False)
-            
+        # The cells are cleared and set in a batch (see begin_batch), so the
+        # cells depending on them are recomputed once at the end
+        self._batch_depth += 1
+        try:
+            # "Delete" contents of cells that were selected to be moved
+            for cell in cells_to_copy:
+                self.set_cell_contents(sheet_name, cell.get_info()[1], None, False)
+
+            # "Paste" contents of copied cells into destination cells
+            self._set_many(to_sheet,
+                           zip(destination_cell_loc_strings, destination_cell_contents),
+                           notify=False)
+        finally:
+            self._end_batch()
         self._notify_cells_helper(self.updated_cells)
 
     def copy_cells(
@@ -948,12 +1117,9 @@ class Workbook:
             to_sheet = sheet_name
 
         # "Paste" contents of copied cells into destination cells
-        for i, cell_loc_str in enumerate(destination_cell_loc_strings):
-            # Update formula of cell, then set contents
-            self.set_cell_contents(
-                to_sheet,
-                cell_loc_str,
-                destination_cell_contents[i], False)
+        self._set_many(to_sheet,
+                       zip(destination_cell_loc_strings, destination_cell_contents),
+                       notify=False)
         self._notify_cells_helper(self.updated_cells)
 
             
@@ -1116,24 +1282,95 @@ class Workbook:
     ################################ PRIVATE FUNCTIONS ###############################
     ##################################################################################
     def _update_formula(self, cell, sheet_name, new_sheet_name, move):
-        # Helper function to rewrite the formula
+        # Helper function to rewrite the formula.  Only the references are
+        # rewritten, without parsing the formula; the rest of the contents
+        # keep their formatting.  move is the (column, row) shift of the cell
+        # for move/copy_cells, or None to rename the sheet_name references.
         contents = cell.get_contents()
         # If the contents exist and is a formula
         if contents is not None and contents[0] == "=":
-            try:
-                tree = self.PARSER.parse(cell.get_contents())
-                # Add outside quotes to the new sheet name if it needs it (has a
-                # space)
-                if ' ' in new_sheet_name:
-                    new_sheet_name = "'" + new_sheet_name + "'"
-                fe = FormulaEditor(self, sheet_name, new_sheet_name, move)
-                parsed = fe.transform(tree)
-                # Add the formula sign back to the contents
-                return "=" + parsed.children[0]
-            except (exceptions.LarkError, exceptions.UnexpectedCharacters) as e:
-                return cell.get_contents()
+            if move:
+                return shift_references(contents, move[0], move[1])
+            return rename_sheet_references(contents, sheet_name, new_sheet_name)
         return contents
-    
+
+    def _parse_formula(self, contents):
+        # Parse a formula string into its AST, reusing the cached AST if the
+        # formula was seen before
+        return self._parse_cache.parse(contents)
+
+    def _parse_formulas(self, formulas):
+        # Parse a list of formula strings in one batch, returning a dict of
+        # formula -> AST of the ones that parse
+        return self._parse_cache.parse_many(formulas)
+
+    def _set_many(self, sheet_name, cells, notify=True):
+        # Set the contents of many (location, contents) cells of a sheet, in
+        # order.  The formulas of each batch of cells are compiled together
+        # first (see FormulaTemplates.compile_many), so that identical and
+        # R1C1-equivalent formulas are only parsed once and large batches are
+        # parsed in parallel.  The cells are set in a batch (see begin_batch),
+        # so the cells depending on them are recomputed once at the end.
+        cells = list(cells)
+        self._batch_depth += 1
+        try:
+            for start in range(0, len(cells), _COMPILE_BATCH):
+                batch = cells[start:start + _COMPILE_BATCH]
+                formulas = []
+                for location, contents in batch:
+                    if contents is None:
+                        continue
+                    contents = contents.strip()
+                    if contents[:1] != "=":
+                        continue
+                    try:
+                        row, col = self._extract_row_col_from_loc(location)
+                        col = self._column_index_from_string(col)
+                    except (ValueError, IndexError):
+                        # Bad locations are reported by set_cell_contents
+                        continue
+                    formulas.append((contents, row, col))
+                self.templates.compile_many(formulas)
+                for location, contents in batch:
+                    self.set_cell_contents(sheet_name, location, contents, False)
+        finally:
+            self._end_batch()
+        if notify and self.updated_cells:
+            self._notify_cells_helper(self.updated_cells)
+
+    def _compile_formula(self, contents, cell):
+        # Get the compiled template computing the value of the formula
+        # contents in cell
+        row, col = cell.get_extent()
+        return self.templates.get(contents, row, col)
+
+    def _static_parent_cells(self, cell):
+        # Set of (sheet, loc) of every cell the formula of cell references,
+        # found without evaluating it.  This is a superset of the parents
+        # recorded by evaluation, e.g. both branches of an IF are included.
+        template = cell.get_compiled_formula()
+        if template is None:
+            return set()
+        sheet_name, _, _ = cell.get_info()
+        return reference_cells(template.references, cell.get_extent(), sheet_name)
+
+    def _evaluate_formula(self, cell):
+        # Run the compiled formula of cell at its position.  Returns the value
+        # and the set of parent cells it referenced.
+        self.context.new_parsing(cell.get_info()[0], cell.get_extent())
+        value = cell.get_compiled_formula()(self.context)
+        parent_cells = set(self.context.get_parent_cells())
+        # A formula referencing a sheet that does not exist is a bad
+        # reference as a whole, whatever it does with the reference.  The
+        # reference is still an edge of the graph, so the cell is computed
+        # again when the sheet is created, deleted or renamed.
+        for sheet_name, _ in parent_cells:
+            if sheet_name not in self.sheet_to_idx:
+                value = CellError(CellErrorType.BAD_REFERENCE,
+                                  detail=f"{sheet_name} is not a valid sheet!")
+                break
+        return value, parent_cells
+
     def _new_default_sheet_num(self) -> int:
         # Get the new default num for sheet_name
         return next(
@@ -1141,48 +1378,6 @@ class Workbook:
                 self.default_sheet_nums.__contains__,
                 count(1)))
     
-    def _update_cells(self, update_cells, sheet):
-        # Update all cells in the list update_cells for del_sheet
-        sheet_name = sheet.get_name()
-
-        # Iterate through all of the cells to be updated
-        for loc in update_cells.keys():
-            # Get the cell corresponding to the location
-            cell = sheet.get_cell(loc)
-
-            # Get the children and parents
-            children, parents = cell.get_children_cells(), cell.get_parent_cells()
-
-            # Per child, update the cell contents
-            for child_loc in children:
-                try:
-                    child_sheet = self.get_sheet(child_loc[0])
-                    child = child_sheet.get_cell(child_loc[1])
-                    child_sheet_name, child_loc, contents = child.get_info()
-                    self.set_cell_contents(
-                        child_sheet_name, child_loc, contents, False)
-                except (KeyError, ValueError):
-                    pass
-
-            # Per parent, update the cell contents
-            for parent_loc in parents:
-                try:
-                    parent_sheet = self.get_sheet(parent_loc[0])
-                    parent = parent_sheet.get_cell(parent_loc[1])
-                    parent_sheet_name, parent_loc, contents = parent.get_info()
-
-                    # Remove the current parent from the parent_cells list of the all children
-                    # Update cell contents
-                    c_parent = parent.get_children_cells()
-                    c_parent.remove((sheet_name.lower(), loc.upper()))
-                    parent.set_children_cells(c_parent)
-                    self.set_cell_contents(
-                        parent_sheet_name, parent_loc, contents, False)
-                except (KeyError, ValueError):
-                    pass
-        self._notify_cells_helper(self.updated_cells)
-
-
     def _column_index_from_string(self, col):
         # get the number corresponding to the column string
         col = str(col)
@@ -1211,6 +1406,11 @@ class Workbook:
         cell_loc_str = col_str + str(row)
         return cell_loc_str
 
+    def _row_col(self, location):
+        # Get the row and column indexes of a valid location
+        row, col = self._extract_row_col_from_loc(location)
+        return row, self._column_index_from_string(col)
+
     def _extract_row_col_from_loc(self, location):
         # Extract the row and col from a string location
         loc = ["".join(x)
@@ -1252,103 +1452,459 @@ class Workbook:
         # Return the sheet and the location tuple
         return sheet, location.upper()
     
-    def _check_circular_dependency(self, sheet_name, loc):
-        # Check for circular dependencies in the newly set cell by iterating through children
-        # until the first cell visited is encountered again
-        circular_dependency_detected = False
-        visited_children = []
-        queue_of_cells = [(sheet_name, loc)]
-
-        while len(queue_of_cells) > 0:
-            curr_sheet_name, curr_cell_loc = queue_of_cells.pop(0)
-            curr_sheet_idx = self.sheet_to_idx[curr_sheet_name.lower()]
-            try:
-                curr_cell = self.sheets[curr_sheet_idx].get_cell(curr_cell_loc)
-                # If the current cell is an error, go to the next cell in the
-                # queue
-                if isinstance(curr_cell.get_value(), CellError) and curr_cell.get_value(
-                ).get_type() == CellErrorType.CIRCULAR_REFERENCE:
+    def _get_cell(self, key):
+        # Cell of a (lower case sheet, loc) key, or None if there is none
+        sheet_idx = self.sheet_to_idx.get(key[0])
+        if sheet_idx is None:
+            return None
+        return self.sheets[sheet_idx].get_cells().get(key[1])
+
+    def _cells_changed(self, keys, changed=()):
+        # Bring the cells depending on changed cells up to date, as the
+        # calculation mode says.  The cells of keys need computing; the cells
+        # of changed already have a new value, so the cells reading them do.
+        if self._deferred():
+            self._invalidate(keys, changed)
+        else:
+            self._recalculate(keys, changed)
+
+    def _deferred(self):
+        # Whether changes only mark cells dirty: in lazy mode or in a batch
+        return self._calc_mode != "automatic" or self._batch_depth > 0
+
+    def _end_batch(self):
+        # Leave a batch, computing the dirty cells if it was the outermost
+        # one in automatic mode
+        self._batch_depth -= 1
+        if not self._batch_depth and self._calc_mode == "automatic" and self._dirty:
+            self._clean(list(self._dirty))
+
+    def _recalculate(self, keys, changed=()):
+        # Recompute the cells of keys and the cells reading changed, then
+        # every cell reading a cell whose value changed, in topological
+        # order.  The cells depending on a recomputed cell whose value did
+        # not change are left alone.
+        stale = set(keys)
+        for key in changed:
+            stale |= self.graph.children(key)
+        # The cells of changed are ordered too, to find the cycles they are on
+        roots = stale | set(changed)
+        while roots:
+            order, cyclic = self.graph.recalc_order(roots)
+            order = self._recalc_in_parallel(order, cyclic, stale)
+            # Cells that start reading a new cell (e.g. another IF branch)
+            # may have been ordered too early, or closed a cycle: they are
+            # left in stale, to go again from them in the new order
+            if not self._recalc_by_level(order, cyclic, stale):
+                self._evaluate_cells(order, cyclic, stale)
+            roots = stale
+
+    def _recalc_in_parallel(self, order, cyclic, stale):
+        # Compute the connected parts of order that read enough cells (see
+        # parallel_threshold) in worker processes, when there are several of
+        # them.  No cell outside of a part reads it, and the cells it reads
+        # from outside of it are up to date, so the parts are independent.
+        # Parts joined to a cycle stay in process.  Returns the keys of order
+        # left to compute in process.
+        workers = self.recalc_workers or os.cpu_count() or 1
+        if workers < 2 or part_reads(self.graph, order) < 2 * self.parallel_threshold:
+            return order
+        # Cells without a formula keep their values: they do not join the
+        # parts reading them, such as the input cell of several sheets
+        formulas = [key for key in order if self.graph.is_range(key) or (
+            self._get_cell(key) is not None and
+            self._get_cell(key).get_compiled_formula() is not None)]
+        parts = []
+        for part in components(self.graph, formulas + list(cyclic)):
+            reads = part_reads(self.graph, part)
+            if (reads >= self.parallel_threshold and
+                    reads >= self.parallel_reads_per_cell * len(part) and
+                    not any(key in cyclic for key in part)):
+                parts.append(part)
+        if len(parts) < 2:
+            return order
+
+        payloads = [self._part_payload(part) for part in parts]
+        with ProcessPoolExecutor(min(workers, len(parts))) as executor:
+            results = recalc_parts(executor, self.parser_mode,
+                                   [sheet.get_name() for sheet in self.sheets],
+                                   [payload for payload, _ in payloads])
+        for part, (_, known), values in zip(parts, payloads, results):
+            self._merge_values(part, values, known, stale)
+        computed = set().union(*parts)
+        return [key for key in order if key not in computed]
+
+    def _recalc_by_level(self, order, cyclic, stale):
+        # Compute order one topological level at a time (see
+        # parallel_recalc.levels), the cells of a level being independent of
+        # each other.  The stale cells of the levels that read enough cells
+        # (see parallel_threshold) are split between worker processes, and
+        # the next level waits for all of them; narrow levels are computed in
+        # process.  The levels share the same worker processes.  Returns
+        # False, having computed nothing, if there are cycles or no level is
+        # wide enough.
+        workers = self.recalc_workers or os.cpu_count() or 1
+        if (workers < 2 or cyclic or
+                part_reads(self.graph, order) < self.parallel_threshold):
+            return False
+        grouped = [self._split_level(level) for level in levels(self.graph, order)]
+        if not any(self._wide_level(formulas) for _, formulas, _ in grouped):
+            return False
+
+        with ProcessPoolExecutor(workers) as executor:
+            for values, formulas, ranges in grouped:
+                self._evaluate_cells(values, (), stale)
+                formulas = [key for key in formulas if key in stale]
+                if not self._wide_level(formulas):
+                    self._evaluate_cells(formulas, (), stale)
+                else:
+                    chunks = [formulas[i::workers]
+                              for i in range(min(workers, len(formulas)))]
+                    payloads = [self._part_payload(chunk) for chunk in chunks]
+                    results = recalc_parts(executor, self.parser_mode,
+                                           [sheet.get_name() for sheet in self.sheets],
+                                           [payload for payload, _ in payloads])
+                    for chunk, (_, known), values in zip(chunks, payloads, results):
+                        self._merge_values(chunk, values, known, stale)
+                # The ranges of a level hold cells of it
+                self._evaluate_cells(ranges, (), stale)
+        return True
+
+    def _split_level(self, level):
+        # Split the keys of a level into its cells without a formula, its
+        # cells with one and its ranges
+        values, formulas, ranges = [], [], []
+        for key in level:
+            cell = self._get_cell(key)
+            if cell is None:
+                (ranges if self.graph.is_range(key) else values).append(key)
+            elif cell.get_compiled_formula() is None:
+                values.append(key)
+            else:
+                formulas.append(key)
+        return values, formulas, ranges
+
+    def _wide_level(self, formulas):
+        # Whether the formula cells of a level are worth computing in
+        # several worker processes
+        reads = part_reads(self.graph, formulas)
+        return (len(formulas) > 1 and reads >= self.parallel_threshold and
+                reads >= self.parallel_reads_per_cell * len(formulas))
+
+    def _merge_values(self, keys, values, known, stale):
+        # Give the cells of keys, in topological order, the values a worker
+        # computed for them (see parallel_recalc), as _evaluate_cells would
+        # have computed them: only the stale cells, and the cells reading a
+        # cell whose value changed, take their new value.  Errors come back
+        # as copies, so the cells are notified when their value is not the
+        # same rather than when it is not equal.  values are the (sheet, loc,
+        # value, parents) the worker returned, and known the keys whose
+        # values the worker had.
+        values = {(sheet_name.lower(), loc): (value, parents)
+                  for sheet_name, loc, value, parents in values}
+        for key in keys:
+            self._dirty.discard(key)
+            if key not in stale:
+                continue
+            stale.discard(key)
+            self._provisional.discard(key)
+            if key not in values:
+                stale |= self.graph.children(key)
+                continue
+            value, parents = values[key]
+            cell = self._get_cell(key)
+            if not _same_value(cell.get_value(), value):
+                stale |= self.graph.children(key)
+                self.updated_cells.append(cell.get_info()[:2])
+            self._keep_version(key)
+            cell.set_value(value)
+            # A cell that may have closed a cycle, or read a cell the worker
+            # did not have, is computed again in process
+            if self.graph.set_parents(key, parents) or not parents <= known:
+                stale.add(key)
+            stale.update(self.graph.take_uncycled())
+
+    def _part_payload(self, part):
+        # The (inputs, formulas) of a part of the cells to recompute, as
+        # parallel_recalc takes them, and the set of keys whose values are
+        # in it: the part, and the cells and ranges it reads
+        members = set(part)
+        known = set(part)
+        inputs = {}
+        formulas = []
+        ranges = []
+        for key in part:
+            cell = self._get_cell(key)
+            if cell is None:
+                if self.graph.is_range(key):
+                    ranges.append(key)
+            elif cell.get_compiled_formula() is None:
+                inputs[key] = cell
+            else:
+                formulas.append(cell.get_info())
+            for parent in self.graph.parents(key) - members:
+                known.add(parent)
+                if self.graph.is_range(parent):
+                    ranges.append(parent)
+                elif self._get_cell(parent) is not None:
+                    inputs[parent] = self._get_cell(parent)
+        # The cells in a range are not all parents of it.  The rows of the
+        # ranges over the same columns are merged first, so the cells of
+        # ranges such as B$1:B1 ... B$1:B100 are only visited once.
+        spans = {}
+        for sheet_name, loc in ranges:
+            if sheet_name in self.sheet_to_idx:
+                top, left, bottom, right = self.graph.bounds((sheet_name, loc))
+                spans.setdefault((sheet_name, left, right), []).append((top, bottom))
+        for (sheet_name, left, right), rows in spans.items():
+            cells = self.sheets[self.sheet_to_idx[sheet_name]].get_cells()
+            start = 0
+            for top, bottom in sorted(rows):
+                for row in range(max(top, start), bottom + 1):
+                    for col in range(left, right + 1):
+                        cell = cells.get(loc_str(row, col))
+                        if cell is not None and (sheet_name, cell.get_loc()) not in members:
+                            inputs[(sheet_name, cell.get_loc())] = cell
+                start = max(start, bottom + 1)
+        known.update(inputs)
+        inputs = [cell.get_info()[:2] + (cell.get_value(),) for cell in inputs.values()]
+        return (inputs, formulas), known
+
+    def _invalidate(self, keys, changed=()):
+        # Lazy mode: the cells of keys and the cells reading changed are
+        # stale; mark them and every cell depending on them dirty.  Dirty
+        # cells already have dirty dependents, so the walk stops at them.
+        stale = set(keys)
+        for key in changed:
+            stale |= self.graph.children(key)
+        self._stale |= stale
+        stack = [key for key in stale if key not in self._dirty]
+        self._dirty.update(stack)
+        while stack:
+            for child in self.graph.children(stack.pop()):
+                if child not in self._dirty:
+                    self._dirty.add(child)
+                    stack.append(child)
+
+    async def _arecalculate(self):
+        # Compute the dirty cells, async_chunk_size at a time in topological
+        # order, letting other tasks run between the chunks.  The cells that
+        # become dirty meanwhile, by other tasks, are computed too.
+        while self._dirty:
+            order, cyclic = self.graph.order(set(self._dirty))
+            keys = list(cyclic) + order
+            for start in range(0, len(keys), self.async_chunk_size):
+                self._clean(keys[start:start + self.async_chunk_size])
+                await asyncio.sleep(0)
+
+    def _clean(self, keys):
+        # Lazy mode: bring the dirty cells of keys up to date, after the
+        # dirty cells they read, directly or not.  Only the stale cells and
+        # the cells reading a cell whose value changed are computed.
+        while True:
+            region = {key for key in keys if key in self._dirty}
+            stack = list(region)
+            while stack:
+                for parent in self.graph.parents(stack.pop()):
+                    # A range is not marked dirty when it is created over a
+                    # dirty cell, so the walk goes through all ranges
+                    if parent not in region and (parent in self._dirty or
+                                                 self.graph.is_range(parent)):
+                        region.add(parent)
+                        stack.append(parent)
+            if not region:
+                return
+            order, cyclic = self.graph.order(region)
+            # A cycle through references that are not read, such as an IF
+            # branch not taken, is no cycle: find out what these cells read
+            # and order the region again
+            if any(key in self._provisional for key in cyclic):
+                # The cycles are taken first to last, so that the cells of
+                # a cycle are only computed once the cells they read are
+                sources = self._first_cycles(region, cyclic)
+                guesses = [key for key in sources if key in self._provisional]
+                if not guesses:
+                    # The first cycles are cycles whatever their cells read
+                    self._invalidate(self._evaluate_cells([], sources, self._stale))
                     continue
-
-                # If we have revisited the first cell we visited, then we have
-                # a circular dependency
-                if len(
-                        visited_children) > 0 and curr_cell == visited_children[0]:
-                    circular_dependency_detected = True
-                    break
-
-                # Add the current cell to the list of visited children
-                visited_children.append(curr_cell)
-
-                # Add children of current cell to queue_of_cells
-                for c in curr_cell.get_children_cells():
-                    if c not in queue_of_cells:
-                        queue_of_cells.append(c)
-
-            except KeyError:
+                # The dirty cells the guesses read, directly or not, are on
+                # no cycle: compute them first
+                ancestors = set()
+                stack = list(guesses)
+                while stack:
+                    for parent in self.graph.parents(stack.pop()):
+                        if parent in region and parent not in ancestors:
+                            ancestors.add(parent)
+                            stack.append(parent)
+                before = [key for key in order if key in ancestors and key in self._dirty]
+                if before:
+                    self._invalidate(self._evaluate_cells(before, (), self._stale))
+                    continue
+                again = self._evaluate_cells(guesses, (), self._stale)
+                self._invalidate(guesses + again)
                 continue
-
-        return circular_dependency_detected, visited_children
-    
-    def _update_children_cells(self, new_cell, sheet_name, loc):
-        # Update the children_cells of the parent cells
-        for (p_sheet_name, p_loc) in new_cell.get_parent_cells():
-            try:
-                if p_sheet_name.lower()[
-                        0] == "'" and p_sheet_name.lower()[-1] == "'":
-                    p_sheet_name = p_sheet_name[1:-1]
-                # Check if the cell exists. If it does, add the child to it
-                parent_cell = self.sheets[self.sheet_to_idx[p_sheet_name.lower()]].get_cell(
-                    p_loc.upper())
-                if (sheet_name.lower(), loc.upper()) not in parent_cell.get_children_cells():
-                    parent_cell.append_child_cell((sheet_name.lower(), loc.upper()))
-            except KeyError:
-                # If sheet name doesnt exist or cell doesn't exist:
-                # Create a new cell with None contents, updating parent cells accordingly
-                # Put this cell into floating cells
-                if p_sheet_name.lower() not in self.sheet_to_idx:
-                    # Sheet doesn't exist
-                    new_cell.set_value(
-                        CellError(
-                            CellErrorType.BAD_REFERENCE,
-                            detail="Sheet/cell does not exist!"))
-                    parent_cell = Cell(p_sheet_name, p_loc, "")
-                    parent_cell.append_child_cell((sheet_name.lower(), loc.upper()))
-                    self.floating_cells[p_sheet_name.lower()].append(
-                        parent_cell)
-                # Sheet exists, cell doesn't exist:
-                # Create a new cell with None contents, updating parent cells
-                # accordingly
-                else:
-                    parent_sheet = self.sheets[self.sheet_to_idx[p_sheet_name.lower(
-                    )]]
-                    parent_cell = Cell(p_sheet_name, p_loc, "")
-                    parent_cell.append_child_cell((sheet_name.lower(), loc.upper()))
-                    parent_sheet.set_cell(p_loc, parent_cell)
-
-    def _build_dependency_graph(self, start_cell, graph):
-        # Build dependency_graph rooted at start_cell
-        stack = [start_cell]
-        visited = set()
+            # A cell that read a cell it did not read before may have been
+            # computed too early, or closed a cycle: compute it again, in the
+            # new order
+            self._invalidate(self._evaluate_cells(order, cyclic, self._stale))
+
+    def _first_cycles(self, region, cyclic):
+        # Keys of the cycles of cyclic, within region, that read no other
+        # of these cycles, directly or through other cells of region
+        after = set()
+        stack = list(cyclic)
         while stack:
-            current_cell = stack.pop()
-            for child_cell_tuple in current_cell.get_children_cells():
-                child_cell_sheet_name = child_cell_tuple[0]
-                child_cell_location = child_cell_tuple[1]
-                child_cell_sheet_idx = self.sheet_to_idx[child_cell_sheet_name.lower(
-                )]
-                child_cell = self.sheets[child_cell_sheet_idx].get_cell(
-                    child_cell_location)
-
-                if child_cell not in visited:
-                    visited.add(child_cell)
-                    stack.append(child_cell)
-                graph.add_edge(current_cell, child_cell)
-        return graph
-    
+            for child in self.graph.children(stack.pop()):
+                if child in region and child not in cyclic and child not in after:
+                    after.add(child)
+                    stack.append(child)
+        first = set()
+        seen = set()
+        for key in cyclic:
+            if key in seen:
+                continue
+            cycle = self.graph.cycle(key) & region or {key}
+            seen |= cycle
+            if not any(parent in after or (parent in cyclic and parent not in cycle)
+                       for member in cycle for parent in self.graph.parents(member)):
+                first |= cycle
+        return first
+
+    def _evaluate_cells(self, order, cyclic, stale):
+        # Give the cells of cyclic the CIRCULAR_REFERENCE error, which the
+        # cells after them then read like any other error, and recompute the
+        # cells of order that are in stale, in that order.  The cells reading
+        # a cell whose value changes are added to stale.  Returns the keys of
+        # the cells to compute again, which are left in stale: those that
+        # started reading a cell they did not read before, and those that
+        # became stale after their turn.
+        again = []
+        done = set()
+
+        def value_changed(key):
+            for child in self.graph.children(key):
+                if child in cyclic:
+                    continue
+                if child in done:
+                    again.append(child)
+                stale.add(child)
+
+        for key in cyclic:
+            self._dirty.discard(key)
+            stale.discard(key)
+            cell = self._get_cell(key)
+            # A range on the cycle is read by the cells after it too
+            if cell is None:
+                value_changed(key)
+                continue
+            old_val = cell.get_value()
+            if not (isinstance(old_val, CellError) and
+                    old_val.get_type() == CellErrorType.CIRCULAR_REFERENCE):
+                self.updated_cells.append(cell.get_info()[:2])
+                value_changed(key)
+            self._keep_version(key)
+            cell.set_value(
+                CellError(
+                    CellErrorType.CIRCULAR_REFERENCE,
+                    detail="Circular reference detected"))
+
+        for key in order:
+            done.add(key)
+            self._dirty.discard(key)
+            if key not in stale:
+                continue
+            stale.discard(key)
+            self._provisional.discard(key)
+            cell = self._get_cell(key)
+            # A range has no value of its own: it changes when one of its
+            # cells does
+            if cell is None:
+                value_changed(key)
+                continue
+            # Formulas that failed to parse keep their PARSE_ERROR
+            if cell.get_compiled_formula() is None:
+                continue
+            old_val = cell.get_value()
+            value, parent_cells = self._evaluate_formula(cell)
+            self._keep_version(key)
+            cell.set_value(value)
+            if self.graph.set_parents(key, parent_cells):
+                again.append(key)
+                stale.add(key)
+            for other in self.graph.take_uncycled():
+                again.append(other)
+                stale.add(other)
+            if not _same_value(old_val, value):
+                value_changed(key)
+            # Add the cell to nofitications if the value changes
+            if value != old_val:
+                self.updated_cells.append(cell.get_info()[:2])
+        return again
+
+    def _keep_version(self, key):
+        # Keep the state of the cell of key before it changes, if a live
+        # snapshot may read it: one of a version after the end of its last
+        # kept state.  The cell keeps one state per version it changes in.
+        if self._released:
+            self._prune_versions()
+        if not self._snapshots:
+            return
+        sheet = self.sheets[self.sheet_to_idx[key[0]]]
+        history = self._history.setdefault((sheet, key[1]), [])
+        if history and history[-1][0] > self._newest_snapshot:
+            return
+        cell = sheet.get_cells().get(key[1])
+        if cell is None:
+            history.append((self._version, None, None))
+        else:
+            history.append((self._version, cell.get_contents(), cell.get_value()))
+
+    def _prune_versions(self):
+        # Drop the states of cells that only released snapshots read.  The
+        # history is replaced rather than changed, as snapshots may be
+        # reading it.
+        while self._released:
+            version = self._released.pop()
+            self._snapshots[version] -= 1
+            if not self._snapshots[version]:
+                del self._snapshots[version]
+        live = sorted(self._snapshots)
+        self._newest_snapshot = live[-1] if live else -1
+        history = {}
+        if live:
+            for key, states in self._history.items():
+                kept = []
+                start = 0
+                for state in states:
+                    # A snapshot of a version in [start, end) reads state
+                    i = bisect_left(live, start)
+                    if i < len(live) and live[i] < state[0]:
+                        kept.append(state)
+                    start = state[0]
+                if kept:
+                    history[key] = kept
+        self._history = history
+
+    def _discard_pending(self, key):
+        # Lazy mode: key has its value, or no cell any more
+        self._dirty.discard(key)
+        self._stale.discard(key)
+        self._provisional.discard(key)
+
+    def _update_sheet_references(self, sheet_name):
+        # Recompute the cells referencing the sheet sheet_name (lower case)
+        # after it was created, deleted or renamed
+        referencing = self.graph.take_uncycled()
+        for key in self.graph.keys_in_sheet(sheet_name):
+            referencing |= self.graph.children(key)
+        self._cells_changed(referencing)
+
     def _notify_cells_helper(self, changed_cells):
         # Helper function to notifying cells
-        # Applies each notification function stored to the list of cells
+        # Applies each notification function stored to the list of cells.
+        # In a batch the cells are kept for commit_batch to notify.
+        if self._batch_depth:
+            return
 
         changed_cells = list(set(changed_cells))
         for f in self.notification_functions:
@@ -1360,29 +1916,6 @@ class Workbook:
         # Reset the updated cells
         self.updated_cells = []
 
-    def _update_bad_ref(self, new_sheet_name):
-        # Recompute the values of any cells that reference the new copied sheet
-        # to_remove is a temporary list of cells that need to be removed from
-        # the bad reference cells
-        to_remove = []
-        if new_sheet_name[0] == "'" and new_sheet_name[-1] == "'":
-            new_sheet_name = new_sheet_name[1:-1]
-
-        # For each cell in bad_ref_cells
-        for (sheet_name, loc) in self.bad_ref_cells.keys():
-            cell = self.bad_ref_cells[(sheet_name, loc)]
-            for (parent_sheet_name, _) in cell.get_parent_cells():
-                # If the cell has a parent that has a sheet_name equal to the
-                # new_sheet_name, then update the cell again
-                if parent_sheet_name.lower() == new_sheet_name.lower():
-                    cell_sheet_name, cell_loc, cell_contents = cell.get_info()
-                    self.set_cell_contents(cell_sheet_name, cell_loc, cell_contents)
-                    to_remove.append((sheet_name, loc))
-
-        # Remove all of the cells that were updated
-        for (sheet_name, loc) in to_remove:
-            self.bad_ref_cells.pop((sheet_name, loc))
-
     def _copy_and_move_helper(
             self,
             sheet_name: str,
@@ -1488,15 +2021,10 @@ class Workbook:
         if loc in sheet.get_cells().keys():
             cell = sheet.get_cell(loc)
 
-            # Update the children cells of parents of the current cell
-            for parent_loc in cell.get_parent_cells():
-                parent_sheet = self.get_sheet(parent_loc[0])
-                parent = parent_sheet.get_cell(parent_loc[1])
-                parent.set_children_cells(
-                    parent.get_children_cells().remove((sheet_name.lower(), loc.upper())))
+            # Remove the dependencies of the current cell
+            self.graph.set_parents((sheet_name.lower(), loc), ())
 
             # Reset the values of the cell
-            cell.set_parent_cells([])
             cell.set_content(None)
             cell.set_value(None)
             cell.set_formula_cell_flag = False
@@ -0,0 +1,59 @@
+import context
+from sheets.parsers import get_parser
+from sheets.helper import column_string_from_index
+
+import time
+import unittest
+
+# Compares the LALR and Earley formula parsers on the formulas generated by
+# the stress tests.  The parse caches are bypassed so that every formula is
+# actually parsed.
+
+
+def stress_formulas(n):
+    # Formula strings in the same shapes as the stress tests
+    formulas = []
+    for i in range(3, n + 1):
+        # longchainstresstest / widechainstresstest
+        formulas.append(f"=A{i-1}")
+        formulas.append(f"=A1 * 2")
+        # recursivefibstresstest
+        formulas.append(f"=A{i-1}+A{i-2}")
+        # smallcircularstresstest / largecircularstresstest
+        formulas.append(f"=A{i} + B{n}")
+        # copysheetstresstest
+        formulas.append(f"=Sheet1!A{i}")
+        # pascalstresstest
+        col = column_string_from_index(i)
+        col_up = column_string_from_index(i - 1)
+        formulas.append(f"={col}{i-1} + {col_up}{i}")
+    return formulas
+
+
+def time_parser(parser, formulas):
+    start = time.perf_counter()
+    for formula in formulas:
+        parser.parse(formula)
+    return time.perf_counter() - start
+
+
+class ParserBenchmark(unittest.TestCase):
+    def run_benchmark(self, n):
+        formulas = stress_formulas(n)
+        lalr = time_parser(get_parser("lalr"), formulas)
+        earley = time_parser(get_parser("earley"), formulas)
+        print(f"\n{len(formulas)} formulas: lalr {lalr:.3f}s, earley {earley:.3f}s "
+              f"({earley / lalr:.1f}x)")
+
+    def test_parse_100(self):
+        self.run_benchmark(100)
+
+    def test_parse_1000(self):
+        self.run_benchmark(1000)
+
+    def test_parse_5000(self):
+        self.run_benchmark(5000)
+
+
+if __name__ == "__main__":
+    unittest.main()
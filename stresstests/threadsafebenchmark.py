@@ -0,0 +1,76 @@
+import context
+from sheets import ThreadSafeWorkbook
+
+import threading
+import time
+import unittest
+
+# Measures the read throughput of a ThreadSafeWorkbook shared by reader
+# threads, alone and while a writer thread keeps changing the cells they
+# read.
+
+
+def model_workbook(n):
+    # A column of n inputs and a column of n formulas reading them
+    wb = ThreadSafeWorkbook()
+    _, name = wb.new_sheet()
+    cells = {f"A{i}": str(i) for i in range(1, n + 1)}
+    cells.update({f"B{i}": f"=A{i} * 2 + SUM(A1:A10)" for i in range(1, n + 1)})
+    wb.set_cells_contents(name, cells)
+    return wb, name
+
+
+def read_throughput(readers, writing, duration=1.0, n=200):
+    # Reads per second of readers threads reading B cells for duration
+    # seconds, with a thread writing A cells if writing.  Returns the reads
+    # and writes per second.
+    wb, name = model_workbook(n)
+    stop = threading.Event()
+    reads = [0] * readers
+    writes = [0]
+
+    def read(index):
+        i = 0
+        while not stop.is_set():
+            wb.get_cell_value(name, f"B{i % n + 1}")
+            i += 1
+        reads[index] = i
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            wb.set_cell_contents(name, f"A{i % 10 + 1}", str(i))
+            i += 1
+        writes[0] = i
+
+    threads = [threading.Thread(target=read, args=(index,)) for index in range(readers)]
+    if writing:
+        threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(reads) / duration, writes[0] / duration
+
+
+class ThreadSafeBenchmark(unittest.TestCase):
+    def run_benchmark(self, readers):
+        alone, _ = read_throughput(readers, False)
+        loaded, writes = read_throughput(readers, True)
+        print(f"\n{readers} readers: {alone:.0f} reads/s alone, {loaded:.0f} reads/s "
+              f"with {writes:.0f} writes/s")
+
+    def test_1_reader(self):
+        self.run_benchmark(1)
+
+    def test_4_readers(self):
+        self.run_benchmark(4)
+
+    def test_16_readers(self):
+        self.run_benchmark(16)
+
+
+if __name__ == "__main__":
+    unittest.main()
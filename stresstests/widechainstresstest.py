@@ -52,6 +52,18 @@ class WideChainStressTest(unittest.TestCase):
 
         p.print()
 
+    def test_chain_1000_levels(self):
+        wb = Workbook()
+
+        _, name = wb.new_sheet()
+        for i in range(2, 1001):
+            wb.set_cell_contents(name, f"A{i}", f"=A1 * 2")
+
+        # Every cell of the chain only reads A1: they are all in one level
+        widths = wb.get_level_widths(name, "A1")
+        print(widths)
+        assert (widths == [999])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,106 @@
+import context
+from sheets.workbook import Workbook
+from sheets.cellerrortype import CellErrorType
+from calcmodetests import count_evaluations
+
+import asyncio
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+
+# Test Suite for the asyncio methods of the workbook
+
+
+def chain_workbook(n, chunk_size):
+    # A sheet with A1 and a chain of n - 1 cells adding 1 to the cell above
+    wb = Workbook()
+    wb.async_chunk_size = chunk_size
+    _, name = wb.new_sheet()
+    wb.set_cell_contents(name, "A1", "0")
+    wb.set_cells_contents(name, {f"A{i}": f"=A{i - 1} + 1" for i in range(2, n + 1)})
+    return wb, name
+
+
+class AsyncTests(unittest.IsolatedAsyncioTestCase):
+    async def test_aset_cell_contents(self):
+        wb, name = chain_workbook(100, 10)
+        evaluated = count_evaluations(wb)
+        notifications = []
+        wb.notify_cells_changed(lambda _, cells: notifications.append(set(cells)))
+        await wb.aset_cell_contents(name, "A1", "5")
+        assert (wb.get_cell_value(name, "A100") == Decimal(104))
+        assert (len(evaluated) == 99)
+        assert (notifications == [{(name, f"A{i}") for i in range(1, 101)}])
+        assert (wb._batch_depth == 0)
+
+        await wb.aset_cells_contents(name, {"A1": "1", "B1": "=A100 * 2"})
+        assert (wb.get_cell_value(name, "B1") == Decimal(200))
+
+        with self.assertRaises(ValueError):
+            await wb.aset_cell_contents(name, "ZZZZZ1", "1")
+        assert (wb._batch_depth == 0)
+
+    async def test_other_tasks_run_between_chunks(self):
+        wb, name = chain_workbook(400, 20)
+        seen = []
+
+        async def read():
+            # Reading a cell during the recalculation computes it
+            while len(seen) < 5:
+                seen.append(wb.get_cell_value(name, "A400"))
+                await asyncio.sleep(0)
+        reading = asyncio.create_task(read())
+        await wb.aset_cell_contents(name, "A1", "1")
+        await reading
+        assert (seen == [Decimal(400)] * 5)
+        assert (wb.get_cell_value(name, "A400") == Decimal(400))
+
+    async def test_concurrent_writes(self):
+        wb, name = chain_workbook(200, 15)
+        notifications = []
+        wb.notify_cells_changed(lambda _, cells: notifications.append(set(cells)))
+        await asyncio.gather(wb.aset_cell_contents(name, "A1", "10"),
+                             wb.aset_cell_contents(name, "B1", "=A200 + A1"),
+                             wb.aset_cell_contents(name, "B2", "=B3"),
+                             wb.aset_cell_contents(name, "B3", "=B2"))
+        assert (wb.get_cell_value(name, "A200") == Decimal(209))
+        assert (wb.get_cell_value(name, "B1") == Decimal(219))
+        assert (wb.get_cell_value(name, "B3").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+        # The changes are notified once, when the last of them is done
+        assert (len(notifications) == 1)
+
+    async def test_lazy_and_manual_modes(self):
+        wb, name = chain_workbook(50, 10)
+        wb.set_calc_mode("lazy")
+        await wb.aset_cell_contents(name, "A1", "3")
+        assert ((name.lower(), "A50") in wb._dirty)
+        assert (wb.get_cell_value(name, "A50") == Decimal(52))
+
+        wb.set_calc_mode("manual")
+        await wb.aset_cell_contents(name, "A1", "4")
+        assert (wb.get_cell_value(name, "A50") == Decimal(52))
+
+    async def test_asave_and_aload(self):
+        wb, name = chain_workbook(300, 25)
+        wb.set_calc_mode("lazy")
+        await wb.aset_cell_contents(name, "A1", "2")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "workbook.json")
+            with open(path, "w") as fp:
+                # Lazily, the cells are computed for the file
+                await wb.asave(fp)
+            assert (not wb._dirty)
+            loaded = await Workbook.aload(path)
+            with open(path, "w") as fp:
+                fp.write('{"sheets": [{"name": "Sheet1"}]}')
+            with self.assertRaises(KeyError):
+                await Workbook.aload(path)
+        assert (loaded.list_sheets() == [name])
+        assert (loaded.get_cell_contents(name, "A300") == "=A299 + 1")
+        assert (loaded.get_cell_value(name, "A300") == Decimal(301))
+        assert (not loaded._dirty)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import context
+from sheets.workbook import Workbook
+from sheets.cellerrortype import CellErrorType
+from calcmodetests import count_evaluations
+
+import unittest
+from decimal import Decimal
+
+# Test Suite for batches of edits
+
+
+class BatchTests(unittest.TestCase):
+    def test_batch_computes_each_cell_once(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        evaluated = count_evaluations(wb)
+        notifications = []
+        wb.notify_cells_changed(lambda _, cells: notifications.append(sorted(cells)))
+        with wb.batch():
+            for i in range(1, 101):
+                wb.set_cell_contents(name, f"B{i}", f"=A{i} + B{i - 1}" if i > 1 else "=A1")
+            for i in range(1, 101):
+                wb.set_cell_contents(name, f"A{i}", str(i))
+            assert (evaluated == [])
+            assert (notifications == [])
+        assert (wb.get_cell_value(name, "B100") == Decimal(5050))
+        assert (sorted(evaluated) == sorted(f"B{i}" for i in range(1, 101)))
+        # One notification, with each cell once
+        assert (len(notifications) == 1)
+        assert (len(notifications[0]) == 200)
+
+    def test_reading_in_a_batch(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with wb.batch():
+            wb.set_cell_contents(name, "A1", "2")
+            wb.set_cell_contents(name, "A2", "=A1 * 3")
+            assert (wb.get_cell_value(name, "A2") == Decimal(6))
+            wb.set_cell_contents(name, "A1", "5")
+        assert (wb.get_cell_value(name, "A2") == Decimal(15))
+
+    def test_sheet_operations_in_a_batch(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with wb.batch():
+            wb.set_cell_contents(name, "A1", "=Data!A1 + 1")
+            wb.new_sheet("Data")
+            wb.set_cell_contents("Data", "A1", "1")
+            wb.rename_sheet("Data", "Inputs")
+            wb.copy_cells("Inputs", "A1", "A1", "B1")
+            wb.set_cell_contents(name, "A2", "=IF(Inputs!B1 > 0, A1, A2)")
+        assert (wb.get_cell_contents(name, "A1") == "=Inputs!A1 + 1")
+        assert (wb.get_cell_value(name, "A1") == Decimal(2))
+        assert (wb.get_cell_value(name, "A2") == Decimal(2))
+
+        with wb.batch():
+            wb.set_cell_contents(name, "B1", "=B2")
+            wb.set_cell_contents(name, "B2", "=B1")
+        assert (wb.get_cell_value(name, "B2").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+
+    def test_moves_and_renames_compute_each_cell_once(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        cells = {f"A{i}": str(i) for i in range(1, 11)}
+        cells.update({f"A{i}": f"=A{i - 10} * 2" for i in range(11, 21)})
+        wb.set_cells_contents(name, cells)
+        wb.set_cell_contents(name, "C1", "=SUM(A1:B20)")
+        wb.set_cell_contents(name, "C2", "=C1 * 2")
+        evaluated = count_evaluations(wb)
+        notifications = []
+        wb.notify_cells_changed(lambda _, cells: notifications.append(sorted(cells)))
+        wb.move_cells(name, "A1", "A20", "B1")
+        assert (wb.get_cell_value(name, "C2") == Decimal(330))
+        assert (sorted(evaluated) == sorted([f"B{i}" for i in range(11, 21)] + ["C1"]))
+        assert (len(notifications) == 1)
+        assert (len(notifications[0]) == 40)
+
+        wb.new_sheet("Data")
+        wb.set_cells_contents("Data", {f"A{i}": str(i) for i in range(1, 21)})
+        wb.set_cells_contents(name, {f"D{i}": f"=Data!A{i}" for i in range(1, 21)})
+        wb.set_cell_contents(name, "E1", "=SUM(Data!A1:A20) + SUM(D1:D20)")
+        evaluated.clear()
+        notifications.clear()
+        wb.rename_sheet("Data", "Inputs")
+        assert (wb.get_cell_value(name, "E1") == Decimal(420))
+        assert (sorted(evaluated) == sorted([f"D{i}" for i in range(1, 21)] + ["E1"]))
+        assert (len(notifications) <= 1)
+
+    def test_batched_cycles_match_single_edits(self):
+        edits = [("A1", "7"), ("B1", "0"), ("A1", "=B1"), ("C1", "=IF(A1 > 1, C1, 5)"),
+                 ("D1", "=IF(C1 > 1, E1, 1)"), ("E1", "=D1")]
+        single = Workbook()
+        _, name = single.new_sheet()
+        for location, contents in edits:
+            single.set_cell_contents(name, location, contents)
+        batched = Workbook()
+        batched.new_sheet()
+        with batched.batch():
+            for location, contents in edits:
+                batched.set_cell_contents(name, location, contents)
+        for location in ["A1", "C1", "D1", "E1"]:
+            assert (str(batched.get_cell_value(name, location)) ==
+                    str(single.get_cell_value(name, location)))
+        assert (batched.get_cell_value(name, "C1") == Decimal(5))
+        assert (batched.get_cell_value(name, "E1").get_type() ==
+                CellErrorType.CIRCULAR_REFERENCE)
+
+        # Copies go through the same deferred computation
+        single.set_cell_contents(name, "F1", "=G1")
+        single.set_cell_contents(name, "G1", "0")
+        single.set_cell_contents(name, "H1", "=IF(F1 > 1, H1, 5)")
+        batched.set_cell_contents(name, "F1", "7")
+        batched.copy_cells(name, "A1", "C1", "F1")
+        assert (batched.get_cell_value(name, "H1") == single.get_cell_value(name, "H1"))
+        assert (batched.get_cell_value(name, "H1") == Decimal(5))
+
+    def test_nested_batches(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A2", "=A1 + 1")
+        wb.begin_batch()
+        with wb.batch():
+            wb.set_cell_contents(name, "A1", "1")
+        assert (wb.get_sheet(name).get_cell("A2").get_value() == Decimal(1))
+        wb.commit_batch()
+        assert (wb.get_sheet(name).get_cell("A2").get_value() == Decimal(2))
+        with self.assertRaises(ValueError):
+            wb.commit_batch()
+
+    def test_failed_batch_is_still_computed(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        with self.assertRaises(ValueError):
+            with wb.batch():
+                wb.set_cell_contents(name, "A1", "4")
+                wb.set_cell_contents(name, "A2", "=A1 * 2")
+                wb.set_cell_contents(name, "ZZZZZ1", "1")
+        assert (wb.get_cell_value(name, "A2") == Decimal(8))
+        assert (wb._batch_depth == 0)
+
+    def test_batch_in_lazy_mode(self):
+        wb = Workbook(calc_mode="lazy")
+        _, name = wb.new_sheet()
+        with wb.batch():
+            wb.set_cell_contents(name, "A1", "4")
+            wb.set_cell_contents(name, "A2", "=A1 * 2")
+        # Lazily, the cells are still only computed when read
+        assert (("sheet1", "A2") in wb._dirty)
+        assert (wb.get_cell_value(name, "A2") == Decimal(8))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+import context
+from sheets.workbook import Workbook
+from sheets.cellerror import CellError
+from sheets.cellerrortype import CellErrorType
+
+import unittest
+from decimal import Decimal
+
+# Test Suite for the calculation modes
+
+
+def count_evaluations(wb):
+    # Record the cells the workbook evaluates from now on
+    evaluated = []
+    evaluate = wb._evaluate_formula
+
+    def counting_evaluate(cell):
+        evaluated.append(cell.get_info()[1])
+        return evaluate(cell)
+    wb._evaluate_formula = counting_evaluate
+    return evaluated
+
+
+class CalcModeTests(unittest.TestCase):
+    def test_calc_modes(self):
+        wb = Workbook()
+        assert (wb.get_calc_mode() == "automatic")
+        wb.set_calc_mode("lazy")
+        assert (wb.get_calc_mode() == "lazy")
+        with self.assertRaises(ValueError):
+            wb.set_calc_mode("eager")
+        wb.set_calc_mode("manual")
+        assert (wb.get_calc_mode() == "manual")
+        with self.assertRaises(ValueError):
+            Workbook(calc_mode="eager")
+
+    def test_lazy_writes_only_mark_cells_dirty(self):
+        wb = Workbook(calc_mode="lazy")
+        _, name = wb.new_sheet()
+        evaluated = count_evaluations(wb)
+        wb.set_cell_contents(name, "A1", "1")
+        for i in range(2, 501):
+            wb.set_cell_contents(name, f"A{i}", f"=A{i - 1} + 1")
+        wb.set_cell_contents(name, "B1", "=A1 * 10")
+        for i in range(5):
+            wb.set_cell_contents(name, "A1", f"{i}")
+        assert (evaluated == [])
+
+        # Reading a cell computes it and the dirty cells it reads, once
+        assert (wb.get_cell_value(name, "A500") == Decimal(503))
+        assert (len(evaluated) == 499)
+        assert (wb.get_cell_value(name, "A250") == Decimal(253))
+        assert (len(evaluated) == 499)
+        assert ("B1" not in evaluated)
+        assert (wb.get_cell_value(name, "B1") == Decimal(40))
+
+        # A value that is not a formula needs no computing
+        wb.set_cell_contents(name, "A1", "7")
+        assert (wb.get_cell_value(name, "A1") == Decimal(7))
+        assert (len(evaluated) == 500)
+
+    def test_lazy_notifications(self):
+        wb = Workbook(calc_mode="lazy")
+        _, name = wb.new_sheet()
+        changes = []
+        wb.notify_cells_changed(lambda _, cells: changes.extend(cells))
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "A2", "=A1 + 1")
+        assert (changes == [(name, "A1")])
+        assert (wb.get_cell_value(name, "A2") == Decimal(2))
+        assert (changes == [(name, "A1"), (name, "A2")])
+
+    def test_lazy_cycles(self):
+        wb = Workbook(calc_mode="lazy")
+        _, name = wb.new_sheet()
+        # A reference in an IF branch that is not taken is not a cycle
+        wb.set_cell_contents(name, "A3", "false")
+        wb.set_cell_contents(name, "A1", "=A2")
+        wb.set_cell_contents(name, "A2", "=IF(A3, A1, 5)")
+        assert (wb.get_cell_value(name, "A1") == Decimal(5))
+        wb.set_cell_contents(name, "A3", "true")
+        value = wb.get_cell_value(name, "A1")
+        assert (isinstance(value, CellError))
+        assert (value.get_type() == CellErrorType.CIRCULAR_REFERENCE)
+        assert (wb.get_cell_value(name, "A2").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+
+        wb.set_cell_contents(name, "B1", "=B1 + 1")
+        assert (wb.get_cell_value(name, "B1").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+
+    def test_lazy_cycle_reading_a_dirty_cell(self):
+        wb = Workbook(calc_mode="lazy")
+        _, name = wb.new_sheet()
+        # A1 is computed before deciding whether C1 reads itself
+        wb.set_cell_contents(name, "A1", "7")
+        wb.set_cell_contents(name, "A1", "=B1")
+        wb.set_cell_contents(name, "C1", "=IF(A1 > 1, C1, 5)")
+        assert (wb.get_cell_value(name, "C1") == Decimal(5))
+
+    def test_lazy_sheet_operations(self):
+        wb = Workbook(calc_mode="lazy")
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=Data!A1 * 2")
+        assert (wb.get_cell_value(name, "A1").get_type() == CellErrorType.BAD_REFERENCE)
+        wb.new_sheet("Data")
+        wb.set_cell_contents("Data", "A1", "4")
+        assert (wb.get_cell_value(name, "A1") == Decimal(8))
+        wb.rename_sheet("Data", "Inputs")
+        assert (wb.get_cell_contents(name, "A1") == "=Inputs!A1 * 2")
+        wb.set_cell_contents("Inputs", "A1", "5")
+        assert (wb.get_cell_value(name, "A1") == Decimal(10))
+        wb.del_sheet("Inputs")
+        assert (wb.get_cell_value(name, "A1").get_type() == CellErrorType.BAD_REFERENCE)
+
+    def test_leaving_lazy_mode_computes_dirty_cells(self):
+        wb = Workbook(calc_mode="lazy")
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "2")
+        wb.set_cell_contents(name, "A2", "=A1 * A1")
+        wb.set_calc_mode("automatic")
+        cell = wb.get_sheet(name).get_cell("A2")
+        assert (cell.get_value() == Decimal(4))
+        wb.set_cell_contents(name, "A1", "3")
+        assert (cell.get_value() == Decimal(9))
+
+    def test_unchanged_values_are_not_propagated(self):
+        for calc_mode in ["automatic", "lazy"]:
+            wb = Workbook(calc_mode=calc_mode)
+            _, name = wb.new_sheet()
+            wb.set_cell_contents(name, "A1", "5")
+            wb.set_cell_contents(name, "B1", "=IF(A1 > 0, 1, 0)")
+            for i in range(1, 51):
+                wb.set_cell_contents(name, f"C{i}", f"=B1 + {i}")
+            wb.set_cell_contents(name, "D1", "=A1 * 2")
+            assert (wb.get_cell_value(name, "C50") == Decimal(51))
+            assert (wb.get_cell_value(name, "D1") == Decimal(10))
+
+            # Only the cells reading A1 are computed
+            evaluated = count_evaluations(wb)
+            wb.set_cell_contents(name, "A1", "7")
+            assert (wb.get_cell_value(name, "C50") == Decimal(51))
+            assert (wb.get_cell_value(name, "D1") == Decimal(14))
+            assert (sorted(evaluated) == ["B1", "D1"])
+
+            # Setting a cell to its own value computes nothing
+            wb.set_cell_contents(name, "A1", "7")
+            assert (wb.get_cell_value(name, "C50") == Decimal(51))
+            assert (len(evaluated) == 2)
+
+            wb.set_cell_contents(name, "A1", "-1")
+            assert (wb.get_cell_value(name, "C50") == Decimal(50))
+            assert (wb.get_cell_value(name, "D1") == Decimal(-2))
+            # Lazily, only the cell read among the cells reading B1
+            assert (len(evaluated) == (54 if calc_mode == "automatic" else 5))
+
+    def test_equal_values_of_another_kind_are_propagated(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "B1", "=A1 & \"\"")
+        wb.set_cell_contents(name, "A1", "true")
+        assert (wb.get_cell_value(name, "B1") == "TRUE")
+
+        wb.set_cell_contents(name, "A2", "#REF!")
+        wb.set_cell_contents(name, "B2", "=ISERROR(A2)")
+        wb.set_cell_contents(name, "A2", "#DIV/0!")
+        wb.set_cell_contents(name, "C2", "=IFERROR(A2, 3)")
+        wb.set_cell_contents(name, "A2", "#DIV/0!")
+        assert (wb.get_cell_value(name, "C2") == Decimal(3))
+
+    def test_a_new_reference_with_an_unchanged_value_can_close_a_cycle(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=A2")
+        wb.set_cell_contents(name, "A2", "=A1")
+        assert (wb.get_cell_value(name, "A1").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+        assert (wb.get_cell_value(name, "A2").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+
+
+    def test_manual_mode(self):
+        wb = Workbook(calc_mode="manual")
+        _, name = wb.new_sheet()
+        changes = []
+        wb.notify_cells_changed(lambda _, cells: changes.append(sorted(cells)))
+        evaluated = count_evaluations(wb)
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "A2", "=A1 + 1")
+        wb.set_cell_contents(name, "A3", "=A2 * 10")
+        for i in range(2, 10):
+            wb.set_cell_contents(name, "A1", f"{i}")
+        # Reading a cell does not compute it
+        assert (wb.get_cell_value(name, "A3") is None)
+        assert (evaluated == [])
+        assert (changes == [[(name, "A1")]] * 9)
+
+        wb.recalculate()
+        assert (sorted(evaluated) == ["A2", "A3"])
+        assert (changes[-1] == [(name, "A2"), (name, "A3")])
+        assert (wb.get_cell_value(name, "A3") == Decimal(100))
+
+        # Cells keep their old values until the next recalculation
+        wb.set_cell_contents(name, "A1", "0")
+        assert (wb.get_cell_value(name, "A3") == Decimal(100))
+        wb.recalculate()
+        assert (wb.get_cell_value(name, "A3") == Decimal(10))
+
+    def test_manual_cycle_reading_a_dirty_cell(self):
+        wb = Workbook(calc_mode="manual")
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "7")
+        wb.set_cell_contents(name, "A1", "=B1")
+        wb.set_cell_contents(name, "C1", "=IF(A1 > 1, C1, 5)")
+        wb.recalculate()
+        assert (wb.get_cell_value(name, "C1") == Decimal(5))
+
+    def test_manual_recalculation_of_a_region(self):
+        wb = Workbook(calc_mode="manual")
+        _, name = wb.new_sheet()
+        wb.new_sheet("Data")
+        wb.set_cells_contents(name, {
+            "A1": "=Data!A1 * 2", "B1": "=A1 + 1", "C1": "=A1 + 2", "D5": "=B1"})
+        wb.set_cell_contents("Data", "A1", "1")
+        wb.set_cell_contents("Data", "A2", "=A1")
+
+        # The cells of the region and the cells they read are computed
+        evaluated = count_evaluations(wb)
+        wb.recalculate("sheet1", "b1:a2")
+        assert (sorted(evaluated) == ["A1", "B1"])
+        assert (wb.get_cell_value(name, "B1") == Decimal(3))
+        assert (wb.get_cell_value(name, "C1") is None)
+
+        wb.recalculate(name, "D5")
+        assert (wb.get_cell_value(name, "D5") == Decimal(3))
+        assert (wb.get_cell_value(name, "C1") is None)
+        wb.recalculate(name)
+        assert (wb.get_cell_value(name, "C1") == Decimal(4))
+        assert (wb.get_cell_value("Data", "A2") is None)
+
+        with self.assertRaises(KeyError):
+            wb.recalculate("Sheet9")
+        with self.assertRaises(ValueError):
+            wb.recalculate(name, "A1:B2:C3")
+        with self.assertRaises(ValueError):
+            wb.recalculate(name, "A1:ZZZZZ1")
+        with self.assertRaises(ValueError):
+            wb.recalculate(region="A1")
+
+        # Switching to automatic mode computes the rest
+        wb.set_calc_mode("automatic")
+        assert (wb.get_cell_value("Data", "A2") == Decimal(1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -220,6 +220,10 @@ class CellErrorTests(unittest.TestCase):
         v = wb.get_cell_value(n1, "A1")
         assert isinstance(v, CellError)
         assert v.get_type() == CellErrorType.DIVIDE_BY_ZERO
+        wb.set_cell_contents(n1, "A2", "#CIRCREF!")
+        v = wb.get_cell_value(n1, "A2")
+        assert isinstance(v, CellError)
+        assert v.get_type() == CellErrorType.CIRCULAR_REFERENCE
 
     def test_circular_reference_outside_cell(self):
         wb = Workbook()
@@ -0,0 +1,243 @@
+import context
+from sheets.workbook import Workbook
+from sheets.cellerror import CellError
+from sheets.cellerrortype import CellErrorType
+from sheets.formula_templates import r1c1_key
+from sheets.formula_references import extract_references
+from sheets.formula_ast import (to_ast, Number, String, Bool, Error, CellRef,
+                                Call)
+from sheets.formula_optimizer import fold_constants
+from sheets.parsers import get_parser
+
+import unittest
+from decimal import Decimal
+
+# Test Suite for compiled formulas
+
+
+def parse_ast(formula):
+    return to_ast(get_parser().parse(formula))
+
+
+class CompilerTests(unittest.TestCase):
+    def test_compiled_formulas(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "4")
+        wb.set_cell_contents(name, "A2", "hello")
+        wb.set_cell_contents(name, "A3", "true")
+        wb.set_cell_contents(name, "B1", "=1/0")
+        a1, a2, a3, b1 = [("sheet1", loc) for loc in ["A1", "A2", "A3", "B1"]]
+        # Formula -> value, or error type, and the cells it reads
+        formulas = {
+            "=A1 + 2 * -A1": (Decimal(-4), {a1}),
+            "=(A1 - 1) / 3": (Decimal(1), {a1}),
+            "=A2 & \" \" & A1": ("hello 4", {a1, a2}),
+            "=A1 > 3": (True, {a1}),
+            "=(A2 = \"HELLO\")": (True, {a2}),
+            "=A3 & A2": ("TRUEhello", {a2, a3}),
+            "=B1 + 1": (CellErrorType.DIVIDE_BY_ZERO, {b1}),
+            "=#REF! + 1": (CellErrorType.BAD_REFERENCE, set()),
+            "=Sheet9!A1": (CellErrorType.BAD_REFERENCE, {("sheet9", "A1")}),
+            "=AND(A3, A1 > 1)": (True, {a1, a3}),
+            "=IF(A3, A1, A2)": (Decimal(4), {a1, a3}),
+            "=IFERROR(B1, \"bad\")": ("bad", {b1}),
+            "=CHOOSE(2, A1, A2)": ("hello", {a2}),
+            "=INDIRECT(\"A1\")": (Decimal(4), {a1}),
+            "=ISBLANK(C9)": (True, {("sheet1", "C9")}),
+            "=FOO(1)": (CellErrorType.BAD_NAME, set()),
+            "=A1 + A2": (CellErrorType.TYPE_ERROR, {a1, a2}),
+            "=VERSION()": ("1.3", set())}
+        for formula, (expected, parents) in formulas.items():
+            wb.context.new_parsing(name)
+            actual = wb.compiler.compile(parse_ast(formula))(wb.context)
+            if isinstance(expected, CellErrorType):
+                assert (isinstance(actual, CellError))
+                assert (actual.get_type() == expected)
+            else:
+                assert (actual == expected)
+            assert (set(wb.context.get_parent_cells()) == parents)
+
+    def test_compiled_formula_stored_on_cell(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=B1 * 2")
+        cell = wb.sheets[0].get_cells()["A1"]
+        compiled = cell.get_compiled_formula()
+        assert (compiled is not None)
+
+        # Recalculation runs the stored closure rather than recompiling
+        wb.set_cell_contents(name, "B1", "21")
+        assert (cell.get_compiled_formula() is compiled)
+        assert (wb.get_cell_value(name, "A1") == Decimal("42"))
+
+        wb.set_cell_contents(name, "A1", "=1 +")
+        assert (wb.sheets[0].get_cells()["A1"].get_compiled_formula() is None)
+
+    def test_ranges_spread_into_arguments(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        for i in range(1, 4):
+            wb.set_cell_contents(name, f"A{i}", f"{i}")
+        wb.set_cell_contents(name, "B1", "=SUM(A1:A3, 10)")
+        wb.set_cell_contents(name, "B2", "=MAX(5, A1:A3)")
+        assert (wb.get_cell_value(name, "B1") == Decimal("16"))
+        assert (wb.get_cell_value(name, "B2") == Decimal("5"))
+
+    def test_lookup_on_offset_range(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "C3", "x")
+        wb.set_cell_contents(name, "D3", "1")
+        wb.set_cell_contents(name, "C4", "y")
+        wb.set_cell_contents(name, "D4", "2")
+        wb.set_cell_contents(name, "C5", "y")
+        wb.set_cell_contents(name, "D5", "3")
+        wb.set_cell_contents(name, "A1", "=VLOOKUP(\"y\", C3:D5, 2)")
+        wb.set_cell_contents(name, "A2", "=HLOOKUP(\"x\", C3:D5, 3)")
+        wb.set_cell_contents(name, "A3", "=VLOOKUP(\"z\", C3:D5, 2)")
+        # The first matching row wins
+        assert (wb.get_cell_value(name, "A1") == Decimal("2"))
+        assert (wb.get_cell_value(name, "A2") == "y")
+        assert (wb.get_cell_value(name, "A3").get_type() == CellErrorType.TYPE_ERROR)
+
+    def test_r1c1_keys(self):
+        # C3 = (3, 3), D4 = (4, 4)
+        assert (r1c1_key("=A1+B2", 3, 3) == r1c1_key("=B2+C3", 4, 4))
+        assert (r1c1_key("=a1", 3, 3) == r1c1_key("=B2", 4, 4))
+        assert (r1c1_key("=$A$1", 3, 3) == r1c1_key("=$A$1", 4, 4))
+        assert (r1c1_key("=$A1", 3, 3) == r1c1_key("=$A2", 4, 4))
+        assert (r1c1_key("=$A1", 3, 3) != r1c1_key("=$B2", 4, 4))
+        assert (r1c1_key("=SUM(A1:B2)", 3, 3) == r1c1_key("=SUM(B2:C3)", 4, 4))
+        # Strings, sheet names and function names are not references
+        assert (r1c1_key("=\"A1\"", 3, 3) != r1c1_key("=\"B2\"", 4, 4))
+        assert (r1c1_key("=AB1!A1", 3, 3) != r1c1_key("=AC2!B2", 4, 4))
+        assert (r1c1_key("=LOG10(1)", 3, 3) != r1c1_key("=LOG11(1)", 4, 4))
+
+    def test_templates_shared_between_cells(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "B1", "10")
+        for i in range(2, 11):
+            wb.set_cell_contents(name, f"A{i}", f"=A{i-1} + $B$1 + INDIRECT(\"B1\")")
+            wb.set_cell_contents(name, f"B{i}", f"=SUM($A$1:A{i})")
+        assert (wb.templates.get_misses() == 2)
+        assert (wb.templates.get_hits() == 16)
+
+        cells = wb.sheets[0].get_cells()
+        assert (cells["A2"].get_compiled_formula() is cells["A10"].get_compiled_formula())
+        assert (wb.get_cell_value(name, "A3") == Decimal("41"))
+        assert (wb.get_cell_value(name, "A10") == Decimal("181"))
+        assert (wb.get_cell_value(name, "B3") == Decimal("63"))
+
+        # Parents are those of each cell, not of the template's first cell
+        wb.set_cell_contents(name, "A9", "0")
+        assert (wb.get_cell_value(name, "A10") == Decimal("20"))
+
+    def test_templates_with_copy_cells(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "2")
+        wb.set_cell_contents(name, "B1", "=A1 * 3")
+        wb.copy_cells(name, "A1", "B1", "A2")
+        wb.set_cell_contents(name, "A2", "5")
+        assert (wb.get_cell_contents(name, "B2") == "=A2 * 3")
+        assert (wb.get_cell_value(name, "B2") == Decimal("15"))
+        assert (wb.templates.get_misses() == 1)
+
+    def test_extract_references(self):
+        ast = parse_ast(
+            "=IF(A1, 'My Sheet'!$B$2, SUM(C1:D2)) & INDIRECT(\"Sheet2!E5\") & \"F6\"")
+        a1, b2 = (1, 1, False, False), (2, 2, True, True)
+        c1, d2 = (1, 3, False, False), (2, 4, False, False)
+        e5 = (5, 5, True, True)
+        assert (extract_references(ast) == [(None, a1, a1), ("My Sheet", b2, b2),
+                                            (None, c1, d2), ("Sheet2", e5, e5)])
+        assert (extract_references(parse_ast("=1 + VERSION()")) == [])
+
+    def test_static_parent_cells(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "true")
+        for i in range(2, 5):
+            wb.set_cell_contents(name, f"B{i}", f"=IF($A$1, A{i}, SUM(C{i}:D{i+1}))")
+        cells = wb.sheets[0].get_cells()
+        assert (wb._static_parent_cells(cells["B3"]) ==
+                {("sheet1", "A1"), ("sheet1", "A3"), ("sheet1", "C3:D4")})
+        # Evaluation only reads the branch that is taken
+        assert (wb.graph.parents(("sheet1", "B3")) == {("sheet1", "A1"), ("sheet1", "A3")})
+
+        wb.set_cell_contents(name, "B9", "=ZZZZZ1 + 1")
+        wb.set_cell_contents(name, "B10", "=1 +")
+        assert (wb._static_parent_cells(cells["B9"]) == set())
+        assert (wb._static_parent_cells(cells["B10"]) == set())
+
+    def test_fold_constants(self):
+        wb = Workbook()
+        a1 = CellRef(None, (1, 1, False, False))
+        assert (fold_constants(parse_ast("=1+2*3"), wb.compiler) == Number(Decimal(7)))
+        assert (fold_constants(parse_ast("=\"a\"&\"b\""), wb.compiler) == String("ab"))
+        assert (fold_constants(parse_ast("=-(2 > 1)"), wb.compiler) == Number(Decimal(-1)))
+        assert (fold_constants(parse_ast("=SUM(1, 2) + A1"), wb.compiler)
+                == parse_ast("=3 + A1"))
+        assert (fold_constants(parse_ast("=IF(TRUE, A1, B1)"), wb.compiler) == a1)
+        assert (fold_constants(parse_ast("=IF(0, B1)"), wb.compiler) == Bool(False))
+        assert (fold_constants(parse_ast("=IFERROR(1/0, A1)"), wb.compiler) == a1)
+        assert (fold_constants(parse_ast("=CHOOSE(1+1, B1, A1)"), wb.compiler) == a1)
+        # Errors fold into error literals
+        folded = fold_constants(parse_ast("=1/0 + 1"), wb.compiler)
+        assert (isinstance(folded, Error))
+        assert (folded.error_type == CellErrorType.DIVIDE_BY_ZERO)
+        # Anything reading cells is left alone
+        for formula in ["=A1 + 1", "=INDIRECT(\"A1\")", "=IF(A1, 1, 2)",
+                        "=CHOOSE(5, A1, B1)"]:
+            ast = parse_ast(formula)
+            assert (fold_constants(ast, wb.compiler) == ast)
+        assert (isinstance(fold_constants(parse_ast("=ISBLANK(A1)"), wb.compiler), Call))
+
+    def test_folded_formulas_evaluate_the_same(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "4")
+        wb.set_cell_contents(name, "B1", "hello")
+        formulas = ["=1+2*3", "=\"a\" & 1 & TRUE", "=IF(TRUE, A1, B1)",
+                    "=IF(\"x\", A1)", "=IF(FALSE, A1)", "=IFERROR(#REF!, B1)",
+                    "=IFERROR(2)", "=CHOOSE(2, A1, B1 & \"!\")", "=CHOOSE(3, A1, B1)",
+                    "=1/0", "=2 * (3 > 2) + A1", "=AND(TRUE, 1) & B1",
+                    "=FOO(1) + 1", "=MAX(1, 2, 3) / A1", "=-\"x\""]
+        for formula in formulas:
+            ast = parse_ast(formula)
+            wb.context.new_parsing(name)
+            expected = wb.compiler.compile(ast)(wb.context)
+            wb.context.new_parsing(name)
+            actual = wb.compiler.compile(fold_constants(ast, wb.compiler))(wb.context)
+            if isinstance(expected, CellError):
+                assert (isinstance(actual, CellError))
+                assert (actual.get_type() == expected.get_type())
+            else:
+                assert (actual == expected)
+
+    def test_folding_drops_untaken_branches(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "C1", "=IF(TRUE, A1, B1)")
+        wb.set_cell_contents(name, "C2", "=1/0")
+        wb.set_cell_contents(name, "A1", "5")
+        cells = wb.sheets[0].get_cells()
+        assert (wb._static_parent_cells(cells["C1"]) == {("sheet1", "A1")})
+        assert (wb.get_cell_value(name, "C1") == Decimal(5))
+        assert (wb.get_cell_value(name, "C2").get_type() == CellErrorType.DIVIDE_BY_ZERO)
+
+    def test_folding_leaves_failing_calls_alone(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        # SUM("x") fails when evaluated, but the branch is never taken
+        ast = parse_ast("=IF(A1, SUM(\"x\"), 1)")
+        assert (fold_constants(ast, wb.compiler) == ast)
+        wb.set_cell_contents(name, "B1", "=IF(A1, SUM(\"x\"), 1)")
+        assert (wb.get_cell_value(name, "B1") == Decimal(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,324 @@
+import context
+from sheets.workbook import Workbook
+from sheets.graph import DependencyGraph
+from sheets.range_index import RangeIndex
+from sheets.cellerror import CellError
+from sheets.cellerrortype import CellErrorType
+
+import random
+import unittest
+from decimal import Decimal
+
+# Test Suite for the workbook dependency graph
+
+
+class GraphTests(unittest.TestCase):
+    def test_edges_are_updated_incrementally(self):
+        graph = DependencyGraph()
+        graph.set_parents(("s", "C1"), {("s", "A1"), ("s", "B1")})
+        graph.set_parents(("s", "D1"), {("s", "A1")})
+        assert (graph.children(("s", "A1")) == {("s", "C1"), ("s", "D1")})
+        assert (graph.parents(("s", "C1")) == {("s", "A1"), ("s", "B1")})
+
+        # Only gaining a parent is reported
+        assert (not graph.set_parents(("s", "C1"), {("s", "A1")}))
+        assert (graph.set_parents(("s", "C1"), {("s", "A1"), ("t", "E5")}))
+        assert (("s", "B1") not in graph)
+        assert (graph.keys_in_sheet("t") == {("t", "E5")})
+
+        # Keys without edges are dropped and their ids reused
+        graph.set_parents(("s", "C1"), ())
+        graph.set_parents(("s", "D1"), ())
+        assert (len(graph) == 0)
+        assert (graph.keys_in_sheet("t") == set())
+        graph.set_parents(("s", "X1"), {("s", "Y1")})
+        assert (len(graph._keys) == 4)
+
+    def test_recalc_order(self):
+        graph = DependencyGraph()
+        graph.set_parents(("s", "B1"), {("s", "A1")})
+        graph.set_parents(("s", "C1"), {("s", "A1"), ("s", "B1")})
+        graph.set_parents(("s", "D1"), {("s", "C1")})
+        graph.set_parents(("s", "Z1"), {("s", "Y1")})
+        order, cyclic = graph.recalc_order([("s", "A1")])
+        assert (order == [("s", "A1"), ("s", "B1"), ("s", "C1"), ("s", "D1")])
+        assert (cyclic == set())
+        assert (graph.recalc_order([("s", "Q1")]) == ([("s", "Q1")], set()))
+
+        # Cells on a cycle have no order; the cells after it still do
+        graph.set_parents(("s", "A1"), {("s", "C1")})
+        order, cyclic = graph.recalc_order([("s", "B1")])
+        assert (order == [("s", "D1")])
+        assert (cyclic == {("s", "A1"), ("s", "B1"), ("s", "C1")})
+        # The cycle is known from the clusters, without looking for it
+        assert (graph.get_stats()["scc_passes"] == 0)
+
+    def test_topological_order_is_maintained(self):
+        graph = DependencyGraph()
+        keys = [("s", f"A{i}") for i in range(1, 13)]
+        rng = random.Random(1)
+        for _ in range(300):
+            graph.set_parents(rng.choice(keys), rng.sample(keys, rng.randint(0, 3)))
+            for key in keys:
+                for child in graph.children(key):
+                    parent_id, child_id = graph._ids[key], graph._ids[child]
+                    if child_id in graph._cluster.get(parent_id, ()):
+                        # The keys of a cluster share their place
+                        assert (graph._order[parent_id] == graph._order[child_id])
+                    else:
+                        assert (graph._order[parent_id] < graph._order[child_id])
+
+    def test_clusters_split_when_the_cycle_breaks(self):
+        graph = DependencyGraph()
+        graph.set_parents(("s", "B1"), {("s", "A1")})
+        graph.set_parents(("s", "C1"), {("s", "B1")})
+        graph.set_parents(("s", "A1"), {("s", "C1")})
+        assert (graph.get_stats()["cyclic"] == 3)
+        assert (graph.take_uncycled() == set())
+        graph.set_parents(("s", "B1"), ())
+        assert (graph.get_stats()["cyclic"] == 0)
+        assert (graph.take_uncycled() == {("s", "A1"), ("s", "B1"), ("s", "C1")})
+        assert (graph.take_uncycled() == set())
+        order, cyclic = graph.recalc_order([("s", "B1")])
+        assert (order == [("s", "B1"), ("s", "C1"), ("s", "A1")])
+        assert (cyclic == set())
+
+        # A cell referencing itself
+        graph.set_parents(("s", "D1"), {("s", "D1")})
+        assert (graph.recalc_order([("s", "D1")]) == ([], {("s", "D1")}))
+        graph.set_parents(("s", "D1"), ())
+        assert (("s", "D1") not in graph)
+
+    def test_strongly_connected_components(self):
+        graph = DependencyGraph()
+        # Two cycles joined by an edge, and a cell after each of them
+        for child, parents in [("A1", {"B1"}), ("B1", {"A1"}), ("C1", {"B1", "D1"}),
+                               ("D1", {"C1"}), ("E1", {"D1"}), ("F1", {"A1"})]:
+            graph.set_parents(("s", child), {("s", parent) for parent in parents})
+        graph.reset_stats()
+        order, cyclic = graph.recalc_order([("s", "A1")])
+        assert (cyclic == {("s", "A1"), ("s", "B1"), ("s", "C1"), ("s", "D1")})
+        assert (set(order) == {("s", "E1"), ("s", "F1")})
+        stats = graph.get_stats()
+        assert (stats["recalcs"] == 1 and stats["recalc_visits"] == 6)
+        assert (stats["scc_passes"] == 0)
+
+        # Removing an edge within a cluster only splits that cluster
+        graph.set_parents(("s", "D1"), {("s", "A1")})
+        stats = graph.get_stats()
+        assert (stats["scc_passes"] == 1 and stats["scc_visits"] == 2)
+        order, cyclic = graph.recalc_order([("s", "A1")])
+        assert (cyclic == {("s", "A1"), ("s", "B1")})
+        assert (order.index(("s", "D1")) < order.index(("s", "C1")))
+        assert (order.index(("s", "D1")) < order.index(("s", "E1")))
+
+    def test_clusters_merge_through_other_clusters(self):
+        graph = DependencyGraph()
+        # A cycle of A1 and B1, read by C1, and D1 reading B1: an edge from
+        # D1 to C1 closes a cycle that goes through the first one
+        graph.set_parents(("s", "D1"), {("s", "B1")})
+        graph.set_parents(("s", "C1"), {("s", "X1")})
+        graph.set_parents(("s", "A1"), {("s", "B1"), ("s", "C1")})
+        graph.set_parents(("s", "B1"), {("s", "A1")})
+        assert (graph.recalc_order([("s", "X1")])[1] == {("s", "A1"), ("s", "B1")})
+        graph.set_parents(("s", "C1"), {("s", "X1"), ("s", "D1")})
+        order, cyclic = graph.recalc_order([("s", "X1")])
+        assert (order == [("s", "X1")])
+        assert (cyclic == {("s", "A1"), ("s", "B1"), ("s", "C1"), ("s", "D1")})
+
+    def test_cells_taken_off_a_cycle_are_computed(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        # C1 is on a cycle with A1, which is also on one with B1
+        wb.set_cell_contents(name, "B1", "=A1")
+        wb.set_cell_contents(name, "C1", "=IFERROR(A1, 5)")
+        wb.set_cell_contents(name, "A1", "=B1 + C1")
+        assert (wb.get_cell_value(name, "C1").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+        # A1 keeps its error, but C1 only reads it now
+        wb.set_cell_contents(name, "A1", "=B1")
+        assert (wb.get_cell_value(name, "A1").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+        assert (wb.get_cell_value(name, "C1") == Decimal(5))
+
+    def test_breaking_a_cycle_only_visits_its_cluster(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {f"A{i}": f"=A{i + 1}" for i in range(1, 100)})
+        wb.set_cell_contents(name, "A100", "=A1")
+        wb.set_cells_contents(name, {f"B{i}": f"=B{i + 1}" for i in range(1, 100)})
+        wb.set_cell_contents(name, "B100", "=B1")
+        wb.graph.reset_stats()
+        wb.set_cell_contents(name, "A100", "1")
+        stats = wb.graph.get_stats()
+        assert (stats["scc_passes"] == 1 and stats["scc_visits"] == 100)
+        assert (stats["recalc_visits"] == 100)
+        assert (wb.get_cell_value(name, "A1") == Decimal(1))
+        assert (wb.get_cell_value(name, "B1").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+
+    def test_cells_after_a_cycle_read_its_error(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "B1", "=IFERROR(A1, \"cycle\")")
+        wb.set_cell_contents(name, "A1", "=A2")
+        wb.set_cell_contents(name, "A2", "=A1")
+        assert (wb.get_cell_value(name, "A2").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+        assert (wb.get_cell_value(name, "B1") == "cycle")
+
+    def test_references_to_missing_sheets_and_cells(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=Data!B2 + C3")
+        assert (wb.get_cell_value(name, "A1").get_type() == CellErrorType.BAD_REFERENCE)
+        # Empty cells are not created for the references
+        assert ("C3" not in wb.get_sheet(name).get_cells())
+
+        wb.new_sheet("Data")
+        assert (wb.get_cell_value(name, "A1") == Decimal(0))
+        wb.set_cell_contents("Data", "B2", "5")
+        wb.set_cell_contents(name, "C3", "2")
+        assert (wb.get_cell_value(name, "A1") == Decimal(7))
+
+        wb.del_sheet("Data")
+        assert (wb.get_cell_value(name, "A1").get_type() == CellErrorType.BAD_REFERENCE)
+        assert (wb.graph.keys_in_sheet("data") == {("data", "B2")})
+
+    def test_formulas_referencing_missing_sheets_are_bad_references(self):
+        # Whatever the formula does with the reference, e.g. in IFERROR or
+        # next to another error
+        for calc_mode in ("automatic", "lazy"):
+            wb = Workbook(calc_mode=calc_mode)
+            wb.new_sheet("Sheet1")
+            wb.new_sheet("Sheet3")
+            wb.set_cell_contents("Sheet1", "D1", "1")
+            wb.set_cell_contents("Sheet1", "A1", "=IFERROR(Sheet4!B4, 5)")
+            wb.set_cell_contents("Sheet1", "A2", '="x" * 1 + Sheet4!B4')
+            wb.set_cell_contents("Sheet1", "A3", '=D1 / "x" * IF(Sheet3!B3 > 1, "x", 1)')
+            wb.set_cell_contents("Sheet1", "A4", "=IF(TRUE, 1, Sheet4!B4)")
+            for loc in ("A1", "A2"):
+                assert (wb.get_cell_value("Sheet1", loc).get_type() == CellErrorType.BAD_REFERENCE)
+            assert (wb.get_cell_value("Sheet1", "A3").get_type() == CellErrorType.TYPE_ERROR)
+            # A reference that is not evaluated does not count
+            assert (wb.get_cell_value("Sheet1", "A4") == Decimal(1))
+
+            wb.del_sheet("Sheet3")
+            assert (wb.get_cell_value("Sheet1", "A3").get_type() == CellErrorType.BAD_REFERENCE)
+            wb.new_sheet("Sheet4")
+            assert (wb.get_cell_value("Sheet1", "A1") is None)
+            assert (wb.get_cell_value("Sheet1", "A2").get_type() == CellErrorType.TYPE_ERROR)
+            wb.set_cell_contents("Sheet4", "B4", "#DIV/0!")
+            assert (wb.get_cell_value("Sheet1", "A1") == Decimal(5))
+            wb.rename_sheet("Sheet1", "Sheet3")
+            assert (wb.get_cell_value("Sheet3", "A3").get_type() == CellErrorType.TYPE_ERROR)
+
+    def test_rename_sheet_updates_references_to_empty_cells(self):
+        wb = Workbook()
+        wb.new_sheet("Sheet1")
+        wb.new_sheet("Sheet2")
+        wb.set_cell_contents("Sheet2", "A1", "=Sheet1!B5 + 1")
+        wb.set_cell_contents("Sheet1", "A1", "=Sheet1!A2 * 2")
+        wb.set_cell_contents("Sheet1", "A2", "4")
+        wb.rename_sheet("Sheet1", "Totals")
+        assert (wb.get_cell_contents("Sheet2", "A1") == "=Totals!B5 + 1")
+        assert (wb.get_cell_contents("Totals", "A1") == "=Totals!A2 * 2")
+        assert (wb.graph.keys_in_sheet("sheet1") == set())
+        wb.set_cell_contents("Totals", "B5", "2")
+        assert (wb.get_cell_value("Sheet2", "A1") == Decimal(3))
+        assert (wb.get_cell_value("Totals", "A1") == Decimal(8))
+
+    def test_cycles(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=B1")
+        wb.set_cell_contents(name, "B1", "=C1 + 1")
+        wb.set_cell_contents(name, "D1", "=B1 * 2")
+        wb.set_cell_contents(name, "C1", "=A1")
+        for loc in ["A1", "B1", "C1", "D1"]:
+            value = wb.get_cell_value(name, loc)
+            assert (isinstance(value, CellError))
+            assert (value.get_type() == CellErrorType.CIRCULAR_REFERENCE)
+
+        # Breaking the cycle recomputes all of it
+        wb.set_cell_contents(name, "C1", "1")
+        assert (wb.get_cell_value(name, "A1") == Decimal(2))
+        assert (wb.get_cell_value(name, "D1") == Decimal(4))
+
+    def test_only_dependents_are_recomputed(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        for i in range(1, 101):
+            wb.set_cell_contents(name, f"B{i}", f"=A1 + {i}")
+        wb.set_cell_contents(name, "C1", "=A2")
+        evaluated = []
+        evaluate = wb._evaluate_formula
+        wb._evaluate_formula = lambda cell: evaluated.append(cell) or evaluate(cell)
+        wb.set_cell_contents(name, "A2", "3")
+        assert (len(evaluated) == 1)
+        assert (wb.get_cell_value(name, "C1") == Decimal(3))
+
+    def test_range_index(self):
+        index = RangeIndex()
+        index.add("column", 1, 1, 9999, 1)
+        index.add("block", 3, 1, 6, 4)
+        index.add("row", 5, 1, 5, 475254)
+        assert (sorted(index.covering(1, 1)) == ["column"])
+        assert (sorted(index.covering(5, 1)) == ["block", "column", "row"])
+        assert (sorted(index.covering(6, 4)) == ["block"])
+        assert (index.covering(7, 4) == [])
+        assert (index.covering(5, 475254) == ["row"])
+        index.remove("block", 3, 1, 6, 4)
+        assert (sorted(index.covering(5, 1)) == ["column", "row"])
+        assert (len(index) == 2)
+
+    def test_ranges_are_single_keys(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        for i in range(1, 101):
+            wb.set_cell_contents(name, f"A{i}", str(i))
+        wb.set_cell_contents(name, "C1", "=SUM(A1:A9999)")
+        wb.set_cell_contents(name, "C2", "=C1 + MAX($A$1:A9999)")
+        assert (wb.graph.parents(("sheet1", "C1")) == {("sheet1", "A1:A9999")})
+        assert (len(wb.graph) == 3)
+        # A write finds the range covering the cell
+        assert (wb.graph.children(("sheet1", "A50")) == {("sheet1", "A1:A9999")})
+        wb.set_cell_contents(name, "A50", "1000")
+        assert (wb.get_cell_value(name, "C1") == Decimal(5050 + 950))
+        wb.set_cell_contents(name, "A500", "1")
+        assert (wb.get_cell_value(name, "C2") == Decimal(6001 + 1000))
+
+        wb.set_cell_contents(name, "C1", None)
+        wb.set_cell_contents(name, "C2", None)
+        assert (len(wb.graph) == 0)
+
+    def test_cells_in_a_range_are_ordered_before_it(self):
+        graph = DependencyGraph()
+        graph.set_parents(("s", "B1"), {("s", "A1:A3")})
+        graph.set_parents(("s", "A2"), {("s", "A1")})
+        graph.set_parents(("s", "C1"), {("s", "A3")})
+        # Only the cells of the range with edges of their own are linked to it
+        assert (graph.parents(("s", "A1:A3")) == {("s", "A1"), ("s", "A2"), ("s", "A3")})
+        order, cyclic = graph.recalc_order([("s", "A1")])
+        assert (order == [("s", "A1"), ("s", "A2"), ("s", "A1:A3"), ("s", "B1")])
+        # A cell reading a range it is in is on a cycle
+        graph.set_parents(("s", "A3"), {("s", "A1:A3")})
+        order, cyclic = graph.recalc_order([("s", "A1")])
+        assert (cyclic == {("s", "A3"), ("s", "A1:A3")})
+        assert (order[:2] == [("s", "A1"), ("s", "A2")])
+        assert (set(order[2:]) == {("s", "B1"), ("s", "C1")})
+        graph.set_parents(("s", "A3"), ())
+        graph.set_parents(("s", "C1"), ())
+        assert (graph.parents(("s", "A1:A3")) == {("s", "A1"), ("s", "A2")})
+
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "B1", "=SUM(A1:A3)")
+        wb.set_cell_contents(name, "A2", "=A1 * 10")
+        wb.set_cell_contents(name, "A1", "2")
+        assert (wb.get_cell_value(name, "B1") == Decimal(22))
+        wb.set_cell_contents(name, "A3", "=SUM(A1:A3)")
+        assert (wb.get_cell_value(name, "A3").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+        assert (isinstance(wb.get_cell_value(name, "B1"), CellError))
+        wb.set_cell_contents(name, "A3", "1")
+        assert (wb.get_cell_value(name, "B1") == Decimal(23))
+
+
+if __name__ == "__main__":
+    unittest.main()
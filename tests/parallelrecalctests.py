@@ -0,0 +1,193 @@
+import context
+import sheets.workbook
+from sheets.workbook import Workbook
+from sheets.graph import DependencyGraph
+from sheets.parallel_recalc import components, levels, part_reads
+from sheets.cellerrortype import CellErrorType
+
+import unittest
+from decimal import Decimal
+
+# Test Suite for parallel recalculation
+
+
+def count_parallel_recalcs(test, executors=None):
+    # Record the number of parts each parallel recalculation sends to workers,
+    # and the executors it sends them to in executors if given
+    calls = []
+    recalc_parts = sheets.workbook.recalc_parts
+
+    def counting_recalc_parts(executor, parser_mode, sheet_names, parts):
+        calls.append(len(parts))
+        if executors is not None:
+            executors.append(executor)
+        return recalc_parts(executor, parser_mode, sheet_names, parts)
+    sheets.workbook.recalc_parts = counting_recalc_parts
+    test.addCleanup(setattr, sheets.workbook, "recalc_parts", recalc_parts)
+    return calls
+
+
+def region_workbook(workers, threshold, reads_per_cell=0):
+    # A sheet of inputs read by three sheets of 30 cells each, each reading
+    # about 90 cells
+    wb = Workbook()
+    wb.recalc_workers = workers
+    wb.parallel_threshold = threshold
+    wb.parallel_reads_per_cell = reads_per_cell
+    wb.new_sheet("Inputs")
+    wb.set_cell_contents("Inputs", "A1", "1")
+    for region in ["North", "South", "East"]:
+        wb.new_sheet(region)
+        wb.set_cells_contents(region, {
+            "A1": "=Inputs!A1 * 2",
+            "B1": "=IF(A1 > 10, Other!A1, 0)",
+            **{f"A{i}": f"=A{i - 1} + Inputs!A1" for i in range(2, 30)},
+            "C1": "=SUM(A1:A29) + B1"})
+    return wb
+
+
+class ParallelRecalcTests(unittest.TestCase):
+    def test_components(self):
+        graph = DependencyGraph()
+        graph.set_parents(("s", "B1"), {("s", "A1")})
+        graph.set_parents(("s", "C1"), {("s", "B1")})
+        graph.set_parents(("s", "E1"), {("s", "D1")})
+        graph.set_parents(("s", "F1"), {("s", "A1"), ("s", "D1")})
+        keys = [("s", "B1"), ("s", "C1"), ("s", "E1"), ("s", "G1")]
+        assert (components(graph, keys) ==
+                [[("s", "B1"), ("s", "C1")], [("s", "E1")], [("s", "G1")]])
+        keys.append(("s", "F1"))
+        keys.append(("s", "A1"))
+        assert (sorted(map(len, components(graph, keys))) == [1, 1, 4])
+
+    def test_part_reads(self):
+        graph = DependencyGraph()
+        graph.set_parents(("s", "C1"), {("s", "A1"), ("s", "B1")})
+        graph.set_parents(("s", "C2"), {("s", "A1:B10")})
+        assert (part_reads(graph, [("s", "C1"), ("s", "C2")]) == 3)
+        assert (part_reads(graph, [("s", "C2"), ("s", "A1:B10")]) == 21)
+
+    def test_levels(self):
+        graph = DependencyGraph()
+        graph.set_parents(("s", "B1"), {("s", "A1")})
+        graph.set_parents(("s", "B2"), {("s", "A1")})
+        graph.set_parents(("s", "C1"), {("s", "B1:B2")})
+        graph.set_parents(("s", "C2"), {("s", "B2"), ("s", "A1")})
+        graph.set_parents(("s", "D1"), {("s", "C1"), ("s", "A1")})
+        order, _ = graph.recalc_order({("s", "A1")})
+        # The range is in the level of C1, which reads it
+        assert ([set(level) for level in levels(graph, order)] == [
+            {("s", "A1")}, {("s", "B1"), ("s", "B2")},
+            {("s", "B1:B2"), ("s", "C1"), ("s", "C2")}, {("s", "D1")}])
+
+    def test_level_widths(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        for i in range(2, 21):
+            wb.set_cell_contents(name, f"A{i}", "=A1 * 2")
+        wb.set_cell_contents(name, "B1", "=SUM(A2:A20)")
+        wb.set_cell_contents(name, "B2", "=B1 + A2")
+        assert (wb.get_level_widths(name, "a1") == [19, 1, 1])
+        assert (wb.get_level_widths(name, "B1") == [1])
+        assert (wb.get_level_widths(name, "C1") == [])
+
+    def test_wide_levels_are_computed_in_workers(self):
+        calls = count_parallel_recalcs(self)
+        workbooks = []
+        for workers in [3, 1]:
+            wb = Workbook()
+            wb.recalc_workers = workers
+            wb.parallel_threshold = 20
+            wb.parallel_reads_per_cell = 0
+            _, name = wb.new_sheet()
+            wb.set_cell_contents(name, "A1", "1")
+            # One connected part, of 40 cells reading A1 and 2 cells reading
+            # them
+            for i in range(1, 41):
+                wb.set_cell_contents(name, f"B{i}", f"=A1 * {i}")
+            wb.set_cell_contents(name, "C1", "=SUM(B1:B40)")
+            wb.set_cell_contents(name, "C2", "=B40 / A1")
+            changes = []
+            wb.notify_cells_changed(lambda _, cells: changes.append(set(cells)))
+            wb.set_cell_contents(name, "A1", "2")
+            wb.set_cell_contents(name, "A1", "0")
+            workbooks.append((wb, changes))
+        (wb, changes), (serial, serial_changes) = workbooks
+        # The 40 cells of the first level are split between the 3 workers;
+        # the 2 cells of the next one are computed in process
+        assert (calls == [3, 3])
+        assert (wb.get_cell_value(name, "C1") == Decimal(0))
+        assert (wb.get_cell_value(name, "C2").get_type() == CellErrorType.DIVIDE_BY_ZERO)
+        for i in range(1, 41):
+            assert (wb.get_cell_value(name, f"B{i}") == serial.get_cell_value(name, f"B{i}"))
+        assert (changes == serial_changes)
+
+    def test_levels_share_worker_processes(self):
+        executors = []
+        calls = count_parallel_recalcs(self, executors)
+        wb = Workbook()
+        wb.recalc_workers = 3
+        wb.parallel_threshold = 20
+        wb.parallel_reads_per_cell = 0
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cells_contents(name, {f"B{i}": f"=A1 * {i}" for i in range(1, 41)})
+        wb.set_cells_contents(name, {f"C{i}": f"=B{i} * 2" for i in range(1, 41)})
+        calls.clear()
+        executors.clear()
+        wb.set_cell_contents(name, "A1", "2")
+        # Both levels are wide, and are sent to the same processes
+        assert (calls == [3, 3])
+        assert (executors[0] is executors[1])
+        assert (wb.get_cell_value(name, "C40") == Decimal(160))
+
+    def test_parts_are_computed_in_workers(self):
+        calls = count_parallel_recalcs(self)
+        wb = region_workbook(2, 20)
+        serial = region_workbook(1, 20)
+        changes = []
+        wb.notify_cells_changed(lambda _, cells: changes.append(set(cells)))
+        serial_changes = []
+        serial.notify_cells_changed(lambda _, cells: serial_changes.append(set(cells)))
+        for workbook in [wb, serial]:
+            workbook.set_cell_contents("Inputs", "A1", "3")
+        assert (calls == [3])
+        for region in ["North", "South", "East"]:
+            for loc in ["A1", "A29", "B1", "C1"]:
+                assert (wb.get_cell_value(region, loc) == serial.get_cell_value(region, loc))
+        assert (wb.get_cell_value("East", "C1") == Decimal(6 * 29 + 3 * 28 * 29 // 2))
+        assert (changes == serial_changes)
+
+    def test_cells_reading_cells_the_worker_lacks(self):
+        calls = count_parallel_recalcs(self)
+        wb = region_workbook(2, 20)
+        wb.new_sheet("Other")
+        wb.set_cell_contents("Other", "A1", "100")
+        # B1 now reads Other!A1, which it did not read before
+        wb.set_cell_contents("Inputs", "A1", "6")
+        assert (calls == [3])
+        assert (wb.get_cell_value("North", "B1") == Decimal(100))
+        assert (wb.get_cell_value("North", "C1") == Decimal(12 * 29 + 6 * 28 * 29 // 2 + 100))
+
+    def test_small_parts_stay_in_process(self):
+        calls = count_parallel_recalcs(self)
+        wb = region_workbook(2, 200)
+        wb.set_cell_contents("Inputs", "A1", "2")
+        wb = region_workbook(1, 20)
+        wb.set_cell_contents("Inputs", "A1", "2")
+        # Nor are parts reading few cells for each of their cells
+        wb = region_workbook(2, 20, 10)
+        wb.set_cell_contents("Inputs", "A1", "2")
+        assert (calls == [])
+
+        # Nor are parts joined to a cycle sent to workers
+        wb = region_workbook(2, 20)
+        wb.set_cell_contents("North", "A1", "=Inputs!A1 * 2 + C1")
+        wb.set_cell_contents("Inputs", "A1", "5")
+        assert (calls == [2])
+        assert (wb.get_cell_value("North", "C1").get_type() == CellErrorType.CIRCULAR_REFERENCE)
+        assert (wb.get_cell_value("South", "A29") == Decimal(10 + 5 * 28))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+import context
+from sheets.workbook import Workbook
+from sheets.parse_cache import ParseCache
+from sheets.parsers import get_parser
+from sheets.cellerror import CellError
+from sheets.cellerrortype import CellErrorType
+import sheets.parsers as parsers
+from sheets.formula_ast import (to_ast, AddOp, Bool, Call, CellRange, CellRef,
+                                Compare, Concat, Error, MulOp, Number, String,
+                                UnaryOp)
+
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from decimal import Decimal
+
+# Test Suite for formula parsing
+
+
+class ParserTests(unittest.TestCase):
+    def test_parse_cache_hits_and_misses(self):
+        cache = ParseCache("lalr", max_size=8)
+        t1 = cache.parse("=A1 + 1")
+        t2 = cache.parse("=A1 + 1")
+        assert (t1 is t2)
+        assert (cache.get_hits() == 1)
+        assert (cache.get_misses() == 1)
+
+        cache.parse("=A1 + 2")
+        assert (cache.get_stats() == {"hits": 1, "misses": 2, "size": 2, "max_size": 8})
+
+        cache.clear()
+        assert (len(cache) == 0)
+        assert (cache.get_hits() == 0 and cache.get_misses() == 0)
+
+    def test_parse_cache_lru_eviction(self):
+        cache = ParseCache("lalr", max_size=2)
+        cache.parse("=1")
+        cache.parse("=2")
+        # Touch "=1" so that "=2" becomes the least recently used entry
+        cache.parse("=1")
+        cache.parse("=3")
+        assert ("=1" in cache)
+        assert ("=2" not in cache)
+        assert ("=3" in cache)
+        assert (len(cache) == 2)
+
+        cache.set_max_size(1)
+        assert (len(cache) == 1)
+        assert ("=3" in cache)
+        with self.assertRaises(ValueError):
+            cache.set_max_size(0)
+
+    def test_parse_errors_not_cached(self):
+        cache = ParseCache("lalr")
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                cache.parse("=1 +")
+        assert (len(cache) == 0)
+        assert (cache.get_misses() == 2)
+
+    def test_recalculation_reuses_cached_trees(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        for i in range(2, 21):
+            wb.set_cell_contents(name, f"A{i}", f"=A{i-1} + 1")
+
+        misses = Workbook.PARSE_CACHE.get_misses()
+        wb.set_cell_contents(name, "A1", "5")
+        # Every dependent formula was already parsed when it was set
+        assert (Workbook.PARSE_CACHE.get_misses() == misses)
+        assert (wb.get_cell_value(name, "A20") == Decimal("24"))
+
+    def test_parse_error_through_cache(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=1 +")
+        wb.set_cell_contents(name, "A2", "=1 +")
+        value = wb.get_cell_value(name, "A2")
+        assert (isinstance(value, CellError))
+        assert (value.get_type() == CellErrorType.PARSE_ERROR)
+
+    def test_lalr_and_earley_trees_match(self):
+        lalr, earley = get_parser("lalr"), get_parser("earley")
+        formulas = ["=A1 + B1 * -C1", "=(1 + 2) * 3", "=(A1 > 2)", "=A1 >= B1",
+                    "=\"a\" & A1 & \"b\"", "='My Sheet'!$A$1 / Sheet1!b2",
+                    "=SUM(A1:B3, 4)", "=IF(A1, B1)", "=VERSION()", "=#ref! + TRUE",
+                    "=IFERROR(Sheet1!A1:A2)", "=SUM(1 -2)", "=((A1))",
+                    "=Sheet1 ! A1", "=Sheet1 !A1", "=SUM(Sheet1 ! A1:B2)",
+                    "='My Sheet' ! A1", "=A1 != Sheet1 ! B1", "=A1 !=B1"]
+        for formula in formulas:
+            assert (lalr.parse(formula) == earley.parse(formula))
+
+    def test_parser_modes(self):
+        for mode in ["lalr", "earley"]:
+            wb = Workbook(mode)
+            assert (wb.parser_mode == mode)
+            _, name = wb.new_sheet()
+            wb.set_cell_contents(name, "A1", "4")
+            wb.set_cell_contents(name, "A2", "=A1 >= 4")
+            wb.set_cell_contents(name, "A3", "=SUM(A1, 2) & \"x\"")
+            assert (wb.get_cell_value(name, "A2") == True)
+            assert (wb.get_cell_value(name, "A3") == "6x")
+
+        with self.assertRaises(ValueError):
+            Workbook("cyk")
+
+    def test_lalr_rejects_leading_comma(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "hello")
+        wb.set_cell_contents(name, "A2", "=EXACT(, A1)")
+        value = wb.get_cell_value(name, "A2")
+        assert (isinstance(value, CellError))
+        assert (value.get_type() == CellErrorType.PARSE_ERROR)
+
+    def test_parsers_load_lazily_from_any_directory(self):
+        # Importing the package must not build a parser, and formulas must
+        # parse when the working directory is not the repository root
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(parsers.__file__)))
+        script = ("import sheets, sheets.parsers as p\n"
+                  "assert not p._parsers\n"
+                  "wb = sheets.Workbook()\n"
+                  "_, name = wb.new_sheet()\n"
+                  "wb.set_cell_contents(name, 'A1', '=1 + 2')\n"
+                  "assert wb.get_cell_value(name, 'A1') == 3\n"
+                  "assert list(p._parsers) == ['lalr']\n")
+        env = dict(os.environ, PYTHONPATH=package_dir)
+        with tempfile.TemporaryDirectory() as cwd:
+            subprocess.run([sys.executable, "-c", script], cwd=cwd, env=env, check=True)
+
+    def test_stale_serialized_parser_is_rebuilt(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            shutil.copy(os.path.join(parsers._DIR, "formulas_lalr.lark"), tmp)
+            path = os.path.join(tmp, "formulas_lalr.parser")
+            with open(path, "wb") as f:
+                pickle.dump("not the grammar digest", f)
+
+            package_dir = parsers._DIR
+            parsers._DIR = tmp
+            try:
+                parser = parsers._load_parser("lalr")
+            finally:
+                parsers._DIR = package_dir
+            assert (parser.parse("=A1 + 1") == get_parser("lalr").parse("=A1 + 1"))
+            with open(path, "rb") as f:
+                digest = pickle.load(f)
+            assert (digest == parsers._grammar_digest(parsers._read_grammar("lalr")))
+
+    def test_to_ast(self):
+        lalr = get_parser("lalr")
+        ast = to_ast(lalr.parse("=-(1.50 + $a1) * 'My Sheet'!B$2 >= 3"))
+        assert (ast == Compare(">=", MulOp("*", UnaryOp("-", AddOp(
+            "+", Number(Decimal("1.50")), CellRef(None, (1, 1, False, True)))),
+            CellRef("My Sheet", (2, 2, True, False))), Number(Decimal("3"))))
+
+        ast = to_ast(lalr.parse("=sum(A1:b2, \"x\", TRUE, #ref!) & (A1 = 2)"))
+        assert (ast == Concat(Call("SUM", (
+            CellRange(None, (1, 1, False, False), (2, 2, False, False)),
+            String("x"), Bool(True), Error(CellErrorType.BAD_REFERENCE, "#ref!"))),
+            Compare("=", CellRef(None, (1, 1, False, False)), Number(Decimal("2")))))
+        assert (to_ast(lalr.parse("=VERSION()")) == Call("VERSION", ()))
+
+    def test_ast_nodes_are_compact_and_immutable(self):
+        ast = to_ast(get_parser().parse("=A1 + 2"))
+        assert (not hasattr(ast, "__dict__"))
+        with self.assertRaises(AttributeError):
+            ast.op = "-"
+        assert (pickle.loads(pickle.dumps(ast)) == ast)
+        assert (hash(ast) == hash(to_ast(get_parser().parse("=A1+2"))))
+
+    def test_lalr_and_earley_asts_match(self):
+        formula = "=IF(Sheet1!A1 > 2, SUM(B1:B3), \"no\" & C1)"
+        assert (to_ast(get_parser("lalr").parse(formula)) ==
+                to_ast(get_parser("earley").parse(formula)))
+
+    def test_parse_many(self):
+        cache = ParseCache("lalr", max_size=64)
+        cache.parse("=A1 + 1")
+        formulas = ["=A1 + 1", "=B1 * 2", "=B1 * 2", "=1 +", "=SUM(C1:C3)"]
+        asts = cache.parse_many(formulas)
+        assert (set(asts) == {"=A1 + 1", "=B1 * 2", "=SUM(C1:C3)"})
+        assert (asts["=B1 * 2"] == to_ast(get_parser().parse("=B1 * 2")))
+        # Duplicates and cached formulas are not parsed again
+        assert (cache.get_hits() == 1 and cache.get_misses() == 4)
+        assert ("=SUM(C1:C3)" in cache and "=1 +" not in cache)
+
+    def test_parse_many_in_worker_processes(self):
+        formulas = [f"=IF(A{i} > {i}, \"x\" & B{i}, SUM(C{i}:D{i + 1}))" for i in range(1, 41)]
+        formulas.append("=)")
+        serial = ParseCache("lalr").parse_many(formulas, max_workers=1)
+        parallel = ParseCache("lalr").parse_many(formulas, max_workers=2, threshold=10)
+        assert (len(parallel) == 40)
+        assert (parallel == serial)
+
+    def test_bulk_operations_parse_each_template_once(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        for i in range(1, 51):
+            wb.set_cell_contents(name, f"A{i}", f"{i}")
+            wb.set_cell_contents(name, f"B{i}", f"=A{i} * 2")
+        wb.set_cell_contents(name, "C1", "=1 +")
+        wb.templates.clear()
+        _, copy_name = wb.copy_sheet(name)
+        # The B column is compiled once, and every cell is set from it
+        assert (len(wb.templates) == 1)
+        assert (wb.templates.get_hits() == 50)
+        assert (wb.get_cell_value(copy_name, "B50") == Decimal(100))
+        assert (wb.get_cell_value(copy_name, "C1").get_type() == CellErrorType.PARSE_ERROR)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import context
+from sheets.workbook import Workbook
+from sheets.formula_rewriter import (rename_sheet_references, shift_references,
+                                     quote_sheet_name)
+
+import unittest
+from decimal import Decimal
+
+# Test Suite for rewriting the references in formulas
+
+
+class RewriterTests(unittest.TestCase):
+    def test_quote_sheet_name(self):
+        assert (quote_sheet_name("Sheet1") == "Sheet1")
+        assert (quote_sheet_name("_data") == "_data")
+        assert (quote_sheet_name("My Sheet") == "'My Sheet'")
+        assert (quote_sheet_name("a.b") == "'a.b'")
+        assert (quote_sheet_name("1st") == "'1st'")
+
+    def test_rename_sheet_references(self):
+        assert (rename_sheet_references("=Sheet1!A1+sheet1!B2*A1", "Sheet1", "Data")
+                == "=Data!A1+Data!B2*A1")
+        assert (rename_sheet_references("= 'Sheet1' ! A1 >= 2", "sheet1", "My Sheet")
+                == "= 'My Sheet' ! A1 >= 2")
+        assert (rename_sheet_references("=SUM(Sheet1!A1:B2, Sheet2!C3)", "Sheet1", "S")
+                == "=SUM(S!A1:B2, Sheet2!C3)")
+        # Strings and other sheets are left alone
+        assert (rename_sheet_references("=\"Sheet1!A1\" & Sheet12!A1", "Sheet1", "S")
+                == "=\"Sheet1!A1\" & Sheet12!A1")
+
+    def test_shift_references(self):
+        assert (shift_references("=A1 + $B2*C$3 - $D$4", 1, 2)
+                == "=B3 + $B4*D$3 - $D$4")
+        assert (shift_references("=SUM(Sheet1!a1:b2,  'My Sheet'!C3)", 0, 1)
+                == "=SUM(Sheet1!a2:b3,  'My Sheet'!C4)")
+        assert (shift_references("=(A2 > B2)", 0, -1) == "=(A1 > B1)")
+        # Function names, sheet names and strings are not references
+        assert (shift_references("=LOG10(A1) & \"A1\" & A1!A1", 1, 0)
+                == "=LOG10(B1) & \"A1\" & A1!B1")
+        # References that leave the sheet become #REF!
+        assert (shift_references("=Sheet1!A1 + 1", 0, -1) == "=#REF! + 1")
+        assert (shift_references("=SUM(A1:A3)", -1, 0) == "=SUM(#REF!)")
+        assert (shift_references("=$A$1", -5, -5) == "=$A$1")
+
+    def test_rename_sheet_with_comparisons_and_ranges(self):
+        wb = Workbook()
+        _, n1 = wb.new_sheet()
+        _, n2 = wb.new_sheet()
+        wb.set_cell_contents(n1, "A1", "3")
+        wb.set_cell_contents(n1, "A2", "4")
+        wb.set_cell_contents(n2, "A1", "=(Sheet1!A1 < Sheet1!A2)")
+        wb.set_cell_contents(n2, "A2", "=SUM(Sheet1!A1:A2)")
+        wb.rename_sheet(n1, "Totals 2023")
+        assert (wb.get_cell_contents(n2, "A1") == "=('Totals 2023'!A1 < 'Totals 2023'!A2)")
+        assert (wb.get_cell_contents(n2, "A2") == "=SUM('Totals 2023'!A1:A2)")
+        assert (wb.get_cell_value(n2, "A1") == True)
+        assert (wb.get_cell_value(n2, "A2") == Decimal("7"))
+
+    def test_copy_cells_with_ranges(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        for i in range(1, 4):
+            wb.set_cell_contents(name, f"A{i}", f"{i}")
+            wb.set_cell_contents(name, f"B{i}", f"{10 * i}")
+        wb.set_cell_contents(name, "C1", "=SUM(A1:A3)")
+        wb.copy_cells(name, "C1", "C1", "D1")
+        assert (wb.get_cell_contents(name, "D1") == "=SUM(B1:B3)")
+        assert (wb.get_cell_value(name, "D1") == Decimal("60"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -188,7 +188,7 @@ class SetCellTests(unittest.TestCase):
         wb.new_sheet()
         wb.set_cell_contents("Sheet2", "A2", "2")
         wb.set_cell_contents("Sheet1", "A1", "=Sheet2!A2")
-        assert (wb.get_sheet("Sheet1").get_cell("A1").get_parent_cells() != [])
+        assert (wb.graph.parents(("sheet1", "A1")) == {("sheet2", "A2")})
         wb.del_sheet("Sheet2")
         assert (wb.get_cell_contents("Sheet1", "A1")
                 == "=Sheet2!A2")
@@ -226,5 +226,66 @@ class SetCellTests(unittest.TestCase):
         assert(value.get_type() == CellErrorType.BAD_REFERENCE)
 
 
+    def test_set_cells_contents(self):
+        wb = Workbook()
+        wb.new_sheet()
+        notifications = []
+        wb.notify_cells_changed(lambda _, cells: notifications.append(sorted(cells)))
+        cells = {f"a{i}": f"=A{i - 1} + 1" for i in range(2, 1001)}
+        cells["A1"] = "1"
+        cells["B1"] = "=SUM(A1:A1000)"
+        wb.set_cells_contents("sheet1", cells)
+        assert (wb.get_cell_value("Sheet1", "A1000") == Decimal(1000))
+        assert (wb.get_cell_value("Sheet1", "B1") == Decimal(500500))
+        assert (len(notifications) == 1)
+        assert (len(notifications[0]) == 1001)
+
+        wb.set_cells_contents("Sheet1", {"A1": "2", "C1": None, "B1": None})
+        assert (wb.get_cell_value("Sheet1", "A1000") == Decimal(1001))
+        assert (wb.get_cell_contents("Sheet1", "B1") is None)
+
+    def test_set_cells_contents_matches_single_writes(self):
+        cells = {"A1": "=B1", "C1": "=IF(A1>1,C1,5)"}
+        single = Workbook()
+        single.new_sheet()
+        single.set_cell_contents("Sheet1", "A1", "7")
+        for location, contents in cells.items():
+            single.set_cell_contents("Sheet1", location, contents)
+        bulk = Workbook()
+        bulk.new_sheet()
+        bulk.set_cell_contents("Sheet1", "A1", "7")
+        bulk.set_cells_contents("Sheet1", cells)
+        for location in ["A1", "C1"]:
+            assert (bulk.get_cell_value("Sheet1", location) ==
+                    single.get_cell_value("Sheet1", location))
+        assert (bulk.get_cell_value("Sheet1", "C1") == Decimal(5))
+
+    def test_set_cells_contents_checks_every_location_first(self):
+        wb = Workbook()
+        wb.new_sheet()
+        with self.assertRaises(ValueError):
+            wb.set_cells_contents("Sheet1", {"A1": "1", "ZZZZZ1": "2"})
+        with self.assertRaises(KeyError):
+            wb.set_cells_contents("Sheet2", {"A1": "1"})
+        assert (wb.get_sheet_extent("Sheet1") == (0, 0))
+
+    def test_set_region_contents(self):
+        wb = Workbook()
+        wb.new_sheet()
+        wb.set_region_contents("Sheet1", "b2", [
+            ["1", "=B2 * 2", "=C2 + B3"],
+            ["'text", None],
+            [],
+            ["=D2"]])
+        assert (wb.get_cell_value("Sheet1", "C2") == Decimal(2))
+        assert (wb.get_cell_value("Sheet1", "B3") == "text")
+        assert (wb.get_cell_value("Sheet1", "D2").get_type() == CellErrorType.TYPE_ERROR)
+        assert (wb.get_cell_value("Sheet1", "B5").get_type() == CellErrorType.TYPE_ERROR)
+        assert (wb.get_sheet_extent("Sheet1") == (4, 5))
+
+        with self.assertRaises(ValueError):
+            wb.set_region_contents("Sheet1", "A9999", [["1"], ["2"]])
+        assert (wb.get_cell_contents("Sheet1", "A9999") is None)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,130 @@
+import context
+from sheets import ThreadSafeWorkbook
+from sheets.workbook import Workbook
+from sheets.cellerrortype import CellErrorType
+
+import gc
+import threading
+import unittest
+from decimal import Decimal
+
+# Test Suite for workbook snapshots
+
+
+class SnapshotTests(unittest.TestCase):
+    def test_snapshot_is_a_point_in_time_view(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "A2", "=A1 * 2")
+        snapshot = wb.snapshot()
+        wb.set_cell_contents(name, "A1", "5")
+        wb.set_cell_contents(name, "A3", "new")
+        wb.set_cell_contents(name, "A2", "=A1 / 0")
+        assert (snapshot.get_cell_contents(name, "A1") == "1")
+        assert (snapshot.get_cell_value(name, "a2") == Decimal(2))
+        assert (snapshot.get_cell_contents(name, "A2") == "=A1 * 2")
+        assert (snapshot.get_cell_value(name, "A3") is None)
+        assert (wb.get_cell_value(name, "A2").get_type() == CellErrorType.DIVIDE_BY_ZERO)
+
+        # A later snapshot sees the changes before it only
+        later = wb.snapshot()
+        wb.set_cell_contents(name, "A1", "7")
+        assert (later.get_cell_contents(name, "A1") == "5")
+        assert (snapshot.get_cell_contents(name, "A1") == "1")
+        assert (later.get_version() > snapshot.get_version())
+
+    def test_sheets_of_a_snapshot(self):
+        wb = Workbook()
+        wb.new_sheet("Inputs")
+        wb.new_sheet("Model")
+        wb.set_cell_contents("Inputs", "A1", "3")
+        wb.set_cell_contents("Model", "A1", "=Inputs!A1 + 1")
+        snapshot = wb.snapshot()
+        wb.rename_sheet("Inputs", "Data")
+        wb.del_sheet("Data")
+        wb.new_sheet("Inputs")
+        wb.move_sheet("Inputs", 0)
+        assert (wb.get_cell_value("Model", "A1").get_type() == CellErrorType.BAD_REFERENCE)
+        assert (snapshot.list_sheets() == ["Inputs", "Model"])
+        assert (snapshot.num_sheets() == 2)
+        assert (snapshot.get_cell_value("inputs", "A1") == Decimal(3))
+        assert (snapshot.get_cell_value("Model", "A1") == Decimal(4))
+        assert (snapshot.get_cell_contents("Model", "A1") == "=Inputs!A1 + 1")
+        with self.assertRaises(KeyError):
+            snapshot.get_cell_value("Data", "A1")
+        with self.assertRaises(ValueError):
+            snapshot.get_cell_value("Model", "ZZZZZ1")
+
+    def test_snapshot_in_lazy_mode(self):
+        wb = Workbook(calc_mode="lazy")
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "2")
+        wb.set_cell_contents(name, "A2", "=A1 * 3")
+        # The out of date cells are computed for the snapshot
+        snapshot = wb.snapshot()
+        wb.set_cell_contents(name, "A1", "4")
+        assert (snapshot.get_cell_value(name, "A2") == Decimal(6))
+        assert (wb.get_cell_value(name, "A2") == Decimal(12))
+
+        wb.set_calc_mode("manual")
+        wb.set_cell_contents(name, "A1", "5")
+        snapshot = wb.snapshot()
+        wb.recalculate()
+        assert (snapshot.get_cell_value(name, "A2") == Decimal(12))
+        assert (wb.get_cell_value(name, "A2") == Decimal(15))
+
+    def test_old_versions_are_reclaimed(self):
+        wb = Workbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "1")
+        for i in range(2, 11):
+            wb.set_cell_contents(name, f"A{i}", f"=A{i - 1} + 1")
+        # Without snapshots no versions are kept
+        wb.set_cell_contents(name, "A1", "2")
+        assert (wb._history == {})
+
+        first = wb.snapshot()
+        wb.set_cell_contents(name, "A1", "3")
+        wb.set_cell_contents(name, "A1", "4")
+        # One old state per cell, however many times it changed
+        assert (len(wb._history) == 10)
+        assert (all(len(states) == 1 for states in wb._history.values()))
+        second = wb.snapshot()
+        wb.set_cell_contents(name, "A1", "5")
+        assert (first.get_cell_value(name, "A10") == Decimal(11))
+        assert (second.get_cell_value(name, "A10") == Decimal(13))
+
+        with first:
+            pass
+        wb.set_cell_contents(name, "B1", "1")
+        assert (all(len(states) == 1 for states in wb._history.values()))
+        assert (second.get_cell_value(name, "A10") == Decimal(13))
+        del second
+        gc.collect()
+        wb.set_cell_contents(name, "B1", "2")
+        assert (wb._history == {})
+        assert (wb._snapshots == {})
+
+    def test_snapshots_are_read_while_writers_hold_the_workbook(self):
+        wb = ThreadSafeWorkbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "1")
+        wb.set_cell_contents(name, "A2", "=A1 + 1")
+        snapshot = wb.snapshot()
+        seen = []
+        with wb.batch():
+            wb.set_cell_contents(name, "A1", "10")
+            # The batch holds the lock, but the snapshot is read without it
+            reading = threading.Thread(target=lambda: seen.append(
+                snapshot.get_cell_value(name, "A2")))
+            reading.start()
+            reading.join(5)
+            assert (not reading.is_alive())
+        assert (seen == [Decimal(2)])
+        assert (wb.get_cell_value(name, "A2") == Decimal(11))
+        assert (snapshot.get_cell_value(name, "A2") == Decimal(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
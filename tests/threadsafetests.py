@@ -0,0 +1,177 @@
+import context
+from sheets import ThreadSafeWorkbook
+from sheets.workbook import Workbook
+from sheets.rwlock import RWLock
+
+import os
+import tempfile
+import threading
+import unittest
+from decimal import Decimal
+
+# Test Suite for the thread-safe workbook and its readers-writer lock
+
+
+def run_threads(*targets):
+    # Run each target in a thread of its own and wait for all of them,
+    # raising the first error one of them raised
+    errors = []
+
+    def run(target):
+        try:
+            target()
+        except BaseException as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert (not any(thread.is_alive() for thread in threads))
+    if errors:
+        raise errors[0]
+
+
+class RWLockTests(unittest.TestCase):
+    def test_readers_share_the_lock(self):
+        lock = RWLock()
+        # Both readers must be in at once to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def read():
+            with lock.read():
+                barrier.wait()
+        run_threads(read, read)
+
+    def test_writers_hold_the_lock_alone(self):
+        lock = RWLock()
+        inside = []
+        overlaps = []
+
+        def write():
+            for _ in range(200):
+                with lock.write():
+                    inside.append(1)
+                    overlaps.append(len(inside))
+                    inside.pop()
+
+        def read():
+            for _ in range(200):
+                with lock.read():
+                    overlaps.append(len(inside))
+        run_threads(write, write, read, read)
+        assert (set(overlaps) == {0, 1})
+        assert (max(overlaps) == 1)
+
+    def test_waiting_writers_go_before_new_readers(self):
+        lock = RWLock()
+        order = []
+        lock.acquire_read()
+        writing = threading.Thread(target=lambda: (lock.acquire_write(),
+                                                   order.append("write"),
+                                                   lock.release_write()))
+        writing.start()
+        while not lock._waiting_writers:
+            pass
+        reading = threading.Thread(target=lambda: (lock.acquire_read(),
+                                                   order.append("read"),
+                                                   lock.release_read()))
+        reading.start()
+        lock.release_read()
+        writing.join(5)
+        reading.join(5)
+        assert (order == ["write", "read"])
+
+    def test_reentrancy(self):
+        lock = RWLock()
+        with lock.write():
+            with lock.write():
+                with lock.read():
+                    pass
+        with lock.read():
+            with lock.read():
+                with self.assertRaises(RuntimeError):
+                    lock.acquire_write()
+        with self.assertRaises(RuntimeError):
+            lock.release_read()
+        with self.assertRaises(RuntimeError):
+            lock.release_write()
+        # The lock is free again
+        run_threads(lambda: (lock.acquire_write(), lock.release_write()))
+
+
+class ThreadSafeWorkbookTests(unittest.TestCase):
+    def test_calls_are_atomic(self):
+        wb = ThreadSafeWorkbook()
+        _, name = wb.new_sheet()
+        wb.set_cells_contents(name, {f"A{i}": "0" for i in range(1, 51)})
+        wb.set_cell_contents(name, "B1", "=SUM(A1:A50)")
+        seen = []
+
+        def write():
+            for k in range(1, 30):
+                wb.set_cells_contents(name, {f"A{i}": str(k) for i in range(1, 51)})
+
+        def read():
+            for _ in range(300):
+                seen.append(wb.get_cell_value(name, "B1"))
+        run_threads(write, read, read)
+        # Every read sees all of the cells of a write, or none of them
+        assert (all(value % 50 == 0 for value in seen))
+        assert (wb.get_cell_value(name, "B1") == Decimal(29 * 50))
+
+    def test_lazy_reads(self):
+        wb = ThreadSafeWorkbook(Workbook(calc_mode="lazy"))
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "1")
+        for i in range(2, 101):
+            wb.set_cell_contents(name, f"A{i}", f"=A{i - 1} + 1")
+
+        def read():
+            for i in range(100, 0, -7):
+                assert (wb.get_cell_value(name, f"A{i}") == Decimal(i))
+        run_threads(read, read, read)
+
+    def test_batches_are_atomic(self):
+        wb = ThreadSafeWorkbook()
+        _, name = wb.new_sheet()
+        changes = []
+        wb.notify_cells_changed(lambda workbook, cells: changes.append(
+            workbook.get_cell_value(name, "A2")))
+        wb.begin_batch()
+        wb.set_cell_contents(name, "A1", "2")
+        seen = []
+        reading = threading.Thread(target=lambda: seen.append(wb.get_cell_value(name, "A2")))
+        reading.start()
+        wb.set_cell_contents(name, "A2", "=A1 * 3")
+        # The batch holds the lock: the other thread can only read after it
+        reading.join(0.2)
+        assert (reading.is_alive())
+        wb.commit_batch()
+        reading.join(5)
+        assert (seen == [Decimal(6)])
+        assert (changes == [Decimal(6)])
+        with self.assertRaises(ValueError):
+            wb.commit_batch()
+
+        with wb.batch():
+            wb.set_cell_contents(name, "A1", "5")
+        run_threads(lambda: seen.append(wb.get_cell_value(name, "A2")))
+        assert (seen[-1] == Decimal(15))
+
+    def test_save_and_load(self):
+        wb = ThreadSafeWorkbook()
+        _, name = wb.new_sheet()
+        wb.set_cell_contents(name, "A1", "=1 + 2")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "workbook.json")
+            with open(path, "w") as fp:
+                wb.save_workbook(fp)
+            loaded = ThreadSafeWorkbook.load_workbook(path)
+        assert (isinstance(loaded, ThreadSafeWorkbook))
+        assert (loaded.get_cell_value(name, "A1") == Decimal(3))
+        assert (loaded.list_sheets() == [name])
+
+
+if __name__ == "__main__":
+    unittest.main()
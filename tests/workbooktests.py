@@ -455,7 +455,7 @@ class WorkbookTests(unittest.TestCase):
 
         name3 = "My Sheet"
         wb.rename_sheet(name1, name3)
-        assert (wb.get_cell_contents(name2, "a1") == f"=(('{name3}'!a1)) * ((2))")
+        assert (wb.get_cell_contents(name2, "a1") == f"=(('{name3}'!a1))   *   ((2))")
 
     def test_rename_sheet_fixes_refs(self):
         wb = Workbook()
@@ -958,7 +958,7 @@ class WorkbookTests(unittest.TestCase):
         wb.set_cell_contents(n1, "B1", "=$B2")
         wb.set_cell_contents(n1, "B2", "1")
         wb.move_cells(n1, "A1", "B2", "B2")
-        assert(wb.get_cell_contents(n1, "B2") == "=B3 + C2")
+        assert(wb.get_cell_contents(n1, "B2") == "=B3+C2")
         assert(wb.get_cell_contents(n1, "B3") == "2")
         assert(wb.get_cell_contents(n1, "C2") == "=$B3")
         assert(wb.get_cell_contents(n1, "C3") == "1")